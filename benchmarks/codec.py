@@ -0,0 +1,103 @@
+"""
+Compares bx_encode and bx_decode with the loops they replaced.
+
+The loops convert one digit at a time, and bx_decode rebuilt its mapping
+on every call. bx_encode and bx_decode now look up the alphabet's shared
+codec, which converts a table entry of digits at a time. The codec is
+also timed on its own, as keygens hold it, to separate the conversion
+from the lookup. Keys of each length are timed separately, and times are
+relative to the loop.
+
+For example:
+   python benchmarks/codec.py --keys 10000 --alphabet hex
+"""
+
+import argparse
+import random
+import timeit
+
+from shorten import alphabets
+from shorten.key import bx_encode, bx_decode, get_codec
+
+ALPHABETS = {
+   'default': alphabets.DEFAULT,
+   'hex': alphabets.HEX,
+   'urlsafe': alphabets.URLSAFE,
+}
+
+def loop_encode(n, alphabet):
+   base = len(alphabet)
+
+   if n == 0:
+      return alphabet[0]
+
+   digits = []
+
+   while n > 0:
+      digits.append(alphabet[n % base])
+      n = n // base
+
+   digits.reverse()
+   return ''.join(digits)
+
+def loop_decode(string, alphabet, mapping=None):
+   mapping = mapping or dict([(d, i) for (i, d) in enumerate(alphabet)])
+   base = len(alphabet)
+   sum = 0
+
+   for digit in string:
+      sum = base*sum + mapping[digit]
+
+   return sum
+
+def best(func, repeat):
+   return min(timeit.repeat(func, number=1, repeat=repeat))
+
+def main():
+   parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+   parser.add_argument('--keys', type=int, default=10000)
+   parser.add_argument('--repeat', type=int, default=7)
+   parser.add_argument('--alphabet', choices=sorted(ALPHABETS),
+      default='default')
+   args = parser.parse_args()
+
+   alphabet = ALPHABETS[args.alphabet]
+   base = len(alphabet)
+
+   print('{0} keys per length, base {1}, best of {2}'.format(args.keys, base,
+      args.repeat))
+   print('{0:>6} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9}'.format('digits',
+      'loop enc', 'bx_encode', 'codec', 'loop dec', 'bx_decode', 'codec'))
+
+   codec = get_codec(alphabet)
+
+   for digits in (2, 4, 6, 8, 10):
+      ns = [random.randrange(base**(digits - 1), base**digits)
+         for i in range(0, args.keys)]
+      keys = [loop_encode(n, alphabet) for n in ns]
+
+      assert [bx_encode(n, alphabet) for n in ns] == keys
+      assert [bx_decode(key, alphabet) for key in keys] == ns
+
+      timings = [best(func, args.repeat) for func in (
+         lambda: [loop_encode(n, alphabet) for n in ns],
+         lambda: [bx_encode(n, alphabet) for n in ns],
+         lambda: [codec.encode(n) for n in ns],
+         lambda: [loop_decode(key, alphabet) for key in keys],
+         lambda: [bx_decode(key, alphabet) for key in keys],
+         lambda: [codec.decode(key) for key in keys])]
+
+      row = ['{0:>6}'.format(digits)]
+
+      # Each loop is followed by the times relative to it
+      for i, timing in enumerate(timings):
+         if i % 3 == 0:
+            loop = timing
+            row.append('{0:>7.1f}ms'.format(timing*1000))
+         else:
+            row.append('{0:>8.2f}x'.format(timing / loop))
+
+      print(' '.join(row))
+
+if __name__ == '__main__':
+   main()
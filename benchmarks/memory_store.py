@@ -0,0 +1,67 @@
+"""
+Compares the memory and lookup time of MemoryStore and DenseMemoryStore.
+
+Each store is filled with the same links while tracemalloc traces the
+allocations. The values are created beforehand, so only what the store
+keeps per link is counted. Lookups use freshly built key strings, whose
+hashes are not cached yet, spread uniformly over the store. Needs
+Python 3.4 or later, for tracemalloc.
+
+For example:
+   python benchmarks/memory_store.py --links 1000000
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from shorten import MemoryStore, DenseMemoryStore
+
+URL = 'https://example.com/articles/{0}'
+
+def measure(cls, values, lookups, min_length):
+   store = cls(min_length=min_length)
+
+   tracemalloc.start()
+
+   for val in values:
+      store.insert(val)
+
+   used = tracemalloc.get_traced_memory()[0]
+   tracemalloc.stop()
+
+   keygen = store._keygen
+   start = keygen.start
+   keys = [keygen.encode(start + i) for i in lookups]
+
+   began = time.time()
+
+   for key in keys:
+      store.get_value(key)
+
+   elapsed = time.time() - began
+
+   return used, elapsed
+
+def main():
+   parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+   parser.add_argument('--links', type=int, default=1000000)
+   parser.add_argument('--lookups', type=int, default=100000)
+   parser.add_argument('--min-length', type=int, default=4)
+   args = parser.parse_args()
+
+   values = [URL.format(i) for i in range(0, args.links)]
+   lookups = [random.randrange(0, args.links) for i in range(0, args.lookups)]
+
+   print('{0} links, {1} lookups'.format(args.links, args.lookups))
+
+   for cls in (MemoryStore, DenseMemoryStore):
+      used, elapsed = measure(cls, values, lookups, args.min_length)
+
+      print('{0:>16}: {1:>7.1f} bytes/link, {2:>6.0f} ns/lookup'.format(
+         cls.__name__, used / float(args.links),
+         elapsed / args.lookups * 1e9))
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,82 @@
+"""
+Compares the memory used by RedisStore and BucketedRedisStore.
+
+Each layout is filled with the same links in an empty database, and the
+growth of ``used_memory`` is reported per link. The database is flushed
+before and after each run, so never point this at a server holding real data.
+
+For example:
+   python benchmarks/redis_memory.py --links 1000000 --db 15
+"""
+
+import argparse
+
+import redis
+
+from shorten import RedisStore, BucketedRedisStore, UUIDTokenGenerator
+from shorten import NamespacedFormatter
+
+URL = 'https://example.com/articles/{0}'
+
+def used_memory(conn):
+   return conn.info('memory')['used_memory']
+
+def fill(store, links, chunk_size=1000):
+   for start in range(0, links, chunk_size):
+      stop = min(start + chunk_size, links)
+      store.insert_many([URL.format(i) for i in range(start, stop)],
+         chunk_size=chunk_size)
+
+def measure(conn, make_store, links):
+   conn.flushdb()
+   before = used_memory(conn)
+
+   fill(make_store(), links)
+
+   used = used_memory(conn) - before
+   keys = conn.dbsize()
+   conn.flushdb()
+
+   return used, keys
+
+def main():
+   parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+   parser.add_argument('--links', type=int, default=100000)
+   parser.add_argument('--bucket-size', type=int, default=100)
+   parser.add_argument('--uuid-tokens', action='store_true')
+   parser.add_argument('--host', default='localhost')
+   parser.add_argument('--port', type=int, default=6379)
+   parser.add_argument('--db', type=int, default=15)
+   args = parser.parse_args()
+
+   conn = redis.StrictRedis(host=args.host, port=args.port, db=args.db)
+
+   # Keep buckets in the compact encoding
+   conn.config_set('hash-max-ziplist-entries', max(128, args.bucket_size))
+   conn.config_set('hash-max-ziplist-value', 256)
+
+   kwargs = dict(
+      redis_client=conn,
+      counter_key='bench:counter',
+      formatter=NamespacedFormatter('bench'),
+      min_length=4)
+
+   if args.uuid_tokens:
+      kwargs['token_gen'] = UUIDTokenGenerator()
+
+   layouts = [
+      ('hash per link', lambda: RedisStore(**kwargs)),
+      ('bucketed', lambda: BucketedRedisStore(bucket_size=args.bucket_size,
+         token_buckets=max(1, args.links // args.bucket_size), **kwargs)),
+   ]
+
+   print('{0} links, bucket size {1}'.format(args.links, args.bucket_size))
+
+   for name, make_store in layouts:
+      used, keys = measure(conn, make_store, args.links)
+
+      print('{0:>14}: {1:>12} bytes, {2:>8.1f} bytes/link, {3} keys'.format(
+         name, used, used / float(args.links), keys))
+
+if __name__ == '__main__':
+   main()
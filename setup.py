@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 # Set __version__ in the namespace
-execfile('shorten/version.py')
+exec(open('shorten/version.py').read())
 
 try:
    from setuptools import setup
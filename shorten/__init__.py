@@ -1,5 +1,7 @@
 #from __future__ import absolute_import
 
+import sys
+
 #rom . import alphabets
 #rom . import key
 #rom . import token
@@ -7,9 +9,17 @@
 #rom . import formatter
 
 from .base import BaseStore, Pair
-from .memory_store import MemoryStore, MemoryKeygen
-from .redis_store import RedisStore, RedisKeygen
-from .memcache_store import MemcacheStore, MemcacheKeygen
+from .memory_store import MemoryStore, DenseMemoryStore, MemoryKeygen
+from .journal import Journal
+from .redis_store import RedisStore, BucketedRedisStore, RedisKeygen
+from .memcache_store import MemcacheStore, MemcacheRingStore, MemcacheKeygen
+from .scramble import ScrambledKeygen
+from .snowflake import SnowflakeKeygen
+from .pool import KeyPool
+from .tiered_store import TieredStore
+
+if sys.version_info >= (3, 6):
+   from .async_redis_store import AsyncRedisStore, AsyncRedisKeygen
 
 from .errors import KeyInsertError, TokenInsertError, RevokeError
 from .formatter import Formatter, NamespacedFormatter
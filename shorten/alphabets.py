@@ -1,4 +1,10 @@
 """\
+Alphabets are sequences of symbols used to encode keys. Any indexable 
+sequence can be used, as long as no symbol is a prefix of another. 
+:func:`get` validates an alphabet once and returns an immutable 
+:class:`Alphabet` with precomputed encoding and decoding tables, which is
+shared by every keygen using the same definition.
+
 :data HEX:                    lowercase hex digits
 
 :data DEFAULT:                the numbers 0-9 and letters a-Z
@@ -16,8 +22,346 @@
                               characters.
 """
 
+__all__ = ['Alphabet', 'Codec', 'get', 'HEX', 'DEFAULT', 'DISSIMILAR', 'URLSAFE',
+   'URLSAFE_DISSIMILAR']
+
 HEX = '0123456789abcdef'
 DEFAULT = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
 DISSIMILAR = '23456790ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
 URLSAFE = '0123456789ABCEDFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_~'
 URLSAFE_DISSIMILAR = '23456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz-_~'
+
+def _decode_digits(string, base, mapping):
+   sum = 0
+
+   for digit in string:
+      try:
+         sum = base*sum + mapping[digit]
+      except KeyError:
+         raise ValueError(
+            "invalid literal for bx_decode with base %i: '%s'" % (base, digit))
+
+   return sum
+
+class Codec(object):
+   """\
+   Encodes and decodes integers in base ``len(alphabet)``, like 
+   :func:`bx_encode` and :func:`bx_decode`, using lookup tables that are
+   computed once per alphabet. 
+
+   Each table entry holds :attr:`width` digits, so a key is converted 
+   :attr:`width` digits at a time. Tables hold ``len(alphabet) ** width``
+   entries, so widths larger than 2 should only be used for small alphabets.
+
+   ::
+
+      codec = Codec('0123456789abcdef')
+
+      # 'deadbeef'
+      codec.encode(0xdeadbeef)
+
+      # '00ff'
+      codec.encode(255, length=4)
+
+      # 255
+      codec.decode('00ff')
+
+   Codecs are usually shared through :class:`Alphabet` objects.
+
+   :param alphabet:     a 0-based iterable.
+   :param width:        the number of digits in each table entry.
+   """
+
+   def __init__(self, alphabet, width=2):
+      symbols = list(alphabet)
+      base = len(symbols)
+      width = max(1, width)
+
+      self.alphabet = alphabet
+      self.base = base
+      self.width = width
+      self.mapping = dict([(d, i) for (i, d) in enumerate(symbols)])
+
+      # Every combination of `width` digits, zero-padded
+      table = symbols
+      for i in range(1, width):
+         table = [a + b for a in table for b in symbols]
+
+      # The same values without leading zero-digits, for the most 
+      # significant entry of a key
+      head = [self._encode_digits(i) for i in range(0, len(table))]
+
+      self.chunk = base ** width
+      self._chunk2 = self.chunk ** 2
+      self._chunk3 = self.chunk ** 3
+      self._table = table
+      self._head = head
+      self._head_digits = [max(1, self._count_digits(i)) for i in 
+         range(0, len(table))]
+
+      # Single-character symbols can be decoded `width` characters at a time
+      lengths = set(len(sym) for sym in symbols)
+
+      if width > 1 and lengths == set([1]):
+         self._decode_table = dict([(d, i) for (i, d) in enumerate(table)])
+      else:
+         self._decode_table = None
+
+      # Multi-character symbols are matched longest first
+      if lengths - set([1]):
+         self._lengths = sorted(lengths, reverse=True)
+      else:
+         self._lengths = None
+
+   def _count_digits(self, n):
+      digits = 0
+      while n > 0:
+         n //= self.base
+         digits += 1
+
+      return digits
+
+   def _encode_digits(self, n):
+      if n == 0:
+         return self.alphabet[0]
+
+      digits = []
+      while n > 0:
+         n, r = divmod(n, self.base)
+         digits.append(self.alphabet[r])
+
+      digits.reverse()
+      return ''.join(digits)
+
+   def encode(self, n, length=None):
+      """\
+      Encodes :attr:`n`. If :attr:`length` is given, the result is padded 
+      with the zero-symbol to at least :attr:`length` digits.
+      """
+
+      if n < 0:
+         raise ValueError('a positive integer is required')
+
+      chunk = self.chunk
+      head = self._head
+
+      # Most keys fit in a few table entries, so avoid building a list
+      if n < chunk:
+         string = head[n]
+         entries = 0
+      elif n < self._chunk2:
+         n, r = divmod(n, chunk)
+         string = head[n] + self._table[r]
+         entries = 1
+      elif n < self._chunk3:
+         table = self._table
+         n, r = divmod(n, chunk)
+         n, r2 = divmod(n, chunk)
+         string = head[n] + table[r2] + table[r]
+         entries = 2
+      else:
+         table = self._table
+         parts = []
+
+         while n >= chunk:
+            n, r = divmod(n, chunk)
+            parts.append(table[r])
+
+         parts.append(head[n])
+         parts.reverse()
+
+         string = ''.join(parts)
+         entries = len(parts) - 1
+
+      if length is not None:
+         digits = entries * self.width + self._head_digits[n]
+
+         if digits < length:
+            string = self.alphabet[0] * (length - digits) + string
+
+      return string
+
+   def decode(self, string):
+      """\
+      Decodes :attr:`string` to an integer, raising a 
+      :class:`ValueError <ValueError>` if it contains symbols outside of the
+      alphabet.
+      """
+
+      if not string:
+         raise ValueError('string cannot be empty')
+
+      if self._lengths is not None:
+         return self._decode_symbols(string)
+
+      table = self._decode_table
+
+      if table is None:
+         return _decode_digits(string, self.base, self.mapping)
+
+      base = self.base
+      chunk = self.chunk
+      width = self.width
+      mapping = self.mapping
+
+      length = len(string)
+      head = length % width
+      sum = 0
+
+      try:
+         if head == 1:
+            sum = mapping[string[0]]
+         else:
+            for i in range(0, head):
+               sum = base*sum + mapping[string[i]]
+
+         # Most keys fit in a few table entries, so avoid the loop
+         entries = length // width
+
+         if entries == 1:
+            sum = chunk*sum + table[string[head:]]
+         elif entries == 2:
+            middle = head + width
+            sum = chunk*(chunk*sum + table[string[head:middle]]) + \
+               table[string[middle:]]
+         else:
+            for i in range(head, length, width):
+               sum = chunk*sum + table[string[i:i+width]]
+
+      except KeyError:
+         # Find the offending digit
+         return _decode_digits(string, base, mapping)
+
+      return sum
+
+   def _decode_symbols(self, string):
+      base = self.base
+      mapping = self.mapping
+      lengths = self._lengths
+
+      length = len(string)
+      i = 0
+      sum = 0
+
+      while i < length:
+         for n in lengths:
+            digit = mapping.get(string[i:i+n])
+
+            if digit is not None:
+               break
+         else:
+            raise ValueError(
+               "invalid literal for bx_decode with base %i: '%s'" % 
+               (base, string[i:]))
+
+         sum = base*sum + digit
+         i += n
+
+      return sum
+
+class Alphabet(tuple):
+   """\
+   An immutable, validated sequence of symbols. Symbols must be non-empty,
+   unique strings and no symbol may be a prefix of another (such as ``'0'`` 
+   and ``'00'``), otherwise keys could be decoded in more than one way.
+   A :class:`ValueError <ValueError>` is raised for invalid alphabets.
+
+   ::
+
+      emoticons = Alphabet((':)', ':(', ':D', ';)'))
+
+      # ':(:D'
+      emoticons.encode(6)
+
+      # 6
+      emoticons.decode(':(:D')
+
+   Use :func:`get` instead of creating alphabets directly, so that each 
+   definition is validated and compiled only once.
+
+   :param symbols:      an iterable of strings.
+   """
+
+   def __new__(cls, symbols):
+      self = tuple.__new__(cls, symbols)
+
+      if not self:
+         raise ValueError('alphabet cannot be empty')
+
+      seen = set()
+      for sym in self:
+         if not sym:
+            raise ValueError('alphabet contains an empty symbol')
+
+         if sym in seen:
+            msg = "alphabet contains duplicate symbol '{0}'".format(sym)
+            raise ValueError(msg)
+
+         seen.add(sym)
+
+      # A symbol that prefixes another sorts immediately before a symbol
+      # it prefixes
+      ordered = sorted(self)
+      for first, second in zip(ordered, ordered[1:]):
+         if second.startswith(first):
+            msg = "alphabet symbol '{0}' is a prefix of '{1}'".format(
+               first, second)
+            raise ValueError(msg)
+
+      self.codec = Codec(self)
+      self.mapping = self.codec.mapping
+      self.single = all(len(sym) == 1 for sym in self)
+
+      return self
+
+   def __reduce__(self):
+      return (get, (tuple(self),))
+
+   def __repr__(self):
+      return 'Alphabet({0})'.format(tuple.__repr__(self))
+
+   def encode(self, n, length=None):
+      """\
+      Encodes the integer :attr:`n` (see :meth:`Codec.encode`).
+      """
+      return self.codec.encode(n, length)
+
+   def decode(self, string):
+      """\
+      Decodes :attr:`string` to an integer (see :meth:`Codec.decode`).
+      """
+      return self.codec.decode(string)
+
+_compiled = {}
+
+def get(alphabet):
+   """\
+   Returns the :class:`Alphabet` for :attr:`alphabet`, validating and 
+   compiling it only the first time a definition is seen. 
+
+   ::
+
+      # True
+      get(DEFAULT) is get(DEFAULT)
+
+   :param alphabet:     an :class:`Alphabet` or an indexable sequence of
+                        symbols, such as a string.
+   """
+
+   if isinstance(alphabet, Alphabet):
+      return alphabet
+
+   try:
+      return _compiled[alphabet]
+   except KeyError:
+      pass
+   except TypeError:
+      # Unhashable definitions, such as lists, are cached by their symbols
+      return get(tuple(alphabet))
+
+   # Guard against unbounded growth with throwaway alphabets
+   if len(_compiled) > 64:
+      _compiled.clear()
+
+   compiled = _compiled[alphabet] = Alphabet(alphabet)
+   return compiled
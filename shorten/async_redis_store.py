@@ -0,0 +1,319 @@
+"""\
+Stores for :mod:`asyncio` applications, built on :mod:`redis.asyncio`
+(redis-py 4.2 or later). Requires Python 3.6.
+"""
+
+import asyncio
+
+from collections import deque
+
+from .base import BaseStore, FormattedPair, Pair
+
+from .key import CounterKeyGenerator
+from .formatter import Formatter, FormatterMixin
+from .token import TokenGenerator
+from .errors import KeyInsertError, TokenInsertError, RevokeError
+from .redis_store import INSERT_SCRIPT, KEY_EXISTS, TOKEN_EXISTS
+from .redis_store import ttl_milliseconds, _text
+
+__all__ = ['AsyncRedisKeygen', 'AsyncRedisStore']
+
+class AsyncRedisKeygen(CounterKeyGenerator):
+   """\
+   Creates keys in Redis with an asynchronous client, like
+   :class:`RedisKeygen <shorten.RedisKeygen>`. Leasing and striping work
+   the same way, but keys are awaited with :meth:`next_key` and
+   :meth:`next_n`, or iterated with ``async for``.
+
+   ::
+
+      keygen = AsyncRedisKeygen(redis_client=redis.asyncio.Redis(),
+         counter_key='counter', lease_size=100)
+
+      key = await keygen.next_key()
+
+   Coroutines sharing a keygen share its lease, and never receive the same
+   key. A keygen should only be used from one event loop.
+
+   :param redis_client:    a :class:`redis.asyncio.Redis` client. Sharing
+                           a store's client shares its connection pool.
+   :param counter_key:     the Redis key in which to store the keygen's
+                           counter value.
+   """
+
+   def __init__(self, redis_client=None, counter_key=None, **kwargs):
+      super(AsyncRedisKeygen, self).__init__(**kwargs)
+
+      if counter_key is None:
+         raise ValueError('a counter key is required')
+
+      if redis_client is None:
+         raise ValueError('a Redis client is required')
+
+      self.counter_key = counter_key
+      self.redis = redis_client
+
+      # Leased ranges of values, oldest first
+      self._leased = deque()
+      self._refill = None
+
+   async def _incr(self, counter_key, count):
+      if count == 1:
+         return await self.redis.incr(counter_key)
+
+      return await self.redis.incrby(counter_key, count)
+
+   async def _reserve(self, count):
+      stripe = self._take_stripe()
+      high = await self._incr(self.stripe_key(stripe), count)
+
+      return self._first_value(stripe, high, count), self.stripes
+
+   async def next_n(self, n):
+      """\
+      Reserves :attr:`n` counter values with a single increment and returns
+      their keys.
+      """
+
+      if n <= 0:
+         return []
+
+      first, step = await self._reserve(n)
+      return self._encode_values(first, step, n)
+
+   def _next_leased(self):
+      leased = self._leased
+
+      while leased:
+         for value in leased[0]:
+            return value
+
+         leased.popleft()
+
+      return None
+
+   async def next_key(self):
+      """\
+      Returns the next key, incrementing the counter when the lease is
+      used up. Only one coroutine increments the counter at a time; the 
+      others wait for its lease.
+      """
+
+      value = self._next_leased()
+
+      if value is None:
+         # Created lazily so that it belongs to the running loop
+         if self._refill is None:
+            self._refill = asyncio.Lock()
+
+         async with self._refill:
+            value = self._next_leased()
+
+            if value is None:
+               count = 1 if self.lease is None else self.lease.next_size()
+               first, step = await self._reserve(count)
+
+               self._leased.append(iter(range(first, first + count*step, 
+                  step)))
+
+               value = self._next_leased()
+
+      return self.encode(value)
+
+   async def _iter_keys(self):
+      while True:
+         yield await self.next_key()
+
+   def __aiter__(self):
+      return self._iter_keys()
+
+   def __iter__(self):
+      raise TypeError('use `async for` to iterate over an AsyncRedisKeygen')
+
+class AsyncRedisStore(BaseStore, FormatterMixin):
+   """\
+   Stores keys, tokens and data in Redis, like
+   :class:`RedisStore <shorten.RedisStore>`, but every operation is a
+   coroutine. Values, pairs and errors are the same as a
+   :class:`RedisStore <shorten.RedisStore>` with the same parameters.
+
+   ::
+
+      store = AsyncRedisStore(redis_client=redis.asyncio.Redis(),
+         counter_key='counter')
+
+      key, token = await store.insert('aardvark')
+
+      # 'aardvark'
+      await store.get_value(key)
+
+      await store.revoke(token)
+
+   If `key_gen` is `None`, an
+   :class:`AsyncRedisKeygen <shorten.async_redis_store.AsyncRedisKeygen>`
+   sharing the store's client is created with the `alphabet`, `min_length`,
+   `start`, `counter_key`, `lease_size`, `max_lease_size`,
+   `lease_interval`, `stripes` and `stripe` parameters (see
+   :class:`RedisStore <shorten.RedisStore>`).
+
+   :param redis_client:    a :class:`redis.asyncio.Redis` client.
+   :param key_gen:         an asynchronous key generator, or `None`.
+   """
+
+   def __init__(self, **kwargs):
+      redis_client = kwargs.pop('redis_client', None)
+      counter_key = kwargs.pop('counter_key', None)
+      alphabet = kwargs.pop('alphabet', None)
+      min_length = kwargs.pop('min_length', None)
+      start = kwargs.pop('start', None)
+      lease_size = kwargs.pop('lease_size', None)
+      max_lease_size = kwargs.pop('max_lease_size', None)
+      lease_interval = kwargs.pop('lease_interval', 1.0)
+      stripes = kwargs.pop('stripes', None)
+      stripe = kwargs.pop('stripe', None)
+      key_gen = kwargs.pop('key_gen', None)
+      formatter = kwargs.pop('formatter', None)
+      token_gen = kwargs.pop('token_gen', None)
+
+      if redis_client is None:
+         raise ValueError('a Redis client is required')
+
+      if key_gen is None:
+         key_gen = AsyncRedisKeygen(
+            redis_client=redis_client,
+            alphabet=alphabet,
+            counter_key=counter_key,
+            min_length=min_length,
+            start=start,
+            lease_size=lease_size,
+            max_lease_size=max_lease_size,
+            lease_interval=lease_interval,
+            stripes=stripes,
+            stripe=stripe)
+
+      # Asynchronous keygens cannot be iterated with `iter`, so the base
+      # class is not initialized
+      self._keygen = self.key_gen = key_gen
+      self.formatter = Formatter() if formatter is None else formatter
+      self.token_gen = TokenGenerator() if token_gen is None else token_gen
+      self.redis = redis_client
+
+      # Registered on the first insert with a TTL
+      self._expiring_insert_script = None
+
+   def __contains__(self, key):
+      raise TypeError('use `await store.has_key(key)`')
+
+   def __getitem__(self, key):
+      raise TypeError('use `await store.get_value(key)`')
+
+   def __delitem__(self, token):
+      raise TypeError('use `await store.revoke(token)`')
+
+   async def next_formatted_pair(self):
+      """\
+      Returns a :class:`FormattedPair <shorten.store.FormattedPair>` like
+      :meth:`BaseStore.next_formatted_pair`.
+      """
+
+      key = await self._keygen.next_key()
+      token = self.token_gen.create_token(key)
+
+      return FormattedPair(key, token, self.format_key(key),
+         self.format_token(token))
+
+   async def next_keys(self, n):
+      return await self._keygen.next_n(n)
+
+   async def get(self, key, default=None):
+      try:
+         return await self.get_value(key)
+      except KeyError:
+         return default
+
+   async def insert(self, val, ttl=None):
+      """\
+      Inserts a value and returns a :class:`Pair <shorten.Pair>`. If 
+      :attr:`ttl` is given, the key and token expire after that many 
+      seconds (see :meth:`RedisStore.insert <shorten.RedisStore.insert>`).
+      """
+
+      if ttl is not None:
+         return await self._insert_expiring(val, ttl)
+
+      key, token, formatted_key, formatted_token = \
+         await self.next_formatted_pair()
+
+      async with self.redis.pipeline(transaction=True) as p:
+         # Associate both the value and token with the key to
+         # allow `get_token(key)`
+         p.hsetnx(formatted_key, 'value', val)
+         p.hsetnx(formatted_key, 'token', token)
+         p.setnx(formatted_token, key)
+
+         results = await p.execute()
+
+      if not results[-2] or not results[-3]:
+         raise KeyInsertError(key, 'key exists')
+
+      if not results[-1]:
+         raise TokenInsertError(token, 'token exists')
+
+      return Pair(key, token)
+
+   async def _insert_expiring(self, val, ttl):
+      milliseconds = ttl_milliseconds(ttl)
+
+      if self._expiring_insert_script is None:
+         self._expiring_insert_script = \
+            self.redis.register_script(INSERT_SCRIPT)
+
+      key, token, formatted_key, formatted_token = \
+         await self.next_formatted_pair()
+
+      code = await self._expiring_insert_script(
+         keys=[formatted_key, formatted_token], 
+         args=[val, token, key, milliseconds])
+
+      if code == KEY_EXISTS:
+         raise KeyInsertError(key, 'key exists')
+
+      if code == TOKEN_EXISTS:
+         raise TokenInsertError(token, 'token exists')
+
+      return Pair(key, token)
+
+   async def revoke(self, token):
+      formatted_token = self.format_token(token)
+
+      async with self.redis.pipeline(transaction=True) as p:
+         await p.watch(formatted_token)
+         key = await p.get(formatted_token)
+
+         if key is None:
+            raise RevokeError(token, 'token not found')
+
+         formatted_key = self.format_key(_text(key))
+
+         p.multi()
+         p.delete(formatted_key, formatted_token)
+
+         await p.execute()
+
+   async def get_value(self, key):
+      key = self.format_key(key)
+      value = await self.redis.hget(key, 'value')
+
+      if value is None:
+         raise KeyError(key)
+
+      return value
+
+   async def has_key(self, key):
+      return bool(await self.redis.exists(self.format_key(key)))
+
+   async def has_token(self, token):
+      return bool(await self.redis.exists(self.format_token(token)))
+
+   async def get_token(self, key):
+      return await self.redis.hget(self.format_key(key), 'token')
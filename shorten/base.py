@@ -1,3 +1,5 @@
+from itertools import islice
+
 from .formatter import Formatter
 from .token import TokenGenerator
 
@@ -129,11 +131,14 @@ class BaseStore(object):
    """
 
    def __init__(self, key_gen=None, formatter=None, token_gen=None):
-      formatter = formatter or Formatter()
-      token_gen = token_gen or TokenGenerator()
-      key_gen = iter(key_gen)
+      if formatter is None:
+         formatter = Formatter()
+
+      if token_gen is None:
+         token_gen = TokenGenerator()
 
-      self.key_gen = key_gen   
+      self._keygen = key_gen
+      self.key_gen = iter(key_gen)
       self.token_gen = token_gen
       self.formatter = formatter
 
@@ -153,13 +158,50 @@ class BaseStore(object):
       Calling this method will always consume a key and token.
       """
 
-      key = self.key_gen.next()
+      key = next(self.key_gen)
       token = self.token_gen.create_token(key)
       fkey = self.formatter.format_key(key)
       ftoken = self.formatter.format_token(token)
 
       return FormattedPair(key, token, fkey, ftoken)
 
+   def next_keys(self, n):
+      """\
+      Returns a list of :attr:`n` keys. If the keygen implements 
+      :meth:`next_n <shorten.BaseKeyGenerator.next_n>`, the keys are 
+      generated in bulk.
+      """
+
+      next_n = getattr(self._keygen, 'next_n', None)
+
+      if next_n is not None:
+         try:
+            return next_n(n)
+         except NotImplementedError:
+            pass
+
+      return list(islice(self.key_gen, n))
+
+   def next_formatted_pairs(self, n):
+      """\
+      Returns a list of :attr:`n` 
+      :class:`FormattedPairs <shorten.store.FormattedPair>`, like 
+      :meth:`next_formatted_pair`.
+      """
+
+      create_token = self.token_gen.create_token
+      format_key = self.formatter.format_key
+      format_token = self.formatter.format_token
+
+      pairs = []
+
+      for key in self.next_keys(n):
+         token = create_token(key)
+         pairs.append(FormattedPair(key, token, format_key(key), 
+            format_token(token)))
+
+      return pairs
+
    def get(self, key, default=None):
       """\
       Get the value for :attr:`key` or :attr:`default` if the
@@ -201,6 +243,9 @@ class BaseStore(object):
             store.insert('bonobo')
          except (KeyInsertError, TokenInsertError):
             print('Cannot insert')
+
+      Stores that can expire pairs accept a `ttl` keyword argument, the 
+      number of seconds until the key and token are removed.
             
       """
 
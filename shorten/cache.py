@@ -0,0 +1,135 @@
+import time
+import threading
+
+from collections import OrderedDict
+
+__all__ = ['LocalCache']
+
+class LocalCache(object):
+   """\
+   A bounded, thread-safe, in-process cache with least-recently-used
+   eviction. Entries older than :attr:`max_age` seconds are never returned,
+   which bounds how stale a value can be if an invalidation is missed.
+
+   ::
+
+      cache = LocalCache(max_entries=10000, max_age=5.0)
+
+      generation = cache.generation
+      value = fetch_value(key)
+
+      # Not cached if `key` was invalidated since `generation` was read
+      cache.put(key, value, generation)
+
+   Reads race with invalidations: a value fetched just before it was
+   invalidated could be cached after the invalidation. Passing the
+   :attr:`generation` read before fetching to :meth:`put` drops such values.
+
+   :param max_entries:  the largest number of entries to keep.
+
+   :param max_age:      the number of seconds an entry may be returned for,
+                        or `None` to keep entries until they are evicted or
+                        invalidated.
+   """
+
+   def __init__(self, max_entries=10000, max_age=None, clock=time.time):
+      if max_entries < 1:
+         raise ValueError('the cache must hold at least one entry')
+
+      self.max_entries = max_entries
+      self.max_age = max_age
+      self.clock = clock
+
+      # Metrics
+      self.hits = 0
+      self.misses = 0
+
+      self.generation = 0
+
+      self._entries = OrderedDict()
+      self._lock = threading.Lock()
+
+   def __len__(self):
+      return len(self._entries)
+
+   def __contains__(self, key):
+      return self.get(key, self) is not self
+
+   def get(self, key, default=None):
+      """\
+      Returns the cached value of :attr:`key`, or :attr:`default` if it is
+      missing or too old.
+      """
+
+      with self._lock:
+         try:
+            value, expires = self._entries.pop(key)
+         except KeyError:
+            self.misses += 1
+            return default
+
+         if expires is not None and self.clock() >= expires:
+            self.misses += 1
+            return default
+
+         # Reinsert as the most recently used entry
+         self._entries[key] = (value, expires)
+         self.hits += 1
+
+         return value
+
+   def put(self, key, value, generation=None, max_age=None):
+      """\
+      Caches :attr:`value` for :attr:`key`, evicting the least recently
+      used entry if the cache is full. If :attr:`generation` is given and
+      any entry was invalidated since it was read, nothing is cached. If
+      :attr:`max_age` is given, the entry is returned for at most that many
+      seconds, even if the cache keeps entries for longer.
+      """
+
+      if max_age is None or (self.max_age is not None and
+            self.max_age < max_age):
+         max_age = self.max_age
+
+      if max_age is None:
+         expires = None
+      else:
+         expires = self.clock() + max_age
+
+      with self._lock:
+         if generation is not None and generation != self.generation:
+            return
+
+         entries = self._entries
+         entries.pop(key, None)
+         entries[key] = (value, expires)
+
+         if len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+   def invalidate(self, key):
+      """\
+      Removes :attr:`key` from the cache.
+      """
+
+      with self._lock:
+         self.generation += 1
+         self._entries.pop(key, None)
+
+   def clear(self):
+      """\
+      Removes every entry from the cache.
+      """
+
+      with self._lock:
+         self.generation += 1
+         self._entries.clear()
+
+   @property
+   def hit_ratio(self):
+      """\
+      The fraction of lookups that were hits, between 0 and 1.
+      """
+
+      lookups = self.hits + self.misses
+      return self.hits / float(lookups) if lookups else 0.0
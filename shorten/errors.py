@@ -1,10 +1,16 @@
+import sys
+
 def format_error(msg, key):
    if msg:
       msg = u'{msg}: {key}'.format(msg=msg, key=key)
    else:
-      msg = unicode(key)
+      msg = u'{0}'.format(key)
+
+   # `__str__` must return bytes in Python 2
+   if sys.version_info[0] < 3:
+      return msg.encode('utf-8')
 
-   return msg.encode('utf-8')
+   return msg
 
 class KeyInsertError(Exception):
    def __init__(self, key, msg=None):
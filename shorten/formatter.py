@@ -1,4 +1,20 @@
-__all__ = ['Formatter', 'NamespacedFormatter', 'FormatterMixin']
+__all__ = ['Formatter', 'NamespacedFormatter', 'FormatterMixin', 
+   'find_affixes']
+
+def find_affixes(format):
+   """\
+   Returns the prefix and suffix that the function :attr:`format` adds to
+   strings, or raises a :class:`ValueError <ValueError>` if it does 
+   anything else.
+   """
+
+   probe = 'shorten-probe'
+   prefix, found, suffix = format(probe).partition(probe)
+
+   if not found or format('0') != prefix + '0' + suffix:
+      raise ValueError('the formatter must only add a prefix and suffix')
+
+   return prefix, suffix
 
 class Formatter(object):  
    """\
@@ -37,6 +53,20 @@ class FormatterMixin(object):
       ftoken = self.formatter.format_token(pair.token)
       return (fkey, ftoken)
 
+   def key_affixes(self):
+      """\
+      Returns the prefix and suffix the formatter adds to keys (see 
+      :func:`find_affixes`).
+      """
+      return find_affixes(self.formatter.format_key)
+
+   def token_affixes(self):
+      """\
+      Returns the prefix and suffix the formatter adds to tokens (see 
+      :func:`find_affixes`).
+      """
+      return find_affixes(self.formatter.format_token)
+
 class NamespacedFormatter(object):
    """\
    Prefixes keys and tokens with `namespace` string.
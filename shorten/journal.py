@@ -0,0 +1,397 @@
+import os
+import mmap
+import struct
+import pickle
+
+from zlib import crc32
+from itertools import islice
+
+from .lock import Condition
+
+__all__ = ['Journal']
+
+# Record types
+INSERT = 'i'
+REVOKE = 'r'
+SNAPSHOT = 's'
+END = 'e'
+
+# Each record is framed by its length and checksum
+HEADER = struct.Struct('<II')
+
+# Snapshot records are pickled in chunks, which is much faster to load
+SNAPSHOT_CHUNK = 1024
+
+SNAPSHOT_NAME = 'snapshot'
+LOG_PREFIX = 'log.'
+
+def frame(record, protocol=2):
+   """\
+   Returns :attr:`record` pickled and framed by its length and checksum.
+   """
+
+   payload = pickle.dumps(record, protocol)
+   return HEADER.pack(len(payload), crc32(payload) & 0xffffffff) + payload
+
+def read_frames(path):
+   """\
+   Yields the records framed in the file at :attr:`path`, read through a
+   memory map. Reading stops at the first torn or corrupt frame, which can
+   only be the tail of a log that was being written during a crash.
+   """
+
+   with open(path, 'rb') as f:
+      size = os.fstat(f.fileno()).st_size
+
+      # Empty files cannot be mapped
+      if size == 0:
+         return
+
+      data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+      try:
+         offset = 0
+
+         while offset + HEADER.size <= size:
+            length, checksum = HEADER.unpack_from(data, offset)
+            start = offset + HEADER.size
+            offset = start + length
+
+            if offset > size:
+               return
+
+            payload = data[start:offset]
+
+            if crc32(payload) & 0xffffffff != checksum:
+               return
+
+            yield pickle.loads(payload)
+      finally:
+         data.close()
+
+def fsync_directory(path):
+   """\
+   Flushes a directory's entries, so that renames within it are durable.
+   Platforms that cannot open directories are skipped.
+   """
+
+   try:
+      fd = os.open(path, os.O_RDONLY)
+   except OSError:
+      return
+
+   try:
+      os.fsync(fd)
+   except OSError:
+      pass
+   finally:
+      os.close(fd)
+
+class Journal(object):
+   """\
+   Persists a :class:`MemoryStore <shorten.MemoryStore>` in a directory,
+   as a compact snapshot and an append-only log of the inserts and
+   revocations made since.
+
+   ::
+
+      store = MemoryStore(journal=Journal('/var/lib/shorten'))
+
+      # Survives a restart
+      key, token = store.insert('aardvark')
+
+   On startup, the newest snapshot is loaded and the logs written after it
+   are replayed, both through memory maps. A snapshot is written to a
+   temporary file and renamed over the previous one, so a crash never
+   leaves a partial snapshot. Logs are rotated before each snapshot, and
+   deleted once it is in place.
+
+   If :attr:`sync` is `True`, an operation returns once its record is on
+   disk. Operations in different threads share ``fsync`` calls: while one
+   thread syncs, the others queue their records, and the next sync
+   commits all of them at once. Otherwise records are written to the
+   operating system, but only synced when a log is rotated or closed.
+
+   Records are pickled, so values must be picklable. Journals are not
+   safe to share between processes.
+
+   :param path:              the directory to keep files in. It is
+                             created if it does not exist.
+
+   :param sync:              if `True`, each operation waits until its
+                             record is synced.
+
+   :param snapshot_records:  the number of log records after which the
+                             store writes a snapshot in the background, 
+                             or `None` to only write snapshots 
+                             explicitly.
+
+   :param runtime:           the runtime to wait for syncs in (see
+                             :func:`Condition <shorten.lock.Condition>`).
+   """
+
+   def __init__(self, path, sync=True, snapshot_records=100000, protocol=2,
+         runtime=None):
+      if snapshot_records is not None and snapshot_records < 1:
+         raise ValueError('snapshots need at least one record')
+
+      self.path = path
+      self.sync = sync
+      self.snapshot_records = snapshot_records
+      self.protocol = protocol
+
+      # Recovered from the snapshot
+      self.next_value = None
+
+      # Metrics
+      self.syncs = 0
+      self.records = 0
+
+      self.generation = None
+      self._fd = None
+
+      # Sequence numbers of the last written and synced records
+      self._written = 0
+      self._synced = 0
+      self._syncing = False
+
+      # The condition is also the journal's lock
+      self._synced_cond = Condition(runtime)
+      self._lock = self._synced_cond
+
+      if not os.path.isdir(path):
+         os.makedirs(path)
+
+   def _file(self, name):
+      return os.path.join(self.path, name)
+
+   def _log_name(self, generation):
+      return '{0}{1:010d}'.format(LOG_PREFIX, generation)
+
+   def _log_generations(self):
+      generations = []
+
+      for name in os.listdir(self.path):
+         if name.startswith(LOG_PREFIX):
+            try:
+               generations.append(int(name[len(LOG_PREFIX):]))
+            except ValueError:
+               pass
+
+      return sorted(generations)
+
+   def read_snapshot(self):
+      """\
+      Yields the insert records of the snapshot, then sets 
+      :attr:`next_value` and :attr:`generation`, the first log generation 
+      it does not include.
+      """
+
+      self.generation = 0
+      path = self._file(SNAPSHOT_NAME)
+
+      if not os.path.exists(path):
+         return
+
+      records = read_frames(path)
+      header = next(records, None)
+
+      if header is None or header[0] != SNAPSHOT:
+         raise ValueError('{0} is not a snapshot'.format(path))
+
+      count = 0
+
+      for chunk in records:
+         if chunk[0] == END:
+            if chunk[1] != count:
+               break
+
+            self.next_value = header[2]
+            self.generation = header[1]
+            return
+
+         count += len(chunk)
+
+         for record in chunk:
+            yield record
+
+      raise ValueError('{0} is incomplete'.format(path))
+
+   def read_logs(self):
+      """\
+      Yields the insert and revoke records of the logs written after the 
+      snapshot, in order. It must be called after :meth:`read_snapshot`.
+      Records that the snapshot already includes may be replayed, so 
+      applying them must be idempotent.
+      """
+
+      for generation in self._log_generations():
+         if generation >= self.generation:
+            for record in read_frames(self._file(self._log_name(generation))):
+               yield record
+
+   def replay(self):
+      """\
+      Yields the records of the snapshot and of the logs after it.
+      """
+
+      for record in self.read_snapshot():
+         yield record
+
+      for record in self.read_logs():
+         yield record
+
+   def open(self):
+      """\
+      Starts a new log after every existing one.
+      """
+
+      generations = self._log_generations()
+      generation = self.generation or 0
+
+      if generations:
+         generation = max(generation, generations[-1] + 1)
+
+      with self._lock:
+         self._open_log(generation)
+
+   def _open_log(self, generation):
+      self.generation = generation
+      self._fd = os.open(self._file(self._log_name(generation)),
+         os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+      fsync_directory(self.path)
+
+   def _close_log(self):
+      # Wait for a sync of the log in progress
+      while self._syncing:
+         self._synced_cond.wait()
+
+      os.fsync(self._fd)
+      os.close(self._fd)
+
+      self.syncs += 1
+      self._synced = self._written
+      self._fd = None
+
+   def append(self, record):
+      """\
+      Writes :attr:`record` to the log and returns its sequence number,
+      which can be passed to :meth:`commit`.
+      """
+
+      data = frame(record, self.protocol)
+
+      with self._lock:
+         if self._fd is None:
+            raise ValueError('the journal is not open')
+
+         os.write(self._fd, data)
+
+         self.records += 1
+         self._written += 1
+         return self._written
+
+   def commit(self, sequence):
+      """\
+      Waits until the record :attr:`sequence` is on disk, if :attr:`sync`
+      is `True`. One thread syncs every record written so far, while
+      the others wait for it.
+      """
+
+      if not self.sync:
+         return
+
+      with self._lock:
+         while self._synced < sequence:
+            if self._syncing:
+               self._synced_cond.wait()
+               continue
+
+            self._syncing = True
+            written = self._written
+            fd = self._fd
+
+            self._lock.release()
+
+            try:
+               os.fsync(fd)
+            finally:
+               self._lock.acquire()
+               self._syncing = False
+               self._synced_cond.notify_all()
+
+            self.syncs += 1
+            self._synced = max(self._synced, written)
+
+   @property
+   def snapshot_due(self):
+      """\
+      `True` if :attr:`snapshot_records` were logged since the last
+      snapshot.
+      """
+
+      return self.snapshot_records is not None and \
+         self.records >= self.snapshot_records
+
+   def write_snapshot(self, records, next_value=None):
+      """\
+      Rotates the log, then writes a snapshot of :attr:`records` and
+      deletes the logs it replaces. The records must be taken after the log
+      is rotated, so :attr:`records` should be an iterator that reads the
+      store lazily, and :attr:`next_value` is only called once it is
+      rotated.
+
+      :param records:      an iterable of insert records.
+
+      :param next_value:   a function returning the counter value to 
+                           resume keygens at, or `None`.
+      """
+
+      with self._lock:
+         self._close_log()
+         self._open_log(self.generation + 1)
+         self.records = 0
+         generation = self.generation
+
+      # Covers every key logged before the rotation
+      if next_value is not None:
+         next_value = next_value()
+
+      path = self._file(SNAPSHOT_NAME)
+      temporary = path + '.tmp'
+
+      with open(temporary, 'wb') as f:
+         f.write(frame((SNAPSHOT, generation, next_value), self.protocol))
+         count = 0
+         records = iter(records)
+
+         while True:
+            chunk = list(islice(records, 0, SNAPSHOT_CHUNK))
+
+            if not chunk:
+               break
+
+            f.write(frame(chunk, self.protocol))
+            count += len(chunk)
+
+         f.write(frame((END, count), self.protocol))
+         f.flush()
+         os.fsync(f.fileno())
+
+      # Atomic on POSIX, even if the snapshot exists
+      os.rename(temporary, path)
+      fsync_directory(self.path)
+
+      for old in self._log_generations():
+         if old < generation:
+            os.remove(self._file(self._log_name(old)))
+
+   def close(self):
+      """\
+      Syncs and closes the log.
+      """
+
+      with self._lock:
+         if self._fd is not None:
+            self._close_log()
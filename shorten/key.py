@@ -1,8 +1,22 @@
-from collections import Mapping, Iterable
+import time
+
+try:
+   from collections.abc import Mapping, Iterable
+except ImportError:
+   from collections import Mapping, Iterable
+from itertools import islice
 
 from . import alphabets
+from .alphabets import Codec, _decode_digits
+
+try:
+   import numpy
+except ImportError:
+   numpy = None
 
-__all__ = ['bx_encode', 'bx_decode', 'BaseKeyGenerator']
+__all__ = ['bx_encode', 'bx_decode', 'encode_range', 'odometer', 'Codec', 
+   'get_codec', 'BaseKeyGenerator', 'CounterKeyGenerator', 'CounterIterator',
+   'LeaseSizer']
 
 def bx_encode(n, alphabet):
    """\
@@ -21,19 +35,7 @@ def bx_encode(n, alphabet):
    if not isinstance(n, int):
       raise TypeError('an integer is required')
 
-   base = len(alphabet)
-
-   if n == 0:
-      return alphabet[0]
-
-   digits = []
-   
-   while n > 0:
-      digits.append(alphabet[n % base])
-      n = n // base
-   
-   digits.reverse()
-   return ''.join(digits)
+   return get_codec(alphabet).encode(n)
 
 def bx_decode(string, alphabet, mapping=None):
    """\
@@ -57,8 +59,8 @@ def bx_decode(string, alphabet, mapping=None):
                         to indices.
    """
   
-   mapping = mapping or dict([(d, i) for (i, d) in enumerate(alphabet)])
-   base = len(alphabet)
+   if not mapping:
+      return get_codec(alphabet).decode(string)
 
    if not string:
       raise ValueError('string cannot be empty')
@@ -66,16 +68,136 @@ def bx_decode(string, alphabet, mapping=None):
    if not isinstance(mapping, Mapping):
       raise TypeError('a Mapping is required')
 
-   sum = 0
+   return _decode_digits(string, len(alphabet), mapping)
+
+def get_codec(alphabet):
+   """\
+   Returns the shared :class:`Codec <shorten.alphabets.Codec>` for 
+   :attr:`alphabet` (see :func:`shorten.alphabets.get`).
+   """
+
+   return alphabets.get(alphabet).codec
+
+def odometer(start, alphabet):
+   """\
+   Yields the encoded values of :attr:`start`, ``start+1``, ... in 
+   :attr:`alphabet`. The key is kept as a list of digits that is incremented
+   in place, carrying only when a digit wraps around, so each key costs
+   a constant amount of work instead of a full re-encoding.
+
+   ::
+
+      # ['ff', '100', '101']
+      list(islice(odometer(255, '0123456789abcdef'), 3))
+
+   :param start:        a positive integer.
+   :param alphabet:     a 0-based iterable.
+   """
+
+   base = len(alphabet)
+
+   # The most significant digits, and the last digit
+   digits = []
+   current, last = divmod(start, base)
+
+   while current > 0:
+      current, r = divmod(current, base)
+      digits.append(r)
+
+   digits.reverse()
+   prefix = ''.join([alphabet[d] for d in digits])
+
+   while True:
+      yield prefix + alphabet[last]
+      last += 1
+
+      if last == base:
+         last = 0
 
-   for digit in string:
-      try:
-         sum = base*sum + mapping[digit]
-      except KeyError:
-         raise ValueError(
-            "invalid literal for bx_decode with base %i: '%s'" % (base, digit))
+         # Carry into the prefix, which changes once every `base` keys
+         i = len(digits) - 1
+         while i >= 0 and digits[i] == base - 1:
+            digits[i] = 0
+            i -= 1
 
-   return sum
+         if i < 0:
+            digits.insert(0, 1)
+         else:
+            digits[i] += 1
+
+         prefix = ''.join([alphabet[d] for d in digits])
+
+# Below this many keys, NumPy's setup costs more than it saves
+NUMPY_THRESHOLD = 1024
+
+def encode_range(start, stop, alphabet, use_numpy=None):
+   """\
+   Returns a list of the encoded values of ``range(start, stop)`` in 
+   :attr:`alphabet`. 
+
+   ::
+
+      # ['ff', '100', '101']
+      encode_range(255, 258, '0123456789abcdef')
+
+   If NumPy is installed, large ranges over alphabets of single characters
+   are encoded in bulk by repeatedly dividing an array of integers. 
+   Otherwise the keys are generated with :func:`odometer`.
+
+   :param start:        a positive integer.
+   :param stop:         the end of the range (exclusive).
+   :param alphabet:     a 0-based iterable.
+
+   :param use_numpy:    if `False`, NumPy is never used. If `None`, NumPy
+                        is used when it is installed and the range is
+                        large enough to benefit.
+   """
+
+   count = stop - start
+
+   if count <= 0:
+      return []
+
+   if use_numpy is None:
+      use_numpy = count >= NUMPY_THRESHOLD
+
+   if (use_numpy and numpy is not None and stop <= 2**62 and 
+         all(len(sym) == 1 for sym in alphabet)):
+      return _encode_range_numpy(start, stop, alphabet)
+
+   return list(islice(odometer(start, alphabet), count))
+
+def _encode_range_numpy(start, stop, alphabet):
+   symbols = numpy.array(list(alphabet))
+   kind = symbols.dtype.kind
+   base = len(alphabet)
+
+   length = 1
+   while base ** length <= start:
+      length += 1
+
+   keys = []
+   lo = start
+
+   # Encode every run of keys with the same number of digits together
+   while lo < stop:
+      hi = min(stop, base ** length)
+
+      n = numpy.arange(lo, hi, dtype=numpy.int64)
+      digits = numpy.empty((hi - lo, length), dtype=numpy.int64)
+
+      for col in range(length - 1, -1, -1):
+         n, digits[:, col] = numpy.divmod(n, base)
+
+      # View each row of symbols as a single fixed-width string
+      chars = symbols[digits]
+      strings = chars.view('{0}{1}'.format(kind, length)).ravel()
+      keys.extend(strings.tolist())
+
+      lo = hi
+      length += 1
+
+   return keys
 
 class BaseKeyGenerator(Iterable):
    """\
@@ -83,10 +205,11 @@ class BaseKeyGenerator(Iterable):
    If the key generator is deterministic, then two generators should 
    yield the same keys given the same parameters.
 
-   `alphabet` can be any iterable, as long as each item is not 
-   contained within any other item. For instance, ``('00', '0', '1')`` 
-   would be an ambiguous alphabet, since ``00`` could be interpreted as 
-   two numbers.
+   `alphabet` can be any iterable, as long as no item is a prefix of 
+   any other item. For instance, ``('00', '0', '1')`` would be an 
+   ambiguous alphabet, since ``00`` could be interpreted as two numbers.
+   It is compiled into a shared :class:`Alphabet <shorten.alphabets.Alphabet>`
+   (see :func:`shorten.alphabets.get`).
 
    Each yielded key is expected to be encoded with :meth:`encode`
 
@@ -112,9 +235,11 @@ class BaseKeyGenerator(Iterable):
 
    .. admonition:: Subclassing
 
-      Subclasses should implement :meth:`__iter__ <BaseKeyGenerator.__iter__>`.
+      Subclasses should implement :meth:`__iter__ <BaseKeyGenerator.__iter__>`
+      and may implement :meth:`next_n <BaseKeyGenerator.next_n>`.
 
-   :param alphabet:     an iterable.
+   :param alphabet:     an iterable or an 
+                        :class:`Alphabet <shorten.alphabets.Alphabet>`.
 
    :param start:        the number to start iteration at.
 
@@ -124,26 +249,269 @@ class BaseKeyGenerator(Iterable):
    """
   
    def __init__(self, alphabet=None, min_length=None, start=None):           
-      min_length = max(1, min_length)
-      alphabet = alphabet or alphabets.DEFAULT
+      min_length = max(1, min_length or 1)
+      alphabet = alphabets.get(alphabet or alphabets.DEFAULT)
 
       if start is None:
          start = len(alphabet) ** (min_length-1)      
 
-      # Raise an error if there are duplicates
-      seen = set()
-      for sym in alphabet:
-         if sym in seen:
-            msg = "alphabet contains duplicate symbol '{0}'".format(sym)
-            raise ValueError(msg)
-
-         seen.add(sym)
-
       self.alphabet = alphabet
+      self.codec = alphabet.codec
       self.start = start
 
    def encode(self, n):
-      return bx_encode(n, self.alphabet)
+      return self.codec.encode(n)
+
+   def decode(self, key):
+      return self.codec.decode(key)
+
+   def next_n(self, n):
+      """\
+      Returns a list of :attr:`n` new keys, consuming them from the same 
+      sequence as the keygen's iterators.
+      """
+
+      raise NotImplementedError
 
    def __iter__(self):
       raise NotImplementedError
+
+class LeaseSizer(object):
+   """\
+   Decides how many counter values a keygen should reserve at once 
+   (a `lease`). Leasing trades a single round trip to the counter's backend 
+   for a block of keys that are handed out locally.
+
+   The lease size starts at :attr:`size` and doubles whenever the previous 
+   lease was used up in less than half of :attr:`interval` seconds, or halves 
+   (but never below :attr:`size`) when it took more than twice as long. 
+   A busy keygen therefore makes roughly one request to the backend every 
+   :attr:`interval` seconds, while an idle one wastes few values if it is
+   shut down with an unfinished lease.
+
+   ::
+
+      sizer = LeaseSizer(10, max_size=1000)
+
+      # 10
+      sizer.next_size()
+
+   :param size:         the initial and smallest lease size.
+
+   :param max_size:     the largest lease size. If `None`, the lease size is
+                        fixed at :attr:`size`.
+
+   :param interval:     the number of seconds a lease should ideally last.
+   """
+
+   def __init__(self, size, max_size=None, interval=1.0, clock=time.time):
+      size = max(1, int(size))
+      max_size = size if max_size is None else max(size, int(max_size))
+
+      self.min_size = size
+      self.max_size = max_size
+      self.size = size
+      self.interval = interval
+      self.clock = clock
+
+      self._last = None
+
+   def next_size(self):
+      """\
+      Returns the size of the next lease, adjusted for how quickly the
+      previous lease was consumed.
+      """
+
+      now = self.clock()
+
+      if self._last is not None:
+         elapsed = now - self._last
+
+         if elapsed < self.interval / 2.0:
+            self.size = min(self.size * 2, self.max_size)
+         elif elapsed > self.interval * 2.0:
+            self.size = max(self.size // 2, self.min_size)
+
+      self._last = now
+      return self.size
+
+class CounterKeyGenerator(BaseKeyGenerator):
+   """\
+   A key generator backed by a shared counter, such as a Redis or Memcache 
+   key. Keys are always generated in increasing order.
+
+   By default the counter is incremented once for every key. If 
+   :attr:`lease_size` is given, blocks of counter values are reserved with a
+   single increment and handed out locally, saving a round trip on most 
+   insertions. The size of each lease adapts to the rate at which keys are 
+   consumed (see :class:`LeaseSizer <shorten.key.LeaseSizer>`).
+
+   Leased values that are never used (for instance, when the process shuts 
+   down) are simply dropped, leaving gaps in the key sequence. Keys from
+   keygens sharing the same counter never collide, but they are only
+   increasing within a single keygen.
+
+   .. admonition:: Striping
+
+      A single counter key lives on a single server, which limits the 
+      write throughput of every store sharing it. If :attr:`stripes` is 
+      given, increments are spread over that many counters named
+      ``'{counter_key}:0'``, ``'{counter_key}:1'``, ... Stripe `s` 
+      produces the values ``n*stripes + s``, so stripes never collide.
+
+      Each keygen increments the stripe given by :attr:`stripe` (such as a
+      worker id), or cycles through the stripes if it is `None`. Keys are
+      then only increasing within a stripe. The number of stripes must 
+      never change once keys have been generated.
+
+   .. admonition:: Subclassing
+
+      Subclasses should implement :meth:`_incr` and set 
+      :attr:`counter_key`.
+
+   :param lease_size:      the number of counter values to reserve at once.
+                           If `None`, no values are leased.
+
+   :param max_lease_size:  the largest number of counter values to reserve
+                           at once. Defaults to :attr:`lease_size`.
+
+   :param lease_interval:  the number of seconds a lease should last when
+                           adapting the lease size.
+
+   :param stripes:         the number of counters to spread increments over.
+
+   :param stripe:          the stripe this keygen increments. If `None`,
+                           stripes are used in turn.
+   """
+
+   counter_key = None
+
+   def __init__(self, lease_size=None, max_lease_size=None, lease_interval=1.0,
+         stripes=None, stripe=None, **kwargs):
+      super(CounterKeyGenerator, self).__init__(**kwargs)
+
+      stripes = stripes or 1
+
+      if stripe is not None and not 0 <= stripe < stripes:
+         raise ValueError('stripe must be between 0 and {0}'.format(stripes-1))
+
+      if lease_size:
+         self.lease = LeaseSizer(lease_size, max_size=max_lease_size,
+            interval=lease_interval)
+      else:
+         self.lease = None
+
+      self.stripes = stripes
+      self.stripe = stripe
+      self._next_stripe = 0
+
+   def stripe_key(self, stripe):
+      """\
+      Returns the name of the counter for :attr:`stripe`.
+      """
+
+      if self.stripes == 1:
+         return self.counter_key
+
+      return '{0}:{1}'.format(self.counter_key, stripe)
+
+   def _incr(self, counter_key, count):
+      """\
+      Increments :attr:`counter_key` by :attr:`count` and returns its new
+      value.
+      """
+
+      raise NotImplementedError
+
+   def _take_stripe(self):
+      """\
+      Returns the stripe to increment next.
+      """
+
+      stripe = self.stripe
+
+      if stripe is None:
+         stripe = self._next_stripe
+         self._next_stripe = (stripe + 1) % self.stripes
+
+      return stripe
+
+   def _first_value(self, stripe, high, count):
+      """\
+      Returns the first value reserved by incrementing :attr:`stripe` by 
+      :attr:`count` to :attr:`high`.
+      """
+
+      # The number of values the stripe had produced before this increment
+      n = int(high) - count
+      return n*self.stripes + stripe + self.start
+
+   def _encode_values(self, first, step, n):
+      if step == 1:
+         return encode_range(first, first + n, self.alphabet)
+
+      encode = self.encode
+      return [encode(i) for i in range(first, first + n*step, step)]
+
+   def _reserve(self, count):
+      """\
+      Reserves :attr:`count` values and returns the first (unencoded) value 
+      and the step between values.
+      """
+
+      stripe = self._take_stripe()
+      high = self._incr(self.stripe_key(stripe), count)
+
+      return self._first_value(stripe, high, count), self.stripes
+
+   def next_n(self, n):
+      """\
+      Reserves :attr:`n` counter values with a single increment and returns
+      their keys.
+      """
+
+      if n <= 0:
+         return []
+
+      first, step = self._reserve(n)
+      return self._encode_values(first, step, n)
+
+   def __iter__(self):
+      """\
+      Returns an iterator that increments the counter and returns a new 
+      key (see :class:`CounterIterator <shorten.key.CounterIterator>`).
+      """
+
+      return CounterIterator(self)
+
+class CounterIterator(object):
+   """\
+   Iterates over the keys of a 
+   :class:`CounterKeyGenerator <shorten.key.CounterKeyGenerator>`, 
+   reserving values as needed. Unlike a generator, it can still be used 
+   after an increment fails: the error is raised from :func:`next`, and 
+   the next call tries to increment again.
+   """
+
+   def __init__(self, keygen):
+      self.keygen = keygen
+      self._values = iter(())
+
+   def __iter__(self):
+      return self
+
+   def __next__(self):
+      keygen = self.keygen
+
+      for value in self._values:
+         return keygen.encode(value)
+
+      lease = keygen.lease
+      count = 1 if lease is None else lease.next_size()
+      first, step = keygen._reserve(count)
+
+      self._values = iter(range(first + step, first + count*step, step))
+
+      return keygen.encode(first)
+
+   next = __next__
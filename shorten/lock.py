@@ -1,21 +1,223 @@
-try:
-  import gevent.coros
-  __gevent__ = True
-except ImportError:
-  __gevent__ = False
-
-class Lock(object):
-  def __init__(self):
-    if __gevent__:
-      self._lock = gevent.coros.Semaphore(2)
-    else:
-      self._lock = None
-
-  def acquire(self):
-    if self._lock is not None:
+import sys
+import threading
+
+__all__ = ['Lock', 'Condition', 'StripedLock', 'RUNTIMES']
+
+RUNTIMES = ('threading', 'gevent', 'asyncio')
+
+def detect_runtime():
+   """\
+   Returns ``'gevent'`` if gevent has patched :mod:`threading`, and
+   ``'threading'`` otherwise.
+   """
+
+   monkey = sys.modules.get('gevent.monkey')
+
+   if monkey is not None and monkey.is_module_patched('threading'):
+      return 'gevent'
+
+   return 'threading'
+
+def Lock(runtime=None):
+   """\
+   Returns a new mutual exclusion lock for :attr:`runtime`. Locks have
+   `acquire` and `release` methods, and can be used in a ``with`` block.
+
+   ==============  ======================================================
+   ``threading``   a :func:`threading.Lock`.
+
+   ``gevent``      a :class:`gevent.lock.BoundedSemaphore` with one
+                   holder, which yields to other greenlets while it waits.
+                   Use it if greenlets share a lock without gevent's
+                   monkey-patching.
+
+   ``asyncio``     a :func:`threading.Lock`. The stores never await while
+                   holding a lock, so coroutines cannot contend for one,
+                   and it only blocks the event loop while another thread
+                   holds it.
+   ==============  ======================================================
+
+   :param runtime:   one of :data:`RUNTIMES`, or `None` to use gevent's
+                     lock if gevent has patched :mod:`threading` and a
+                     thread lock otherwise.
+   """
+
+   if runtime is None:
+      runtime = detect_runtime()
+
+   if runtime not in RUNTIMES:
+      raise ValueError('valid runtimes are {0}'.format(', '.join(RUNTIMES)))
+
+   if runtime == 'gevent':
+      from gevent.lock import BoundedSemaphore
+      return BoundedSemaphore(1)
+
+   return threading.Lock()
+
+def Condition(runtime=None):
+   """\
+   Returns a new condition variable for :attr:`runtime`, with the 
+   `acquire`, `release`, `wait`, `notify` and `notify_all` methods of a
+   :class:`threading.Condition`. It can be used in a ``with`` block.
+
+   ==============  ======================================================
+   ``threading``   a :class:`threading.Condition`.
+
+   ``gevent``      a condition whose lock is a
+                   :class:`gevent.lock.BoundedSemaphore`, and whose
+                   waits yield to other greenlets. Without gevent's 
+                   monkey-patching, waiting on a thread condition would
+                   block every greenlet.
+
+   ``asyncio``     a :class:`threading.Condition`.
+   ==============  ======================================================
+
+   :param runtime:   one of :data:`RUNTIMES`, or `None` to detect it (see
+                     :func:`Lock`).
+   """
+
+   if runtime is None:
+      runtime = detect_runtime()
+
+   if runtime not in RUNTIMES:
+      raise ValueError('valid runtimes are {0}'.format(', '.join(RUNTIMES)))
+
+   if runtime == 'gevent':
+      return GeventCondition()
+
+   return threading.Condition(threading.Lock())
+
+class GeventCondition(object):
+   """\
+   A condition variable for greenlets, which does not depend on gevent's
+   monkey-patching. Use :func:`Condition` to create one.
+   """
+
+   def __init__(self):
+      from gevent.lock import BoundedSemaphore
+      from gevent.event import Event
+
+      self._lock = BoundedSemaphore(1)
+      self._event = Event
+      self._waiters = []
+
+   def acquire(self, *args, **kwargs):
+      return self._lock.acquire(*args, **kwargs)
+
+   def release(self):
+      self._lock.release()
+
+   def __enter__(self):
       self._lock.acquire()
+      return self
+
+   def __exit__(self, *exc_info):
+      self._lock.release()
+
+   def wait(self, timeout=None):
+      """\
+      Releases the lock until the condition is notified or :attr:`timeout`
+      seconds pass, then reacquires it. Returns `False` on a timeout.
+      """
 
-  def release(self):
-    if self._lock is not None:
+      waiter = self._event()
+      self._waiters.append(waiter)
       self._lock.release()
 
+      try:
+         waiter.wait(timeout)
+      finally:
+         self._lock.acquire()
+
+         # Notified waiters are removed by the notifier
+         if not waiter.is_set():
+            self._waiters.remove(waiter)
+
+      return waiter.is_set()
+
+   def notify(self, n=1):
+      """\
+      Wakes up to :attr:`n` waiters. The lock must be held.
+      """
+
+      waiters = self._waiters[:n]
+      del self._waiters[:n]
+
+      for waiter in waiters:
+         waiter.set()
+
+   def notify_all(self):
+      """\
+      Wakes every waiter. The lock must be held.
+      """
+
+      self.notify(len(self._waiters))
+
+class StripedLock(object):
+   """\
+   A fixed set of locks that names are spread over by hash, so that
+   operations on different names rarely wait for each other.
+
+   ::
+
+      locks = StripedLock(stripes=16)
+      held = locks.acquire(key, token)
+
+      try:
+         ...
+      finally:
+         locks.release(held)
+
+   Every name's stripe is acquired in increasing order, so two callers
+   locking overlapping names never deadlock.
+
+   :param stripes:   the number of locks.
+   :param runtime:   the runtime to create locks for (see :func:`Lock`).
+   """
+
+   def __init__(self, stripes=16, runtime=None):
+      if stripes < 1:
+         raise ValueError('at least one stripe is required')
+
+      self.stripes = stripes
+      self.locks = [Lock(runtime) for i in range(0, stripes)]
+
+   def __len__(self):
+      return self.stripes
+
+   def stripe(self, name):
+      """\
+      Returns the index of the lock that guards :attr:`name`.
+      """
+      return hash(name) % self.stripes
+
+   def acquire(self, *names):
+      """\
+      Acquires the locks of :attr:`names` and returns their indices, to be
+      passed to :meth:`release`.
+      """
+
+      stripes = self.stripes
+      locks = self.locks
+
+      if len(names) == 2:
+         # The common case of a key and its token
+         i, j = hash(names[0]) % stripes, hash(names[1]) % stripes
+         held = [i] if i == j else [i, j] if i < j else [j, i]
+      else:
+         held = sorted(set([hash(name) % stripes for name in names]))
+
+      for i in held:
+         locks[i].acquire()
+
+      return held
+
+   def release(self, held):
+      """\
+      Releases the locks acquired by :meth:`acquire`.
+      """
+
+      locks = self.locks
+
+      for i in reversed(held):
+         locks[i].release()
@@ -1,43 +1,144 @@
+import math
+import time
+
+from itertools import islice
+
 from .base import BaseStore, Pair
 
-from .lock import Lock
-from .key import BaseKeyGenerator
+from .key import CounterKeyGenerator
 from .formatter import FormatterMixin
-from .errors import KeyInsertError, TokenInsertError
+from .ring import MemcacheRing
+from .errors import KeyInsertError, TokenInsertError, RevokeError
+
+try:
+   # pylibmc raises an error when incrementing a missing key, other clients
+   # return `None`
+   from pylibmc import NotFound as CounterNotFound
+except ImportError:
+   class CounterNotFound(Exception):
+      pass
+
+# Memcache reads larger expiry times as Unix timestamps
+MAX_RELATIVE_EXPIRY = 60 * 60 * 24 * 30
 
-class MemcacheKeygen(BaseKeyGenerator):
+class MemcacheKeygen(CounterKeyGenerator):
    """\
-   Creates keys in-memory. Keys are always generated in increasing order.
+   Creates keys in Memcache. Keys are always generated in increasing order.
+
+   If :attr:`lease_size` is given, blocks of counter values are reserved 
+   with a single ``incr(counter_key, delta)``. If :attr:`stripes` is given,
+   increments are spread over several counter keys, which may hash to 
+   different servers (see 
+   :class:`CounterKeyGenerator <shorten.key.CounterKeyGenerator>`).
+
+   Memcache may lose the counter at any time through a restart or eviction.
+   To avoid handing out keys that already exist, a mark at or above the 
+   highest reserved value is recorded in :attr:`high_key`. Marks are 
+   multiples of :attr:`high_gap`, so the mark is only written when the 
+   counter passes the previous one, once every :attr:`high_gap` values. 
+   When the counter is missing it is atomically recreated (with ``add``) 
+   past the recorded mark, or past the highest mark this keygen has 
+   written, if that is higher. Because concurrent keygens may record their 
+   marks out of order, the counter also skips :attr:`high_gap` values when
+   it is recreated; this should be larger than the number of keygens times
+   the largest lease.
+
+   .. warning::
+
+      By default the mark is stored in :attr:`memcache_client`, next to 
+      the counter. That only protects against the counter being evicted:
+      if the server restarts, the mark is lost along with the counter, 
+      and only the marks held by running keygens keep keys from starting
+      over at 0. Pass a :attr:`high_client` that stores the mark durably
+      to survive a restart.
+
+   :param memcache_client: a Memcache client.
+   :param counter_key:     the Memcache key in which to store the keygen's
+                           counter value.
+
+   :param high_key:        the key in which to store the high-water mark.
+                           Defaults to ``'{counter_key}:high'``. Striped 
+                           counters always use ``'{stripe_key}:high'``.
+
+   :param high_client:     a Memcache client (e.g. a persistent, 
+                           Memcache-compatible server) used to store 
+                           :attr:`high_key`. Defaults to 
+                           :attr:`memcache_client`.
+
+   :param high_gap:        the interval between marks, and the number of 
+                           values to skip when the counter is recreated.
    """
  
-   def __init__(self, memcache_client=None, counter_key=None, **kwargs):
+   def __init__(self, memcache_client=None, counter_key=None, high_key=None,
+         high_client=None, high_gap=1000, **kwargs):
       super(MemcacheKeygen, self).__init__(**kwargs)
 
       if counter_key is None:
          raise ValueError('a counter key is required')
 
+      if high_gap < 1:
+         raise ValueError('high_gap must be at least 1')
+
       self.counter_key = counter_key
+      self.high_key = high_key or '{0}:high'.format(counter_key)
+      self.high_gap = high_gap
+
       self._mc = memcache_client
+      self._high_mc = high_client or memcache_client
 
-   def __iter__(self):
-      ckey = self.counter_key
-      start = self.start
-      mc = self._mc
-     
-      # Create a start value 
-      lock = Lock()
-      lock.acquire()
+      # The highest mark written for each counter key
+      self._marks = {}
 
-      # Create a start value if it doesn't exist
-      current = mc.get(ckey)
-      if current is None:
-         mc.set(ckey, 0)
+   def _high_key(self, counter_key):
+      if counter_key == self.counter_key:
+         return self.high_key
 
-      lock.release()
+      return '{0}:high'.format(counter_key)
 
-      while True:
-         i = int(mc.incr(ckey)) + start - 1
-         yield self.encode(i)
+   def _try_incr(self, counter_key, count):
+      try:
+         return self._mc.incr(counter_key, count)
+      except CounterNotFound:
+         return None
+
+   def _recover(self, counter_key):
+      """\
+      Recreates a missing counter past the highest recorded mark. ``add``
+      fails if the counter exists, so only one keygen will recreate it.
+      """
+
+      high = self._high_mc.get(self._high_key(counter_key))
+      mark = self._marks.pop(counter_key, None)
+
+      if high is not None:
+         mark = max(mark, int(high)) if mark is not None else int(high)
+
+      if mark is None:
+         initial = 0
+      else:
+         initial = mark + self.high_gap
+
+      self._mc.add(counter_key, initial)
+
+   def _incr(self, counter_key, count):
+      high = self._try_incr(counter_key, count)
+
+      if high is None:
+         self._recover(counter_key)
+         high = self._try_incr(counter_key, count)
+
+      if high is None:
+         raise KeyInsertError(counter_key, 'counter could not be stored')
+
+      high = int(high)
+
+      if high > self._marks.get(counter_key, 0):
+         # Record the next multiple of the gap
+         mark = (high // self.high_gap + 1) * self.high_gap
+         self._high_mc.set(self._high_key(counter_key), mark)
+         self._marks[counter_key] = mark
+
+      return high
 
 class MemcacheStore(BaseStore, FormatterMixin):
    """\
@@ -56,6 +157,27 @@ class MemcacheStore(BaseStore, FormatterMixin):
                       counter value.
 
    `memcache_client`  a Memcache client.
+
+   `lease_size`       the number of counter values the keygen reserves
+                      at once.
+
+   `max_lease_size`   the largest number of counter values the keygen
+                      reserves at once.
+
+   `lease_interval`   the number of seconds a lease should last.
+
+   `high_key`         the key in which to store the keygen's high-water
+                      mark.
+
+   `high_client`      a Memcache client used to store the high-water 
+                      mark, such as a persistent server.
+
+   `high_gap`         the interval between high-water marks.
+
+   `stripes`          the number of counter keys to spread increments 
+                      over.
+
+   `stripe`           the counter key this store's keygen increments.
    =================  ===================================================
 
    :param counter_key:     the Memcache key in which to store the keygen's
@@ -65,6 +187,9 @@ class MemcacheStore(BaseStore, FormatterMixin):
 
    :param redis_client:    a Memcache client.
    :type key_gen:          a MemcacheKeyGen or None
+
+   :param fast:            if `True`, :meth:`insert` does not check whether
+                           the key and token exist before adding them.
    """
  
    def __init__(self, **kwargs):
@@ -73,7 +198,17 @@ class MemcacheStore(BaseStore, FormatterMixin):
       alphabet = kwargs.pop('alphabet', None)
       min_length = kwargs.pop('min_length', None)
       start = kwargs.pop('start', None)
-      key_gen = kwargs.get('key_gen', None)
+      lease_size = kwargs.pop('lease_size', None)
+      max_lease_size = kwargs.pop('max_lease_size', None)
+      lease_interval = kwargs.pop('lease_interval', 1.0)
+      high_key = kwargs.pop('high_key', None)
+      high_client = kwargs.pop('high_client', None)
+      high_gap = kwargs.pop('high_gap', 1000)
+      stripes = kwargs.pop('stripes', None)
+      stripe = kwargs.pop('stripe', None)
+      key_gen = kwargs.pop('key_gen', None)
+      clock = kwargs.pop('clock', time.time)
+      fast = kwargs.pop('fast', False)
 
       # Create a reasonable keygen if it isn't provided
       if key_gen is None:
@@ -82,15 +217,25 @@ class MemcacheStore(BaseStore, FormatterMixin):
             alphabet=alphabet, 
             counter_key=counter_key, 
             min_length=min_length, 
-            start=start)
+            start=start,
+            lease_size=lease_size,
+            max_lease_size=max_lease_size,
+            lease_interval=lease_interval,
+            high_key=high_key,
+            high_client=high_client,
+            high_gap=high_gap,
+            stripes=stripes,
+            stripe=stripe)
 
       if memcache_client is None:
          raise ValueError('a memcache client is required')
 
       super(MemcacheStore, self).__init__(key_gen=key_gen, **kwargs)
       self._mc = memcache_client
+      self.clock = clock
+      self.fast = fast
 
-   def insert(self, val):     
+   def insert(self, val, ttl=None):     
       """\
       Inserts a value and returns a :class:`Pair <Pair>`.
 
@@ -98,38 +243,182 @@ class MemcacheStore(BaseStore, FormatterMixin):
       :class:`KeyInsertError <shorten.KeyInsertError>` is raised (or a
       :class:`TokenInsertError <shorten.TokenInsertError>` if a token
       exists or cannot be stored).      
+
+      If :attr:`ttl` is given, the key and token expire after that many 
+      seconds (rounded up). Memcache treats expiry times over 30 days as
+      Unix timestamps, so longer TTLs are sent as one.
+
+      Both records are first looked up with a single ``get_multi``, unless
+      the store is :attr:`fast`. Since ``add`` never overwrites a record,
+      skipping the lookup is just as safe, but an existing key cannot be 
+      told apart from a failure to store it. If the token cannot be added,
+      the key record is deleted again.
       """
 
+      expiry = self._expiry(ttl)
       key, token, formatted_key, formatted_token = self.next_formatted_pair()
 
-      if self.has_key(key):
-         raise KeyInsertError(key)
+      if not self.fast:
+         found = self._mc.get_multi([formatted_key, formatted_token])
 
-      if self.has_token(token):
-         raise TokenInsertError(token)
+         if formatted_key in found:
+            raise KeyInsertError(key, 'key exists')
 
-      # Memcache is down or read-only
+         if formatted_token in found:
+            raise TokenInsertError(token, 'token exists')
 
-      if not self._mc.add(formatted_key, (val, token)):
+      # Fails if the key exists, or if memcache is down or read-only
+      if not self._mc.add(formatted_key, (val, token), time=expiry):
          raise KeyInsertError(key, 'key could not be stored')
 
-      if not self._mc.add(formatted_token, key):
+      if not self._mc.add(formatted_token, key, time=expiry):
+         # Don't leave a key without a token behind
+         self._mc.delete(formatted_key)
          raise TokenInsertError(token, 'token could not be stored')
 
       return Pair(key, token)
 
+   def insert_many(self, values, chunk_size=1000, ttl=None):
+      """\
+      Inserts every value in :attr:`values` and returns a list with a 
+      :class:`Pair <shorten.Pair>` for each value, in order, like 
+      :meth:`RedisStore.insert_many <shorten.RedisStore.insert_many>`. 
+      Values that cannot be inserted have a 
+      :class:`KeyInsertError <shorten.KeyInsertError>` or 
+      :class:`TokenInsertError <shorten.TokenInsertError>` instead.
+
+      Each chunk of :attr:`chunk_size` values costs at most three calls: 
+      an ``add_multi`` for the key records, an ``add_multi`` for the token 
+      records, and a ``delete_multi`` to remove the key records whose token
+      could not be added. Since ``add`` fails for existing keys, keys are 
+      not checked beforehand.
+
+      :attr values:     an iterable of values to insert.
+      :attr chunk_size: the number of values to send in each call.
+      :attr ttl:        the number of seconds each pair lasts (see 
+                        :meth:`insert`).
+      """
+
+      expiry = self._expiry(ttl)
+      values = iter(values)
+      results = []
+
+      while True:
+         chunk = list(islice(values, chunk_size))
+
+         if not chunk:
+            return results
+
+         pairs = self.next_formatted_pairs(len(chunk))
+
+         failed_keys = set(self._mc.add_multi(dict(
+            (pair.formatted_key, (val, pair.token)) 
+            for val, pair in zip(chunk, pairs)), time=expiry))
+
+         added = [pair for pair in pairs 
+            if pair.formatted_key not in failed_keys]
+
+         failed_tokens = set(self._mc.add_multi(dict(
+            (pair.formatted_token, pair.key) for pair in added), 
+            time=expiry))
+
+         # Don't leave keys without tokens behind
+         orphans = [pair.formatted_key for pair in added 
+            if pair.formatted_token in failed_tokens]
+
+         if orphans:
+            self._mc.delete_multi(orphans)
+
+         for pair in pairs:
+            if pair.formatted_key in failed_keys:
+               results.append(KeyInsertError(pair.key, 
+                  'key could not be stored'))
+            elif pair.formatted_token in failed_tokens:
+               results.append(TokenInsertError(pair.token, 
+                  'token could not be stored'))
+            else:
+               results.append(Pair(pair.key, pair.token))
+
+   def _expiry(self, ttl):
+      """\
+      Returns the Memcache expiry time for a TTL in seconds, where ``0``
+      never expires.
+      """
+
+      if ttl is None:
+         return 0
+
+      if ttl <= 0:
+         raise ValueError('ttl must be positive')
+
+      seconds = int(math.ceil(ttl))
+
+      if seconds > MAX_RELATIVE_EXPIRY:
+         return int(self.clock()) + seconds
+
+      return seconds
+
    def revoke(self, token):
+      """\
+      Revokes :attr:`token` with a ``get`` for its key and a single 
+      ``delete_multi``.
+      """
+
       formatted_token = self.format_token(token)
+      key = self._mc.get(formatted_token)
 
-      try:
-         key = self._mc.get(formatted_token)
-      except KeyError:
-         raise RevokeError('token not found')
-        
-      formatted_key = self.format_key(key)
+      if key is None:
+         raise RevokeError(token, 'token not found')
+
+      self._mc.delete_multi([self.format_key(key), formatted_token])
+
+   def revoke_many(self, tokens):
+      """\
+      Revokes every token in :attr:`tokens` with one ``get_multi`` and one
+      ``delete_multi``, and returns a list with `None` for each revoked 
+      token, in order, or a :class:`RevokeError <shorten.RevokeError>` for
+      tokens that were not found.
+      """
+
+      tokens = list(tokens)
+      formatted_tokens = [self.format_token(token) for token in tokens]
+      found = self._mc.get_multi(formatted_tokens)
+
+      results = []
+      names = []
+
+      for token, formatted_token in zip(tokens, formatted_tokens):
+         key = found.get(formatted_token)
+
+         if key is None:
+            results.append(RevokeError(token, 'token not found'))
+            continue
+
+         names.append(self.format_key(key))
+         names.append(formatted_token)
+         results.append(None)
+
+      if names:
+         self._mc.delete_multi(names)
+
+      return results
+
+   def get_many(self, keys, default=None):
+      """\
+      Returns a list with the value of each key in :attr:`keys`, in order,
+      or :attr:`default` for keys that do not exist, with a single 
+      ``get_multi``.
+      """
+
+      formatted_keys = [self.format_key(key) for key in keys]
+      found = self._mc.get_multi(formatted_keys)
+      values = []
+
+      for formatted_key in formatted_keys:
+         record = found.get(formatted_key)
+         values.append(default if record is None else record[0])
 
-      del self._mc[formatted_key]
-      del self._mc[formatted_token]
+      return values
 
    def get_value(self, key):
       key = self.format_key(key)
@@ -154,7 +443,81 @@ class MemcacheStore(BaseStore, FormatterMixin):
       val = self._mc.get(key)
       
       if val is None:
-         raise KeyError(token)
+         raise KeyError(key)
 
       token = val[1]
       return token      
+
+class MemcacheRingStore(MemcacheStore):
+   """\
+   Stores keys, tokens and data in several Memcache servers, spread over a
+   :class:`HashRing <shorten.ring.HashRing>` with virtual nodes. Adding or
+   removing one of `N` servers only moves about ``1/N`` of the records.
+
+   ::
+
+      store = MemcacheRingStore(memcache_clients={
+            'mc1': pylibmc.Client(['10.0.0.1']),
+            'mc2': pylibmc.Client(['10.0.0.2']),
+         }, counter_key='counter', formatter=NamespacedFormatter('links'))
+
+   Key records are placed by their key and token records by their token,
+   without the formatter's prefix and suffix, so a key and a token that are
+   equal (as with the default 
+   :class:`TokenGenerator <shorten.TokenGenerator>`) always share a server,
+   and every insertion and revokation stays on that server. Multi-key calls
+   are sent as one call per server. The keygen's counter is placed by its 
+   name.
+
+   Takes the same parameters as :class:`MemcacheStore`, except 
+   `memcache_client`, and:
+
+   :param memcache_clients:   a :class:`dict` of node names and Memcache 
+                              clients. Node names must never change, since
+                              they decide where records are placed.
+
+   :param vnodes:             the number of points per node on the ring.
+   """
+
+   def __init__(self, **kwargs):
+      clients = kwargs.pop('memcache_clients', None)
+      vnodes = kwargs.pop('vnodes', 160)
+
+      if not clients:
+         raise ValueError('memcache clients are required')
+
+      ring = MemcacheRing(clients, vnodes=vnodes)
+
+      super(MemcacheRingStore, self).__init__(memcache_client=ring, **kwargs)
+
+      affixes = []
+
+      for find in (self.key_affixes, self.token_affixes):
+         try:
+            affixes.append(find())
+         except ValueError:
+            pass
+
+      self._affixes = affixes
+      ring.route = self._route
+
+   @property
+   def ring(self):
+      """\
+      The :class:`MemcacheRing <shorten.ring.MemcacheRing>` holding this 
+      store's clients.
+      """
+      return self._mc
+
+   def _route(self, name):
+      """\
+      Returns the key or token that the record :attr:`name` belongs to, or
+      :attr:`name` itself.
+      """
+
+      for prefix, suffix in self._affixes:
+         if name.startswith(prefix) and name.endswith(suffix) and \
+               len(name) > len(prefix) + len(suffix):
+            return name[len(prefix):len(name) - len(suffix)]
+
+      return name
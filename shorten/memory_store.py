@@ -1,31 +1,116 @@
-from .base import BaseStore, Pair
+import sys
+import time
+import heapq
 
-from .key import BaseKeyGenerator
-from .lock import Lock
+from itertools import islice
+
+from .base import BaseStore, Pair, FormattedPair
+
+from .key import BaseKeyGenerator, encode_range, odometer
+from .lock import Lock, Condition, StripedLock, detect_runtime
+from .pool import spawn_thread
 from .formatter import FormatterMixin
 from .errors import KeyInsertError, TokenInsertError, RevokeError
+from .journal import INSERT, REVOKE
+
+# The number of keys an odometer iterator reserves at once
+ODOMETER_BLOCK = 256
 
 class MemoryKeygen(BaseKeyGenerator):
    """\
    Creates keys in-memory. Keys are always generated in increasing order.
+   The counter is shared by every iterator over the keygen and by 
+   :meth:`next_n`.
+
+   If :attr:`odometer` is `True`, the current key is kept as a list of
+   digits that is incremented in place, carrying only when a digit wraps
+   around (see :func:`odometer <shorten.key.odometer>`). Each iterator 
+   reserves :data:`ODOMETER_BLOCK` keys at once, so the counter is only
+   locked once per block. A single iterator produces the same keys in 
+   both modes, but keys from several iterators are interleaved in blocks,
+   and the rest of a block is skipped when its iterator is discarded.
+
+   :param odometer:     if `True`, keys are incremented digit-by-digit 
+                        instead of being encoded from a counter.
+
+   :param runtime:      the runtime to lock the counter for (see 
+                        :func:`Lock <shorten.lock.Lock>`).
+
+   .. versionchanged:: 2.1
+      Iterators share the keygen's counter. Each iterator used to restart
+      at :attr:`start`, so two iterators over one keygen repeated keys.
    """
- 
+
+   def __init__(self, odometer=False, runtime=None, **kwargs):
+      super(MemoryKeygen, self).__init__(**kwargs)
+
+      self.odometer = odometer
+      self._current = self.start
+      self._lock = Lock(runtime)
+
+   def _reserve(self, count):
+      self._lock.acquire()
+
+      try:
+         current = self._current
+         self._current += count
+         return current
+      finally:
+         self._lock.release()
+
+   def advance(self, value):
+      """\
+      Moves the counter forward to :attr:`value`, if it is behind.
+      """
+
+      self._lock.acquire()
+
+      try:
+         self._current = max(self._current, value)
+      finally:
+         self._lock.release()
+
+   def next_n(self, n):
+      """\
+      Returns a list of the next :attr:`n` keys.
+      """
+
+      if n <= 0:
+         return []
+
+      first = self._reserve(n)
+      return encode_range(first, first + n, self.alphabet)
+
    def __iter__(self):
       """\
-      Increments the in-memory counter and yields a new key.      
+      Returns an iterator that increments the in-memory counter and yields
+      a new key.
       """
 
-      lock = Lock()
-      current = self.start
+      if self.odometer:
+         return self._iter_odometer()
+
+      return self._iter_counter()
 
+   def _iter_counter(self):
       while True:
-         try:
-            lock.acquire()    
-            yield self.encode(current)
-            current += 1
+         yield self.encode(self._reserve(1))
 
-         finally:
-            lock.release()
+   def _iter_odometer(self):
+      keys = None
+      expected = None
+
+      while True:
+         current = self._reserve(ODOMETER_BLOCK)
+
+         # Restart the odometer if other consumers have taken keys
+         if current != expected:
+            keys = odometer(current, self.alphabet)
+
+         expected = current + ODOMETER_BLOCK
+
+         for key in islice(keys, ODOMETER_BLOCK):
+            yield key
 
 class MemoryStore(BaseStore, FormatterMixin):
    """\
@@ -39,11 +124,63 @@ class MemoryStore(BaseStore, FormatterMixin):
    `min_length`       the minimum key length to begin generating keys at.
 
    `start`            the number to start the keygen's counter at.
+
+   `odometer`         if `True`, keys are incremented digit-by-digit
+                      instead of being encoded from a counter.
    =================  ===================================================
 
+   Pairs inserted with a `ttl` are kept in a heap ordered by their 
+   expiry. Expired pairs are removed from the top of the heap at the start
+   of every operation, so expiring a pair costs ``O(log n)`` and the store
+   is never scanned.
+
+   If a :class:`Journal <shorten.Journal>` is given, the store is recovered
+   from it when it is created, and every insert and revocation is logged 
+   to it. A keygen with an `advance` method, such as a 
+   :class:`MemoryKeygen <shorten.MemoryKeygen>`, resumes after the highest
+   key that was ever inserted. Once the journal has logged
+   :attr:`snapshot_records <shorten.Journal>` records, a background worker
+   writes a snapshot, so inserts never wait for one. If a snapshot fails,
+   the logs are kept and :attr:`snapshot_failures` is incremented.
+
+   Stores are safe to share between threads. Each key and token is 
+   guarded by one of :attr:`stripes` locks, chosen by its hash, so 
+   operations on different pairs rarely wait for each other. 
+
+   If :attr:`max_entries` or :attr:`max_bytes` is given, the store is 
+   bounded, and pairs are evicted with the CLOCK policy, an approximation
+   of least-recently-used eviction. Every pair has a slot on a circular
+   list with a reference bit, which :meth:`get_value` sets. To evict, a 
+   hand sweeps the list, clearing set bits and evicting the first pair 
+   whose bit is clear. Pairs are evicted after the insert that exceeds a
+   bound, so concurrent inserts can exceed it briefly. The number of 
+   evicted pairs is counted in :attr:`evictions`.
+
    :param key_gen:    a key generator. If `None`, a new key
                       generator is created (see above).
 
+   :param max_entries:   the largest number of pairs to keep, or `None`.
+
+   :param max_bytes:     the largest total size of values to keep, or 
+                         `None`.
+
+   :param sizeof:        a function returning the size of a value in 
+                         bytes, :func:`sys.getsizeof` by default.
+
+   :param stripes:    the number of locks to spread keys and tokens over.
+
+   :param runtime:    the runtime to create locks for, which is also 
+                      passed to a new keygen (see 
+                      :func:`Lock <shorten.lock.Lock>`).
+
+   :param journal:    a :class:`Journal <shorten.Journal>`, or `None` to 
+                      keep pairs in memory only.
+
+   :param spawn:      a function that runs its argument in the background,
+                      used to write snapshots. Defaults to 
+                      :func:`gevent.spawn` for the ``gevent`` runtime, and 
+                      to a daemon thread otherwise.
+
    :type key_gen:     a MemoryKeygen or None
    """
   
@@ -51,68 +188,820 @@ class MemoryStore(BaseStore, FormatterMixin):
       alphabet = kwargs.pop('alphabet', None)
       min_length = kwargs.pop('min_length', None)
       start = kwargs.pop('start', None)      
-      key_gen = kwargs.get('key_gen', None)
+      odometer = kwargs.pop('odometer', False)
+      key_gen = kwargs.pop('key_gen', None)
+      clock = kwargs.pop('clock', time.time)
+      journal = kwargs.pop('journal', None)
+      stripes = kwargs.pop('stripes', 16)
+      runtime = kwargs.pop('runtime', None)
+      max_entries = kwargs.pop('max_entries', None)
+      max_bytes = kwargs.pop('max_bytes', None)
+      sizeof = kwargs.pop('sizeof', sys.getsizeof)
+      spawn = kwargs.pop('spawn', None)
+
+      if max_entries is not None and max_entries < 1:
+         raise ValueError('the store must hold at least one pair')
+
+      if max_bytes is not None and max_bytes < 1:
+         raise ValueError('the store must hold at least one byte')
 
       # Provide a reasonable default keygen
       if key_gen is None:
          key_gen = MemoryKeygen(alphabet=alphabet, min_length=min_length, 
-            start=start)
+            start=start, odometer=odometer, runtime=runtime)
 
       super(MemoryStore, self).__init__(key_gen=key_gen, **kwargs)
 
+      self._runtime = runtime
+      self._locks = StripedLock(stripes, runtime)
+      self._keygen_lock = Lock(runtime)
+      self._expiry_lock = Lock(runtime)
+      self._snapshot_lock = Lock(runtime)
+      self._snapshot_cond = Condition(runtime)
+
+      self.max_entries = max_entries
+      self.max_bytes = max_bytes
+      self.sizeof = sizeof
+
+      # Metrics
+      self.evictions = 0
+      self.snapshot_failures = 0
+
+      # The key and reference bit of each slot, the free slots and the hand
+      if max_entries is None and max_bytes is None:
+         self._referenced = None
+      else:
+         self._referenced = bytearray()
+
+      self._slot_keys = []
+      self._free_slots = []
+      self._hand = 0
+      self._bytes = 0
+      self._eviction_lock = Lock(runtime)
+
+      self._create_storage()
+
+      # A heap of (expiry, key) and the expiry of each key
+      self._expiry_heap = []
+      self._expiries = {}
+      self.clock = clock
+
+      self.journal = journal
+      self.retry_interval = 1.0
+      self._closed = False
+
+      # The highest counter value inserted, for keygens to resume after
+      self._high = -1
+
+      if journal is not None:
+         self._recover()
+         self._evict()
+
+         if journal.snapshot_records is not None:
+            if (runtime or detect_runtime()) == 'gevent':
+               import gevent
+               spawn = spawn or gevent.spawn
+
+            self._compactor = (spawn or spawn_thread)(self._compact)
+
+   def _expire(self):
+      """\
+      Removes every pair that has expired.
+      """
+
+      heap = self._expiry_heap
+
+      if not heap:
+         return
+
+      try:
+         if heap[0][0] > self.clock():
+            return
+      except IndexError:
+         # Emptied by another thread
+         return
+
+      # Stripes are only ever acquired after this lock, never before it
+      with self._expiry_lock:
+         now = self.clock()
+
+         while heap and heap[0][0] <= now:
+            expires, key = heapq.heappop(heap)
+            record = self._lookup(key)
+
+            if record is None:
+               continue
+
+            token = record[1]
+            held = self._locks.acquire(key, token)
+
+            try:
+               # Skip entries for pairs that were revoked (and possibly 
+               # reused)
+               if self._expiries.get(key) != expires:
+                  continue
+
+               del self._expiries[key]
+               self._delete(key, token)
+            finally:
+               self._locks.release(held)
+
+   # Storage primitives, which subclasses may replace
+
+   def _create_storage(self):
       self._data = {}
-      self._tokens = {}  
+      self._tokens = {}
 
-   def insert(self, val):     
-      key, token, formatted_key, formatted_token = self.next_formatted_pair()
+   def _lookup(self, key):
+      """\
+      Returns the value and token of :attr:`key`, or `None`.
+      """
+      return self._data.get(self.format_key(key))
 
-      # To be consistent, the `has_key` and `has_token` methods are used
-      if self.has_key(key):
-         raise KeyInsertError(key, 'key exists')
+   def _token_key(self, token):
+      """\
+      Returns the key of :attr:`token`, or `None`.
+      """
+      return self._tokens.get(self.format_token(token))
 
-      if self.has_token(token):
-         raise TokenInsertError(token, 'token exists')
+   def _put(self, pair, val):
+      """\
+      Stores a :class:`FormattedPair <shorten.base.FormattedPair>` and its 
+      value.
+      """
+
+      key, token, formatted_key, formatted_token = pair
+
+      if self._referenced is None:
+         self._data[formatted_key] = (val, token)
+      else:
+         self._data[formatted_key] = (val, token, self._claim_slot(key, val))
 
-      self._data[formatted_key] = (val, token)
       self._tokens[formatted_token] = key
 
+   def _delete(self, key, token):
+      """\
+      Removes :attr:`key` and :attr:`token`.
+      """
+
+      record = self._data.pop(self.format_key(key))
+      del self._tokens[self.format_token(token)]
+
+      if self._referenced is not None:
+         self._release_slot(record[2], record[0])
+
+   # Eviction
+
+   def _claim_slot(self, key, val):
+      """\
+      Returns a free slot for :attr:`key` on the clock.
+      """
+
+      with self._eviction_lock:
+         self._bytes += self.sizeof(val)
+
+         if self._free_slots:
+            slot = self._free_slots.pop()
+            self._slot_keys[slot] = key
+            self._referenced[slot] = 0
+         else:
+            slot = len(self._slot_keys)
+            self._slot_keys.append(key)
+            self._referenced.append(0)
+
+         return slot
+
+   def _release_slot(self, slot, val):
+      with self._eviction_lock:
+         self._bytes -= self.sizeof(val)
+         self._slot_keys[slot] = None
+         self._free_slots.append(slot)
+
+   def _over_bounds(self):
+      return (self.max_entries is not None and 
+            len(self._data) > self.max_entries) or \
+         (self.max_bytes is not None and self._bytes > self.max_bytes)
+
+   def _next_victim(self):
+      """\
+      Sweeps the hand to the next slot whose reference bit is clear, and
+      returns it and its key.
+      """
+
+      with self._eviction_lock:
+         keys = self._slot_keys
+         referenced = self._referenced
+         slots = len(keys)
+         hand = self._hand
+
+         # Every bit is cleared in the first pass, at worst
+         for i in range(0, 2*slots):
+            if hand >= slots:
+               hand = 0
+
+            key = keys[hand]
+
+            if key is not None:
+               if not referenced[hand]:
+                  self._hand = hand + 1
+                  return hand, key
+
+               referenced[hand] = 0
+
+            hand += 1
+
+         return None, None
+
+   def _evict(self):
+      """\
+      Evicts pairs until the store is within its bounds.
+      """
+
+      if self._referenced is None:
+         return
+
+      # Bounded, in case every victim is removed by other threads first
+      for i in range(0, len(self._slot_keys) + 1):
+         if not self._over_bounds():
+            return
+
+         slot, key = self._next_victim()
+
+         if key is None:
+            return
+
+         record = self._lookup(key)
+
+         if record is None:
+            continue
+
+         token = record[1]
+         held = self._locks.acquire(key, token)
+
+         try:
+            record = self._lookup(key)
+
+            # The pair may have been replaced while the stripes were free
+            if record is None or record[2] != slot:
+               continue
+
+            self._delete(key, token)
+            self._expiries.pop(key, None)
+
+            with self._eviction_lock:
+               self.evictions += 1
+         finally:
+            self._locks.release(held)
+
+   def _pairs(self):
+      """\
+      Yields the key, token and value of every pair.
+      """
+
+      # Copied, so that pairs can be inserted and revoked meanwhile
+      for key in list(self._tokens.values()):
+         record = self._lookup(key)
+
+         if record is not None:
+            yield key, record[1], record[0]
+
+   # Persistence
+
+   def _recover(self):
+      """\
+      Replays the journal, then advances the keygen past the highest key.
+      """
+
+      journal = self.journal
+      restore = self._restore
+
+      # Snapshots hold distinct pairs, and their counter value
+      for record in journal.read_snapshot():
+         restore(record[1], record[2], record[3], record[4])
+
+      high = -1 if journal.next_value is None else journal.next_value - 1
+      decode = self._keygen.decode
+
+      for record in journal.read_logs():
+         key, token = record[1], record[2]
+         existing = self._lookup(key)
+
+         # Records may be replayed more than once
+         if existing is not None:
+            self._delete(key, existing[1])
+            self._expiries.pop(key, None)
+
+         if record[0] == INSERT:
+            restore(key, token, record[3], record[4])
+            high = max(high, decode(key))
+
+      self._high = high
+      advance = getattr(self._keygen, 'advance', None)
+
+      if advance is not None:
+         advance(high + 1)
+
+      journal.open()
+
+   def _restore(self, key, token, val, expires):
+      self._put(FormattedPair(key, token, self.format_key(key),
+         self.format_token(token)), val)
+
+      if expires is not None:
+         self._expiries[key] = expires
+         heapq.heappush(self._expiry_heap, (expires, key))
+
+   def _commit(self, sequence):
+      """\
+      Waits for the journal to sync the record :attr:`sequence`, and wakes
+      the compactor if a snapshot is due.
+      """
+
+      journal = self.journal
+      journal.commit(sequence)
+
+      if journal.snapshot_due:
+         with self._snapshot_cond:
+            self._snapshot_cond.notify()
+
+   def _compact(self):
+      cond = self._snapshot_cond
+      journal = self.journal
+
+      while True:
+         with cond:
+            while not self._closed and not journal.snapshot_due:
+               cond.wait()
+
+            if self._closed:
+               return
+
+         try:
+            self.snapshot()
+         except Exception:
+            if self._closed:
+               return
+
+            self.snapshot_failures += 1
+
+            # The snapshot may still be due
+            with cond:
+               cond.wait(self.retry_interval)
+
+   def _snapshot_records(self):
+      expiries = self._expiries
+
+      for key, token, val in self._pairs():
+         yield (INSERT, key, token, val, expiries.get(key))
+
+   def snapshot(self):
+      """\
+      Writes a snapshot of the store to its journal, replacing the logs.
+      """
+
+      if self.journal is None:
+         raise ValueError('the store has no journal')
+
+      with self._snapshot_lock:
+         if self._closed:
+            raise ValueError('the store is closed')
+
+         self._expire()
+
+         self.journal.write_snapshot(self._snapshot_records(), 
+            lambda: self._high + 1)
+
+   def close(self):
+      """\
+      Stops writing snapshots and closes the journal, if there is one. A
+      snapshot in progress is finished first.
+      """
+
+      if self.journal is None:
+         return
+
+      with self._snapshot_cond:
+         self._closed = True
+         self._snapshot_cond.notify_all()
+
+      with self._snapshot_lock:
+         self.journal.close()
+
+   def next_formatted_pair(self):
+      # The keygen's iterator is shared by every thread
+      with self._keygen_lock:
+         pair = super(MemoryStore, self).next_formatted_pair()
+
+         if self.journal is not None:
+            self._high = max(self._high, self._keygen.decode(pair.key))
+
+      return pair
+
+   def insert(self, val, ttl=None):
+      """\
+      Inserts a value and returns a :class:`Pair <shorten.Pair>`. If 
+      :attr:`ttl` is given, the pair is removed after that many seconds.
+      """
+
+      if ttl is not None and ttl <= 0:
+         raise ValueError('ttl must be positive')
+
+      self._expire()
+      pair = self.next_formatted_pair()
+      key, token = pair[0], pair[1]
+
+      expires = None if ttl is None else self.clock() + ttl
+      sequence = None
+
+      held = self._locks.acquire(key, token)
+
+      try:
+         if self._lookup(key) is not None:
+            raise KeyInsertError(key, 'key exists')
+
+         if self._token_key(token) is not None:
+            raise TokenInsertError(token, 'token exists')
+
+         self._put(pair, val)
+
+         if expires is not None:
+            self._expiries[key] = expires
+
+         if self.journal is not None:
+            sequence = self._log_insert(key, token, val, expires)
+      finally:
+         self._locks.release(held)
+
+      # Pushed once the stripes are released, since expiry acquires them
+      # after the heap
+      if expires is not None:
+         with self._expiry_lock:
+            heapq.heappush(self._expiry_heap, (expires, key))
+
+      if sequence is not None:
+         self._commit(sequence)
+
+      if self._referenced is not None:
+         self._evict()
+
       return Pair(key, token)
 
+   def _log_insert(self, key, token, val, expires):
+      # Pairs are logged after they are stored, so that a snapshot taken
+      # after the log is rotated contains every pair logged before it
+      try:
+         return self.journal.append((INSERT, key, token, val, expires))
+      except Exception:
+         self._delete(key, token)
+         self._expiries.pop(key, None)
+         raise
+
    def revoke(self, token):
-      formatted_token = self.format_token(token)
+      self._expire()
+      key = self._token_key(token)
 
-      try:
-         key = self._tokens[formatted_token]
-      except KeyError:
+      if key is None:
          raise RevokeError(token, 'token not found')
-        
-      formatted_key = self.format_key(key)
 
-      del self._data[formatted_key]
-      del self._tokens[formatted_token]
+      sequence = None
+      held = self._locks.acquire(key, token)
+
+      try:
+         # The token may have been revoked while waiting
+         if self._token_key(token) != key:
+            raise RevokeError(token, 'token not found')
+
+         self._delete(key, token)
+         self._expiries.pop(key, None)
+
+         # Logged under the stripes, so that records of a pair are in order
+         if self.journal is not None:
+            sequence = self.journal.append((REVOKE, key, token))
+      finally:
+         self._locks.release(held)
+
+      if sequence is not None:
+         self._commit(sequence)
 
    def get_value(self, key):
-      key = self.format_key(key)
-      return self._data[key][0]
+      self._expire()
+      record = self._lookup(key)
+
+      if record is None:
+         raise KeyError(key)
+
+      if self._referenced is not None:
+         self._referenced[record[2]] = 1
+
+      return record[0]
 
    def has_key(self, key):
-      return self.format_key(key) in self._data
+      self._expire()
+      return self._lookup(key) is not None
       
    def has_token(self, token):      
-      return self.format_token(token) in self._tokens
+      self._expire()
+      return self._token_key(token) is not None
 
    def get_token(self, key):
-      key = self.format_key(key)
-      return self._data[key][1]
+      self._expire()
+      record = self._lookup(key)
+
+      if record is None:
+         raise KeyError(key)
+
+      return record[1]
 
    def __iter__(self):
       """\
-      Iterates over all keys.
+      Iterates over all (formatted) keys.
       """
-      return iter(self._data)
+      self._expire()
+      return iter(list(self._data))
+
+   def __len__(self):
+      """\
+      The number of keys in the store.
+      """
+      self._expire()
+      return len(self._data)
+
+# Marks empty and revoked slots of a DenseMemoryStore
+_TOMBSTONE = object()
+
+# The number of slots a DenseMemoryStore grows by at once
+GROW_CHUNK = 1024
+
+# The number of decoded keys a DenseMemoryStore caches
+SLOT_CACHE_SIZE = 16384
+
+def _function(cls, name):
+   method = getattr(cls, name)
+
+   # Python 2 wraps functions in a new unbound method on every access
+   return getattr(method, '__func__', method)
+
+class DenseMemoryStore(MemoryStore):
+   """\
+   Stores keys, tokens and data in memory, like 
+   :class:`MemoryStore <shorten.MemoryStore>`, but in slots of a list 
+   instead of dicts. A key is stored in slot ``decode(key) - start``, so
+   no per-key string or tuple is kept. Keys of up to five single-character
+   symbols are decoded two symbols at a time from the codec's table, 
+   without calling the codec. Decoding still costs more than hashing, so
+   the slots of up to :data:`SLOT_CACHE_SIZE` recently decoded keys are 
+   cached, and looking up a recently used key costs a dict lookup of the
+   unformatted key and an index. A key's slot never changes, so the cache
+   is only cleared when it is full. Lookups of keys that are not cached 
+   are slower than in a :class:`MemoryStore <shorten.MemoryStore>`.
+
+   Tokens are kept in a parallel list. A token equal to its key (the 
+   default :class:`TokenGenerator <shorten.TokenGenerator>`) is not stored 
+   at all; other tokens are also mapped to their slot in a dict. Revoked 
+   and expired slots are tombstoned, and never reused.
+
+   The store grows to the largest slot inserted, so it should only be used
+   with keygens that yield consecutive values, such as a
+   :class:`MemoryKeygen <shorten.MemoryKeygen>`. Slots are computed with 
+   the alphabet's codec, so keygens that override `encode` or `decode`,
+   such as a :class:`ScrambledKeygen <shorten.ScrambledKeygen>`, are 
+   rejected. It takes the same parameters as a 
+   :class:`MemoryStore <shorten.MemoryStore>`.
+
+   Values are kept in a list of references. An :mod:`array` cannot hold 
+   arbitrary values, and a slab of serialized values would have to copy 
+   every value on each lookup.
+   """
+
+   def _create_storage(self):
+      if self._referenced is not None:
+         raise ValueError('a DenseMemoryStore cannot be bounded')
+
+      for name in ('encode', 'decode'):
+         if _function(type(self._keygen), name) is not \
+               _function(BaseKeyGenerator, name):
+            raise ValueError('a DenseMemoryStore cannot use a keygen that '
+               'overrides {0}'.format(name))
+
+      self._offset = self._keygen.start
+      self._zero = self._keygen.alphabet[0]
+
+      codec = self._keygen.codec
+      self._decode = codec.decode
+      self._chunk = codec.chunk
+      self._digits = codec.mapping
+
+      # Values of every pair of symbols, for single-character alphabets
+      if codec.width == 2:
+         self._pair_digits = codec._decode_table
+      else:
+         self._pair_digits = None
+
+      self._slot_cache = {}
+
+      self._values = []
+      self._slot_tokens = []
+      self._grow_lock = Lock(self._runtime)
+
+      # The number of keys in each stripe, which is guarded by its lock
+      self._counts = [0] * len(self._locks)
+
+      # Slots of tokens that differ from their key
+      self._data = None
+      self._tokens = {}
+
+   def _slot(self, key):
+      """\
+      Returns the slot of :attr:`key`, or `None` if it is outside of the 
+      store.
+      """
+
+      try:
+         slot = self._slot_cache.get(key)
+      except TypeError:
+         return None
+
+      if slot is None:
+         slot = self._decode_slot(key)
+
+      return slot
+
+   def _decode_slot(self, key):
+      """\
+      Decodes the slot of :attr:`key` and caches it, returning `None` if it
+      is outside of the store.
+      """
+
+      try:
+         pairs = self._pair_digits
+         zero = self._zero
+         length = len(key)
+
+         # Keys with leading zero-digits would share a slot. Most keys fit
+         # in a few pairs of symbols, so the codec's loop is avoided.
+         if pairs is None or length > 5:
+            if key.startswith(zero) and key != zero:
+               return None
+
+            slot = self._decode(key)
+         elif length > 1 and key[0] == zero:
+            return None
+         elif length == 4:
+            slot = self._chunk*pairs[key[:2]] + pairs[key[2:]]
+         elif length == 5:
+            chunk = self._chunk
+            slot = chunk*(chunk*self._digits[key[0]] + pairs[key[1:3]]) + \
+               pairs[key[3:]]
+         elif length == 3:
+            slot = self._chunk*self._digits[key[0]] + pairs[key[1:]]
+         elif length == 2:
+            slot = pairs[key]
+         else:
+            slot = self._digits[key]
+
+      except (KeyError, ValueError, TypeError, AttributeError):
+         return None
+
+      slot -= self._offset
+
+      if not 0 <= slot < len(self._values):
+         return None
+
+      # Slots are never removed, so cached slots stay in the store. The 
+      # cache is cleared rather than evicted from, which is cheaper.
+      cache = self._slot_cache
+
+      if len(cache) >= SLOT_CACHE_SIZE:
+         cache.clear()
+
+      cache[key] = slot
+      return slot
+
+   def _lookup(self, key):
+      slot = self._slot(key)
+
+      if slot is None:
+         return None
+
+      val = self._values[slot]
+
+      if val is _TOMBSTONE:
+         return None
+
+      token = self._slot_tokens[slot]
+      return (val, key if token is None else token)
+
+   def _token_key(self, token):
+      slot = self._tokens.get(token)
+
+      if slot is not None:
+         return self._keygen.encode(slot + self._offset)
+
+      # Tokens equal to their key are only stored in the key's slot
+      slot = self._slot(token)
+
+      if slot is None or self._values[slot] is _TOMBSTONE or \
+            self._slot_tokens[slot] is not None:
+         return None
+
+      return token
+
+   def _put(self, pair, val):
+      key, token = pair[0], pair[1]
+
+      # The codec's, like every other slot computation
+      slot = self._decode(key) - self._offset
+
+      if slot < 0:
+         raise KeyInsertError(key, 'key precedes the start of the store')
+
+      values = self._values
+
+      if slot >= len(values):
+         with self._grow_lock:
+            grow = slot + 1 - len(values)
+
+            # Grown in chunks, so that appending rarely takes the lock
+            if grow > 0:
+               grow = max(grow, GROW_CHUNK)
+
+               # Tokens first, so that every slot of a value has a token
+               self._slot_tokens.extend([None] * grow)
+               values.extend([_TOMBSTONE] * grow)
+
+      # The token is set first, so that readers never see the value with
+      # the wrong token
+      if token != key:
+         self._slot_tokens[slot] = token
+         self._tokens[token] = slot
+
+      values[slot] = val
+
+      # The caller holds the key's stripe
+      self._counts[self._locks.stripe(key)] += 1
+
+   def _delete(self, key, token):
+      slot = self._slot(key)
+
+      self._values[slot] = _TOMBSTONE
+      self._slot_tokens[slot] = None
+      self._tokens.pop(token, None)
+      self._counts[self._locks.stripe(key)] -= 1
+
+   def _pairs(self):
+      encode = self._keygen.encode
+      offset = self._offset
+
+      # Copied, so that pairs can be inserted and revoked meanwhile
+      tokens = self._slot_tokens[:]
+      values = self._values[:len(tokens)]
+
+      for slot, val in enumerate(values):
+         if val is not _TOMBSTONE:
+            key = encode(slot + offset)
+            token = tokens[slot]
+            yield key, key if token is None else token, val
+
+   def get_value(self, key):
+      if self._expiry_heap:
+         self._expire()
+
+      # The common case of a cached key is inlined
+      slot = self._slot_cache.get(key)
+
+      if slot is None:
+         slot = self._decode_slot(key)
+
+      if slot is not None:
+         val = self._values[slot]
+
+         if val is not _TOMBSTONE:
+            return val
+
+      raise KeyError(key)
+
+   def has_key(self, key):
+      self._expire()
+      slot = self._slot(key)
+
+      return slot is not None and self._values[slot] is not _TOMBSTONE
+
+   def __iter__(self):
+      """\
+      Iterates over all (formatted) keys.
+      """
+
+      self._expire()
+
+      encode = self._keygen.encode
+      offset = self._offset
+
+      return (self.format_key(encode(slot + offset)) 
+         for slot, val in enumerate(self._values) if val is not _TOMBSTONE)
 
    def __len__(self):
       """\
       The number of keys in the store.
       """
-      return len(self._data)       
+      self._expire()
+      return sum(self._counts)
@@ -0,0 +1,273 @@
+import time
+import threading
+
+from collections import deque
+from itertools import islice
+
+from .key import BaseKeyGenerator
+from .lock import Condition, detect_runtime
+
+__all__ = ['KeyPool']
+
+def spawn_thread(target):
+   thread = threading.Thread(target=target)
+   thread.daemon = True
+   thread.start()
+   return thread
+
+class KeyPool(BaseKeyGenerator):
+   """\
+   Wraps any keygen with a bounded pool of pre-generated keys (and
+   optionally their tokens), so that latency spikes in the keygen's backend
+   do not reach :meth:`insert`. A background worker refills the pool
+   whenever it drops below :attr:`low_water` keys.
+
+   To prefetch tokens as well, use the pool as both the keygen and the
+   token generator of a store:
+
+   ::
+
+      pool = KeyPool(RedisKeygen(redis_client=redis, counter_key='counter'),
+         token_gen=UUIDTokenGenerator(), size=1000)
+
+      store = RedisStore(redis_client=redis, key_gen=pool, token_gen=pool)
+
+      # ...
+
+      unused = pool.close()
+
+   With gevent, pass ``runtime='gevent'``, which runs the worker in a 
+   greenlet and waits on a condition that yields to other greenlets. This
+   is detected if gevent has monkey-patched :mod:`threading`. Otherwise the
+   pool waits on a thread condition, which would block every greenlet.
+
+   :meth:`close` stops the worker and returns the unused
+   :class:`tuples <tuple>` of keys and tokens. Keys that are never used
+   leave gaps in the key sequence. If the keygen fails, the error is raised
+   by the next iteration that finds the pool empty, and the worker retries
+   after :attr:`retry_interval` seconds.
+
+   :param key_gen:         the keygen to prefetch keys from.
+
+   :param token_gen:       a token generator to prefetch tokens from. If
+                           `None`, tokens are the keys themselves. Only
+                           give a token generator if the pool is also the
+                           store's token generator.
+
+   :param size:            the largest number of keys in the pool.
+
+   :param low_water:       the number of keys below which the pool is
+                           refilled. Defaults to a quarter of :attr:`size`.
+
+   :param spawn:           a function that runs its argument in the
+                           background. Defaults to :func:`gevent.spawn` 
+                           for the ``gevent`` runtime, and to a daemon 
+                           thread otherwise.
+
+   :param retry_interval:  the number of seconds to wait after the keygen
+                           raises an error.
+
+   :param runtime:         the runtime to wait for refills in (see
+                           :func:`Condition <shorten.lock.Condition>`).
+   """
+
+   def __init__(self, key_gen=None, token_gen=None, size=1000, low_water=None,
+         spawn=None, retry_interval=1.0, runtime=None):
+      if key_gen is None:
+         raise ValueError('a keygen is required')
+
+      if runtime is None:
+         runtime = detect_runtime()
+
+      if runtime == 'gevent':
+         import gevent
+         spawn = spawn or gevent.spawn
+         self._sleep = gevent.sleep
+      else:
+         self._sleep = time.sleep
+
+      super(KeyPool, self).__init__(alphabet=getattr(key_gen, 'alphabet', None),
+         start=0)
+
+      if low_water is None:
+         low_water = size // 4
+
+      self.key_gen = key_gen
+      self.token_gen = token_gen
+      self.size = max(1, size)
+      self.low_water = min(low_water, self.size - 1)
+      self.retry_interval = retry_interval
+
+      # Metrics
+      self.refills = 0
+      self.misses = 0
+
+      self._pairs = deque()
+      self._tokens = {}
+      self._keys = iter(key_gen)
+      self._cond = Condition(runtime)
+      self._closed = False
+      self._filling = False
+      self._error = None
+
+      self._worker = (spawn or spawn_thread)(self._refill)
+
+   def __len__(self):
+      """\
+      The number of keys in the pool.
+      """
+      return len(self._pairs)
+
+   @property
+   def fill_level(self):
+      """\
+      The fraction of the pool that is filled, between 0 and 1.
+      """
+      return len(self._pairs) / float(self.size)
+
+   def _generate(self, n):
+      next_n = getattr(self.key_gen, 'next_n', None)
+      keys = None
+
+      if next_n is not None:
+         try:
+            keys = next_n(n)
+         except NotImplementedError:
+            pass
+
+      if keys is None:
+         keys = list(islice(self._keys, n))
+
+      if self.token_gen is None:
+         return [(key, key) for key in keys]
+
+      create_token = self.token_gen.create_token
+      return [(key, create_token(key)) for key in keys]
+
+   def _refill(self):
+      cond = self._cond
+
+      while True:
+         with cond:
+            while not self._closed and len(self._pairs) > self.low_water:
+               cond.wait()
+
+            if self._closed:
+               return
+
+            self._filling = True
+            n = self.size - len(self._pairs)
+
+         try:
+            pairs = self._generate(n)
+            error = None
+         except Exception as e:
+            pairs = []
+            error = e
+
+         with cond:
+            self._filling = False
+            self._error = error
+            self._pairs.extend(pairs)
+            self.refills += 1
+            cond.notify_all()
+
+         if error is not None:
+            self._sleep(self.retry_interval)
+
+   def take(self):
+      """\
+      Removes a key and its token from the pool and returns them as a
+      :class:`tuple`. Waits for the pool to be refilled if it is empty, or
+      returns `None` if the pool is empty and closed.
+      """
+
+      cond = self._cond
+
+      with cond:
+         if not self._pairs:
+            self.misses += 1
+
+         while not self._pairs:
+            if self._error is not None:
+               raise self._error
+
+            if self._closed:
+               return None
+
+            cond.notify_all()
+            cond.wait()
+
+         pair = self._pairs.popleft()
+
+         if len(self._pairs) <= self.low_water:
+            cond.notify_all()
+
+      return pair
+
+   def create_token(self, key):
+      """\
+      Returns the prefetched token for :attr:`key`, which must have been
+      taken from the pool.
+      """
+
+      try:
+         return self._tokens.pop(key)
+      except KeyError:
+         pass
+
+      if self.token_gen is None:
+         return key
+
+      return self.token_gen.create_token(key)
+
+   def close(self):
+      """\
+      Stops refilling the pool, waiting for a refill in progress to finish,
+      and returns the unused keys and tokens as a list of
+      :class:`tuples <tuple>`.
+      """
+
+      cond = self._cond
+
+      with cond:
+         self._closed = True
+         cond.notify_all()
+
+         while self._filling:
+            cond.wait()
+
+         pairs = list(self._pairs)
+         self._pairs.clear()
+
+      return pairs
+
+   def _pop_key(self):
+      pair = self.take()
+
+      if pair is None:
+         return None
+
+      key, token = pair
+
+      if self.token_gen is not None:
+         self._tokens[key] = token
+
+      return key
+
+   def next_n(self, n):
+      keys = [self._pop_key() for i in range(0, n)]
+
+      if None in keys:
+         raise ValueError('the pool is closed')
+
+      return keys
+
+   def __iter__(self):
+      while True:
+         key = self._pop_key()
+
+         if key is None:
+            return
+
+         yield key
@@ -1,18 +1,146 @@
 # Needed to import from the PyRedis package
 from __future__ import absolute_import
 
+import time
+
+from itertools import islice
+from zlib import crc32
+
 from redis import WatchError
 
 from .base import BaseStore, Pair
 
-from .key import BaseKeyGenerator
-from .formatter import FormatterMixin
-from .errors import KeyInsertError, TokenInsertError
+from .key import CounterKeyGenerator
+from .cache import LocalCache
+from .pool import spawn_thread
+from .formatter import FormatterMixin, find_affixes
+from .errors import KeyInsertError, TokenInsertError, RevokeError
+
+# Results of INSERT_SCRIPT
+INSERTED, KEY_EXISTS, TOKEN_EXISTS = 0, 1, 2
+
+# KEYS: formatted key, formatted token
+# ARGV: value, token, key and optionally a TTL in milliseconds
+INSERT_SCRIPT = """\
+if redis.call('exists', KEYS[1]) == 1 then
+   return 1
+end
+
+if redis.call('exists', KEYS[2]) == 1 then
+   return 2
+end
+
+redis.call('hmset', KEYS[1], 'value', ARGV[1], 'token', ARGV[2])
+redis.call('set', KEYS[2], ARGV[3])
+
+if ARGV[4] then
+   redis.call('pexpire', KEYS[1], ARGV[4])
+   redis.call('pexpire', KEYS[2], ARGV[4])
+end
+
+return 0
+"""
+
+# KEYS: formatted token
+# ARGV: the formatter's key prefix and suffix
+REVOKE_SCRIPT = """\
+local key = redis.call('get', KEYS[1])
+
+if not key then
+   return 0
+end
+
+redis.call('del', ARGV[1] .. key .. ARGV[2], KEYS[1])
+return key
+"""
+
+# KEYS: key bucket, token bucket
+# ARGV: key, token, packed token and value, packed key and key bucket id
+BUCKET_INSERT_SCRIPT = """\
+if redis.call('hexists', KEYS[1], ARGV[1]) == 1 then
+   return 1
+end
+
+if redis.call('hexists', KEYS[2], ARGV[2]) == 1 then
+   return 2
+end
+
+redis.call('hset', KEYS[1], ARGV[1], ARGV[3])
+redis.call('hset', KEYS[2], ARGV[2], ARGV[4])
+return 0
+"""
+
+# KEYS: token bucket
+# ARGV: token, the prefix and suffix of key bucket names
+BUCKET_REVOKE_SCRIPT = """\
+local packed = redis.call('hget', KEYS[1], ARGV[1])
+
+if not packed then
+   return 0
+end
+
+local sep = string.find(packed, '\\0', 1, true)
+local key = string.sub(packed, 1, sep - 1)
+local bucket = string.sub(packed, sep + 1)
+
+redis.call('hdel', KEYS[1], ARGV[1])
+redis.call('hdel', ARGV[2] .. bucket .. ARGV[3], key)
+return 1
+"""
+
+# Cache lookups return this for missing values
+_MISSING = object()
+
+def ttl_milliseconds(ttl):
+   """\
+   Converts a TTL in seconds to a whole number of milliseconds.
+   """
+
+   if ttl <= 0:
+      raise ValueError('ttl must be positive')
+
+   return max(1, int(ttl * 1000))
+
+def _text(value):
+   if isinstance(value, bytes) and not isinstance(value, str):
+      return value.decode('utf-8')
+
+   return value
+
+def _pack(token, val):
+   """\
+   Packs a token and a value into one hash field. Tokens cannot contain
+   a NUL character, so the first one separates them.
+   """
+
+   if not isinstance(val, (bytes, type(u''))):
+      val = str(val)
+
+   if isinstance(val, bytes):
+      if not isinstance(token, bytes):
+         token = token.encode('utf-8')
+
+      return token + b'\x00' + val
+
+   return u'{0}\x00{1}'.format(token, val)
+
+def _unpack(packed):
+   """\
+   Returns the token and the value packed by :func:`_pack`.
+   """
+   sep = b'\x00' if isinstance(packed, bytes) else u'\x00'
+   token, _, val = packed.partition(sep)
+   return token, val
 
-class RedisKeygen(BaseKeyGenerator):
+class RedisKeygen(CounterKeyGenerator):
    """\
    Creates keys in Redis. Keys are always generated in increasing order.
 
+   If :attr:`lease_size` is given, blocks of counter values are reserved 
+   with a single ``INCRBY``. If :attr:`stripes` is given, increments are 
+   spread over several counter keys, which may live on different nodes
+   (see :class:`CounterKeyGenerator <shorten.key.CounterKeyGenerator>`).
+
    :param redis:           an open Redis connection.
    :param counter_key:     the Redis key in which to store the keygen's
                            counter value.
@@ -30,17 +158,11 @@ class RedisKeygen(BaseKeyGenerator):
       self.counter_key = counter_key
       self.redis = redis_client
 
-   def __iter__(self):
-      """\
-      Increments the Redis counter and yields a new key.
-      """
-    
-      ckey = self.counter_key
-      start = self.start
-  
-      while True:           
-         i = self.redis.incr(ckey) + start - 1      
-         yield self.encode(i)
+   def _incr(self, counter_key, count):
+      if count == 1:
+         return self.redis.incr(counter_key)
+
+      return self.redis.incrby(counter_key, count)
 
 class RedisStore(BaseStore, FormatterMixin):
    """\
@@ -59,8 +181,34 @@ class RedisStore(BaseStore, FormatterMixin):
                       counter value.
 
    `redis_client`     an open Redis connection.
+
+   `lease_size`       the number of counter values the keygen reserves
+                      at once.
+
+   `max_lease_size`   the largest number of counter values the keygen
+                      reserves at once.
+
+   `lease_interval`   the number of seconds a lease should last.
+
+   `stripes`          the number of counter keys to spread increments 
+                      over.
+
+   `stripe`           the counter key this store's keygen increments.
    =================  ===================================================
 
+   .. admonition:: Server-side Scripts
+
+      If `scripts` is `True`, :meth:`insert` and :meth:`revoke` run as Lua 
+      scripts (by ``EVALSHA``) that finish in one round trip and never
+      fail with a :class:`WatchError`. The scripts raise the same errors 
+      under the same conditions, but a failed insertion stores nothing.
+
+      :meth:`revoke` formats the key on the server, so the formatter must
+      only add a prefix and suffix to keys (like 
+      :class:`NamespacedFormatter <shorten.NamespacedFormatter>`). The 
+      key is not declared to the script, so keys and tokens must live on 
+      the same node.
+
    :param counter_key:     the Redis key in which to store the keygen's
                            counter value.
    :param key_gen:         a key generator. If `None`, a new key
@@ -68,6 +216,42 @@ class RedisStore(BaseStore, FormatterMixin):
 
    :param redis_client:    an open Redis connection.
    :type key_gen:          a RedisKeyGen or None
+
+   .. admonition:: Local Caching
+
+      Values never change once inserted, so if `cache_size` is given, up to
+      that many values are cached in-process by :meth:`get_value` (see 
+      :class:`LocalCache <shorten.cache.LocalCache>`). :meth:`revoke` 
+      removes the revoked key from this store's cache. To hear about 
+      revocations by other processes, a background worker subscribes to
+      the keyspace notifications for the store's keys, which must be 
+      enabled on the server:
+
+      ::
+
+         redis.config_set('notify-keyspace-events', 'Kgx')
+
+      A revoked value may still be returned for up to `cache_max_age` 
+      seconds if a notification is lost, and the cache is cleared whenever
+      the subscription is (re)established. Call :meth:`close` to stop the 
+      worker.
+
+   :param scripts:         if `True`, inserts and revokes run as Lua 
+                           scripts.
+
+   :param cache_size:      the number of values to cache locally. If 
+                           `None`, values are not cached.
+
+   :param cache_max_age:   the largest number of seconds a value is 
+                           cached for.
+
+   :param invalidate:      if `False`, revocations by other processes are
+                           not listened for, and are only seen once cached
+                           values expire.
+
+   :param spawn:           a function that runs its argument in the
+                           background (such as :func:`gevent.spawn`).
+                           Defaults to a daemon thread.
    """
   
    def __init__(self, **kwargs):
@@ -78,7 +262,17 @@ class RedisStore(BaseStore, FormatterMixin):
       alphabet = kwargs.pop('alphabet', None)
       min_length = kwargs.pop('min_length', None)
       start = kwargs.pop('start', None)
-      key_gen = kwargs.get('key_gen', None)
+      lease_size = kwargs.pop('lease_size', None)
+      max_lease_size = kwargs.pop('max_lease_size', None)
+      lease_interval = kwargs.pop('lease_interval', 1.0)
+      stripes = kwargs.pop('stripes', None)
+      stripe = kwargs.pop('stripe', None)
+      key_gen = kwargs.pop('key_gen', None)
+      scripts = kwargs.pop('scripts', False)
+      cache_size = kwargs.pop('cache_size', None)
+      cache_max_age = kwargs.pop('cache_max_age', 5.0)
+      invalidate = kwargs.pop('invalidate', True)
+      spawn = kwargs.pop('spawn', None)
 
       if redis_client is None:
          raise ValueError('a Redis client is required')
@@ -86,14 +280,149 @@ class RedisStore(BaseStore, FormatterMixin):
       # Create a reasonable keygen if it isn't provided
       if key_gen is None:
          key_gen = RedisKeygen(redis_client=redis_client, alphabet=alphabet, 
-               counter_key=counter_key, min_length=min_length, start=start)
+               counter_key=counter_key, min_length=min_length, start=start,
+               lease_size=lease_size, max_lease_size=max_lease_size,
+               lease_interval=lease_interval, stripes=stripes, stripe=stripe)
 
       super(RedisStore, self).__init__(key_gen=key_gen, **kwargs)
 
       self.redis = redis_client
       self.counter_key = counter_key
 
-   def insert(self, val, pipe=None):
+      if scripts:
+         self._key_affixes = self.key_affixes()
+         self._insert_script = redis_client.register_script(INSERT_SCRIPT)
+         self._revoke_script = redis_client.register_script(REVOKE_SCRIPT)
+      else:
+         self._insert_script = None
+         self._revoke_script = None
+
+      # Registered on the first insert with a TTL
+      self._expiring_insert_script = None
+
+      self.retry_interval = 1.0
+      self._closed = False
+      self._pubsub = None
+      self._listener = None
+
+      if cache_size:
+         self.cache = LocalCache(max_entries=cache_size, 
+            max_age=cache_max_age)
+
+         if invalidate:
+            self._listener = (spawn or spawn_thread)(self._listen)
+      else:
+         self.cache = None
+
+   def _invalidation_pattern(self):
+      """\
+      Returns the pattern of keyspace notification channels for this store's
+      keys.
+      """
+
+      db = self.redis.connection_pool.connection_kwargs.get('db', 0)
+
+      try:
+         prefix, suffix = self.key_affixes()
+         keys = _escape_pattern(prefix) + '*' + _escape_pattern(suffix)
+      except ValueError:
+         keys = '*'
+
+      return '__keyspace@{0}__:{1}'.format(db, keys)
+
+   def _invalidate_channel(self, channel):
+      """\
+      Removes the key that a keyspace notification was published for from 
+      the cache.
+      """
+
+      if not isinstance(channel, str):
+         channel = channel.decode('utf-8')
+
+      self.cache.invalidate(channel.partition(':')[2])
+
+   def _listen(self):
+      pattern = self._invalidation_pattern()
+
+      while not self._closed:
+         pubsub = self.redis.pubsub()
+
+         try:
+            pubsub.psubscribe(pattern)
+            self._pubsub = pubsub
+
+            for message in pubsub.listen():
+               if self._closed:
+                  break
+
+               if message['type'] == 'pmessage':
+                  self._invalidate_channel(message['channel'])
+               elif message['type'] == 'psubscribe':
+                  # Revocations may have been missed while unsubscribed
+                  self.cache.clear()
+
+         except Exception:
+            if self._closed:
+               break
+
+            self.cache.clear()
+            time.sleep(self.retry_interval)
+
+         finally:
+            self._pubsub = None
+
+            try:
+               pubsub.close()
+            except Exception:
+               pass
+
+   def close(self):
+      """\
+      Stops listening for revocations by other processes.
+      """
+
+      self._closed = True
+      pubsub = self._pubsub
+
+      if pubsub is not None:
+         try:
+            pubsub.punsubscribe()
+         except Exception:
+            pass
+
+   def _call_insert_script(self, client, val, pair, ttl=None):
+      key, token, formatted_key, formatted_token = pair
+      args = [val, token, key]
+      script = self._insert_script
+
+      if ttl is not None:
+         args.append(ttl_milliseconds(ttl))
+
+         if script is None:
+            if self._expiring_insert_script is None:
+               self._expiring_insert_script = \
+                  self.redis.register_script(INSERT_SCRIPT)
+
+            script = self._expiring_insert_script
+
+      return script(keys=[formatted_key, formatted_token], args=args,
+         client=client)
+
+   def _insert_result(self, code, key, token):
+      """\
+      Returns a :class:`Pair <shorten.Pair>` or the error for a result of
+      the insert script.
+      """
+
+      if code == KEY_EXISTS:
+         return KeyInsertError(key, 'key exists')
+
+      if code == TOKEN_EXISTS:
+         return TokenInsertError(token, 'token exists')
+
+      return Pair(key, token)
+
+   def insert(self, val, pipe=None, ttl=None):
       """\
       Inserts a value and returns a :class:`Pair <shorten.Pair>`.
 
@@ -120,11 +449,37 @@ class RedisStore(BaseStore, FormatterMixin):
             raise TokenInsertError(token)
 
 
+      If the store uses scripts or :attr:`ttl` is given, the last result 
+      is ``0`` if the pair was inserted, ``1`` if the key exists and ``2`` 
+      if the token exists.
+
+      If :attr:`ttl` is given, the key and token expire after that many
+      seconds. Expiring inserts always run as a script (see above), so that
+      an expiry is never set on records the insert did not create.
+
       :attr val:     a value to insert.
       :attr pipe:    a Redis pipeline. If `None`, the pair will
                      be returned immediately. Otherwise they must be
                      extracted from the pipeline results (see above).
+      :attr ttl:     the number of seconds the pair lasts. If `None`, it 
+                     lasts until it is revoked.
       """
+
+      if self._insert_script is not None or ttl is not None:
+         pair = self.next_formatted_pair()
+         key, token = pair[:2]
+
+         code = self._call_insert_script(pipe or self.redis, val, pair, ttl)
+
+         if pipe is not None:
+            return Pair(key, token)
+
+         result = self._insert_result(code, key, token)
+
+         if isinstance(result, Exception):
+            raise result
+
+         return result
      
       p = self.redis.pipeline() if pipe is None else pipe
       
@@ -160,6 +515,80 @@ class RedisStore(BaseStore, FormatterMixin):
          if pipe is None:
             p.reset()                  
  
+   def insert_many(self, values, chunk_size=1000, ttl=None):
+      """\
+      Inserts every value in :attr:`values` and returns a list with a 
+      :class:`Pair <shorten.Pair>` for each value, in order. 
+
+      Values are sent in chunks of :attr:`chunk_size`, each in a single
+      pipelined transaction, so a chunk costs one round trip. Keys for a
+      whole chunk are taken from the keygen at once (see 
+      :meth:`next_n <shorten.BaseKeyGenerator.next_n>`).
+
+      A value that cannot be inserted does not fail the rest of the batch. 
+      Its entry in the list is a 
+      :class:`KeyInsertError <shorten.KeyInsertError>` or 
+      :class:`TokenInsertError <shorten.TokenInsertError>` instead:
+
+      ::
+
+         for result in store.insert_many(urls):
+            if isinstance(result, Exception):
+               print('Cannot insert')
+      
+      :attr values:     an iterable of values to insert.
+      :attr chunk_size: the number of values to send in each pipeline.
+      :attr ttl:        the number of seconds each pair lasts (see 
+                        :meth:`insert`).
+      """
+
+      values = iter(values)
+      results = []
+
+      while True:
+         chunk = list(islice(values, chunk_size))
+
+         if not chunk:
+            break
+
+         pairs = self.next_formatted_pairs(len(chunk))
+
+         if self._insert_script is not None or ttl is not None:
+            results.extend(self._insert_chunk_scripted(chunk, pairs, ttl))
+            continue
+
+         with self.redis.pipeline() as p:
+            for val, pair in zip(chunk, pairs):
+               key, token, formatted_key, formatted_token = pair
+
+               p.hsetnx(formatted_key, 'value', val)
+               p.hsetnx(formatted_key, 'token', token)
+               p.setnx(formatted_token, key)
+
+            replies = p.execute()
+
+         for i, pair in enumerate(pairs):
+            value_set, token_set, token_key_set = replies[3*i:3*i+3]
+
+            if not value_set or not token_set:
+               results.append(KeyInsertError(pair.key, 'key exists'))
+            elif not token_key_set:
+               results.append(TokenInsertError(pair.token, 'token exists'))
+            else:
+               results.append(Pair(pair.key, pair.token))
+
+      return results
+
+   def _insert_chunk_scripted(self, chunk, pairs, ttl=None):
+      with self.redis.pipeline(transaction=False) as p:
+         for val, pair in zip(chunk, pairs):
+            self._call_insert_script(p, val, pair, ttl)
+
+         codes = p.execute()
+
+      return [self._insert_result(code, pair.key, pair.token) 
+         for code, pair in zip(codes, pairs)]
+
    def revoke(self, token, pipe=None):
       """\
       Revokes the key associated with the given revokation token.
@@ -181,15 +610,32 @@ class RedisStore(BaseStore, FormatterMixin):
             raise RevokeError(token)
          
 
+      If values are cached locally, the key is removed from the cache once
+      it is deleted. With a `pipe`, that is up to the caller: after 
+      executing the pipeline, pass the revoked key to :meth:`uncache`. With
+      scripts, the key is the script's result; otherwise it is returned.
+
       :param pipe:   a Redis pipeline. If `None`, the token will
                      be revoked immediately. Otherwise they must be
                      extracted from the pipeline results (see above).
       """
       
-      p = self.redis.pipeline() if pipe is None else pipe    
-      
       formatted_token = self.format_token(token)
 
+      if self._revoke_script is not None:
+         key = self._revoke_script(keys=[formatted_token], 
+            args=list(self._key_affixes), client=pipe or self.redis)
+
+         if pipe is None:
+            if not key:
+               raise RevokeError(token, 'token not found')
+
+            self.uncache(_text(key))
+
+         return
+
+      p = self.redis.pipeline() if pipe is None else pipe    
+
       try:         
          p.watch(formatted_token)
 
@@ -200,10 +646,16 @@ class RedisStore(BaseStore, FormatterMixin):
          # Make this atomic
          p.multi()
          p.delete(formatted_key, formatted_token)
-        
-         if pipe is None:
-            if not p.execute()[-1]:
-               raise RevokeError(token, 'token not found')         
+
+         if pipe is not None:
+            return _text(key)
+
+         if not p.execute()[-1]:
+            raise RevokeError(token, 'token not found')         
+
+         # Only after the delete, or a concurrent read could cache the
+         # value again
+         self.uncache(_text(key))
 
       except WatchError:
          raise
@@ -212,18 +664,86 @@ class RedisStore(BaseStore, FormatterMixin):
          if pipe is None:
             p.reset()
 
+   def uncache(self, key):
+      """\
+      Removes :attr:`key` from the local cache, if values are cached.
+      """
+
+      if self.cache is not None:
+         self.cache.invalidate(self.format_key(key))
+
    def get_value(self, key):
       key = self.format_key(key)
+      cache = self.cache
+
+      if cache is not None:
+         value = cache.get(key, _MISSING)
+
+         if value is not _MISSING:
+            return value
+
+         generation = cache.generation
+
       value = self.redis.hget(key, 'value')
 
       if value is None:
          raise KeyError(key)
-      else:
-         return value
+
+      if cache is not None:
+         cache.put(key, value, generation)
+
+      return value
 
    def has_key(self, key):
       key = self.format_key(key)
       return self.redis.exists(key)
+
+   def _pipelined(self, keys, command, chunk_size):
+      """\
+      Calls :attr:`command` with a pipeline and each formatted key, sending 
+      at most :attr:`chunk_size` commands per round trip, and returns the
+      replies in order.
+      """
+
+      keys = iter(keys)
+      replies = []
+
+      while True:
+         chunk = list(islice(keys, chunk_size))
+
+         if not chunk:
+            return replies
+
+         with self.redis.pipeline(transaction=False) as p:
+            for key in chunk:
+               command(p, self.format_key(key))
+
+            replies.extend(p.execute())
+
+   def get_many(self, keys, default=None, chunk_size=1000):
+      """\
+      Returns a list with the value of each key in :attr:`keys`, in order,
+      or :attr:`default` for keys that do not exist.
+
+      Lookups are pipelined in chunks of :attr:`chunk_size`, so that large
+      batches cost a few round trips without blocking the server for long.
+      """
+
+      replies = self._pipelined(keys, lambda p, key: p.hget(key, 'value'),
+         chunk_size)
+
+      return [default if value is None else value for value in replies]
+
+   def has_keys(self, keys, chunk_size=1000):
+      """\
+      Returns a list of booleans, `True` for each key in :attr:`keys` that
+      exists in this store. Lookups are pipelined like :meth:`get_many`.
+      """
+
+      replies = self._pipelined(keys, lambda p, key: p.exists(key), 
+         chunk_size)
+
+      return [bool(exists) for exists in replies]
       
    def has_token(self, token):
       token = self.format_token(token)
@@ -233,3 +753,306 @@ class RedisStore(BaseStore, FormatterMixin):
       key = self.format_key(key)
       return self.redis.hget(key, 'token')
 
+
+class BucketedRedisStore(RedisStore):
+   """\
+   Stores keys, tokens and data in Redis, grouped into small hashes to cut
+   the per-key overhead of :class:`RedisStore`.
+
+   Keys are bucketed by their decoded id: every :attr:`bucket_size` 
+   consecutive ids share one hash, in which each key's token and value are
+   packed into a single field. Tokens are spread over :attr:`token_buckets`
+   hashes by their CRC-32, each mapping tokens to their keys and the ids of
+   their keys' hashes. Inserts and revokes run as Lua scripts (see 
+   :class:`RedisStore`), so they take one round trip and never fail with a 
+   :class:`WatchError`.
+
+   ::
+
+      store = BucketedRedisStore(redis_client=redis, counter_key='counter',
+         formatter=NamespacedFormatter('links'), bucket_size=100,
+         token_buckets=2 ** 20)
+
+   Redis keeps small hashes in a compact encoding (a listpack, or a 
+   ziplist before Redis 7) as long as they have at most 
+   ``hash-max-listpack-entries`` fields of at most 
+   ``hash-max-listpack-value`` bytes. The default limits are 128 fields of
+   64 bytes, so :attr:`bucket_size` should stay below the first and the 
+   second should usually be raised to fit a token and a value. 
+   :attr:`token_buckets` should be about the expected number of tokens 
+   divided by :attr:`bucket_size`.
+
+   Hash fields cannot expire on their own, so inserts cannot be given a
+   `ttl`. Keys must come from a keygen that hands out dense ids (counter-based
+   or scrambled keygens, but not a 
+   :class:`SnowflakeKeygen <shorten.SnowflakeKeygen>`), and tokens cannot
+   contain a NUL character. As with scripts in :class:`RedisStore`, the
+   formatter must only add a prefix and suffix to keys. Existing stores can
+   be moved over with 
+   :func:`migrate_to_buckets <shorten.redis_store.migrate_to_buckets>`.
+
+   Takes the same parameters as :class:`RedisStore`, except `scripts` and
+   `cache_size`, and:
+
+   :param bucket_size:     the number of consecutive key ids per hash.
+   :param token_buckets:   the number of hashes to spread tokens over.
+
+   :param key_bucket_prefix:     a string that the names of key hashes 
+                                 start with, before they are formatted 
+                                 by the store's formatter.
+
+   :param token_bucket_prefix:   a string that the names of token hashes
+                                 start with. It must differ from 
+                                 :attr:`key_bucket_prefix`, or keys and 
+                                 tokens would share hashes.
+   """
+
+   def __init__(self, **kwargs):
+      bucket_size = kwargs.pop('bucket_size', 100)
+      token_buckets = kwargs.pop('token_buckets', 2 ** 16)
+      key_bucket_prefix = kwargs.pop('key_bucket_prefix', 'key-buckets:')
+      token_bucket_prefix = kwargs.pop('token_bucket_prefix', 
+         'token-buckets:')
+      kwargs.pop('scripts', None)
+
+      if kwargs.get('cache_size'):
+         raise ValueError('bucketed stores cannot cache values')
+
+      if bucket_size < 1 or token_buckets < 1:
+         raise ValueError('buckets cannot be empty')
+
+      if key_bucket_prefix == token_bucket_prefix:
+         raise ValueError('key and token buckets need different prefixes')
+
+      super(BucketedRedisStore, self).__init__(**kwargs)
+
+      self.bucket_size = bucket_size
+      self.token_buckets = token_buckets
+      self.key_bucket_prefix = key_bucket_prefix
+      self.token_bucket_prefix = token_bucket_prefix
+
+      # The revoke script names key buckets itself
+      self._key_bucket_affixes = find_affixes(lambda bucket: 
+         self.format_key(key_bucket_prefix + bucket))
+
+      self._insert_script = self.redis.register_script(BUCKET_INSERT_SCRIPT)
+      self._revoke_script = self.redis.register_script(BUCKET_REVOKE_SCRIPT)
+
+   def key_bucket(self, key):
+      """\
+      Returns the formatted name of the hash that holds :attr:`key`.
+      """
+
+      return self.format_key('{0}{1}'.format(self.key_bucket_prefix, 
+         self._key_bucket_id(key)))
+
+   def _key_bucket_id(self, key):
+      return self._keygen.decode(key) // self.bucket_size
+
+   def token_bucket(self, token):
+      """\
+      Returns the formatted name of the hash that holds :attr:`token`.
+      """
+
+      if not isinstance(token, bytes):
+         token = token.encode('utf-8')
+
+      bucket = (crc32(token) & 0xffffffff) % self.token_buckets
+      return self.format_token('{0}{1}'.format(self.token_bucket_prefix, 
+         bucket))
+
+   def _call_insert_script(self, client, val, pair, ttl=None):
+      if ttl is not None:
+         raise ValueError('bucketed stores cannot expire keys')
+
+      key, token = pair[:2]
+      bucket = self._key_bucket_id(key)
+
+      return self._insert_script(
+         keys=[self.format_key('{0}{1}'.format(self.key_bucket_prefix, 
+            bucket)), self.token_bucket(token)],
+         args=[key, token, _pack(token, val), _pack(key, bucket)], 
+         client=client)
+
+   def revoke(self, token, pipe=None):
+      """\
+      Revokes the key associated with the given revokation token.
+
+      If the token does not exist, a 
+      :class:`RevokeError <shorten.RevokeError>` is raised. If `pipe` is 
+      given, the last result of the pipeline is ``0`` if the token did not
+      exist.
+      """
+
+      prefix, suffix = self._key_bucket_affixes
+
+      revoked = self._revoke_script(keys=[self.token_bucket(token)],
+         args=[token, prefix, suffix], client=pipe or self.redis)
+
+      if pipe is None and not revoked:
+         raise RevokeError(token, 'token not found')
+
+   def _fetch_packed(self, keys, chunk_size):
+      """\
+      Returns the packed field of each key in :attr:`keys`, in order, with 
+      one ``HMGET`` per bucket and chunk.
+      """
+
+      keys = iter(keys)
+      replies = []
+
+      while True:
+         chunk = list(islice(keys, chunk_size))
+
+         if not chunk:
+            return replies
+
+         buckets = {}
+
+         for i, key in enumerate(chunk):
+            bucket = self._find_bucket(key)
+
+            if bucket is not None:
+               buckets.setdefault(bucket, []).append(i)
+
+         packed = [None] * len(chunk)
+
+         with self.redis.pipeline(transaction=False) as p:
+            for bucket, indexes in buckets.items():
+               p.hmget(bucket, [chunk[i] for i in indexes])
+
+            for indexes, fields in zip(buckets.values(), p.execute()):
+               for i, field in zip(indexes, fields):
+                  packed[i] = field
+
+         replies.extend(packed)
+
+   def _find_bucket(self, key):
+      """\
+      Returns the bucket of :attr:`key`, or `None` if it cannot be decoded 
+      (and so cannot be in the store).
+      """
+
+      try:
+         return self.key_bucket(key)
+      except ValueError:
+         return None
+
+   def _get_packed(self, key):
+      bucket = self._find_bucket(key)
+
+      if bucket is None:
+         return None
+
+      return self.redis.hget(bucket, key)
+
+   def get_value(self, key):
+      packed = self._get_packed(key)
+
+      if packed is None:
+         raise KeyError(key)
+
+      return _unpack(packed)[1]
+
+   def get_many(self, keys, default=None, chunk_size=1000):
+      """\
+      Returns a list with the value of each key in :attr:`keys`, in order,
+      or :attr:`default` for keys that do not exist. Keys in the same bucket
+      are fetched together.
+      """
+
+      return [default if packed is None else _unpack(packed)[1]
+         for packed in self._fetch_packed(keys, chunk_size)]
+
+   def has_key(self, key):
+      bucket = self._find_bucket(key)
+      return bucket is not None and self.redis.hexists(bucket, key)
+
+   def has_keys(self, keys, chunk_size=1000):
+      return [packed is not None 
+         for packed in self._fetch_packed(keys, chunk_size)]
+
+   def has_token(self, token):
+      return self.redis.hexists(self.token_bucket(token), token)
+
+   def get_token(self, key):
+      packed = self._get_packed(key)
+
+      if packed is None:
+         return None
+
+      return _unpack(packed)[0]
+
+def _escape_pattern(string):
+   for char in '\\*?[]':
+      string = string.replace(char, '\\' + char)
+
+   return string
+
+def migrate_to_buckets(source, target, chunk_size=1000, delete=False):
+   """\
+   Copies every key, token and value of a :class:`RedisStore` into a 
+   :class:`BucketedRedisStore`, and returns the number of keys copied. 
+   Keys that already exist in the target are skipped, so an interrupted
+   migration can be run again.
+
+   Keys are found with ``SCAN``, so the source's formatter must only add a 
+   prefix and suffix to keys. Both stores should share a keygen (or 
+   counter key), so that the target does not create keys that were 
+   copied over.
+
+   :param source:       the store to copy from.
+   :param target:       the store to copy to.
+   :param chunk_size:   the number of keys to copy per round trip.
+   :param delete:       if `True`, copied keys and tokens are deleted from
+                        the source.
+   """
+
+   prefix, suffix = source.key_affixes()
+   pattern = _escape_pattern(prefix) + '*' + _escape_pattern(suffix)
+   names = source.redis.scan_iter(match=pattern, count=chunk_size)
+   migrated = 0
+
+   while True:
+      chunk = list(islice(names, chunk_size))
+
+      if not chunk:
+         return migrated
+
+      with source.redis.pipeline(transaction=False) as p:
+         for name in chunk:
+            p.hmget(name, ['value', 'token'])
+
+         # Other keys (such as counters or buckets) may match the pattern
+         replies = p.execute(raise_on_error=False)
+
+      records = []
+
+      for name, reply in zip(chunk, replies):
+         if isinstance(reply, Exception) or None in reply:
+            continue
+
+         name = _text(name)
+         key = name[len(prefix):len(name) - len(suffix)]
+         val, token = reply
+         token = _text(token)
+
+         records.append((name, key, token, val))
+
+      with target.redis.pipeline(transaction=False) as p:
+         for name, key, token, val in records:
+            target._call_insert_script(p, val, (key, token))
+
+         codes = p.execute()
+
+      copied = [record for record, code in zip(records, codes) 
+         if code == INSERTED]
+
+      migrated += len(copied)
+
+      if delete and copied:
+         with source.redis.pipeline(transaction=False) as p:
+            for name, key, token, val in copied:
+               p.delete(name, source.format_token(token))
+
+            p.execute()
@@ -0,0 +1,213 @@
+from bisect import bisect
+from hashlib import md5
+
+__all__ = ['HashRing', 'MemcacheRing']
+
+def ring_hash(string):
+   """\
+   Returns a 32-bit position on the ring for :attr:`string`.
+   """
+
+   if not isinstance(string, bytes):
+      string = string.encode('utf-8')
+
+   return int(md5(string).hexdigest()[:8], 16)
+
+class HashRing(object):
+   """\
+   Assigns strings to nodes by consistent hashing. Each node is placed at
+   :attr:`vnodes` points on a ring of 32-bit hashes, and a string belongs
+   to the first node at or after its own hash. Adding or removing one of
+   `N` nodes only moves about ``1/N`` of the strings.
+
+   ::
+
+      ring = HashRing(['mc1', 'mc2', 'mc3'])
+
+      # 'mc2', for instance
+      ring.get_node('aardvark')
+
+   :param nodes:     an iterable of node names.
+   :param vnodes:    the number of points per node. More points spread
+                     strings more evenly.
+   """
+
+   def __init__(self, nodes=None, vnodes=160):
+      if vnodes < 1:
+         raise ValueError('nodes need at least one point on the ring')
+
+      self.vnodes = vnodes
+
+      self._nodes = set()
+      self._points = []
+      self._owners = []
+
+      for node in nodes or ():
+         self.add_node(node)
+
+   def __len__(self):
+      return len(self._nodes)
+
+   def __contains__(self, node):
+      return node in self._nodes
+
+   @property
+   def nodes(self):
+      """\
+      The names of the nodes on the ring.
+      """
+      return sorted(self._nodes)
+
+   def _rebuild(self):
+      points = []
+
+      for node in self._nodes:
+         for i in range(0, self.vnodes):
+            points.append((ring_hash('{0}-{1}'.format(node, i)), node))
+
+      # Ties are broken by node name, so every ring agrees
+      points.sort()
+
+      self._points = [point for point, node in points]
+      self._owners = [node for point, node in points]
+
+   def add_node(self, node):
+      """\
+      Adds :attr:`node` to the ring.
+      """
+
+      if node in self._nodes:
+         raise ValueError('{0} is already on the ring'.format(node))
+
+      self._nodes.add(node)
+      self._rebuild()
+
+   def remove_node(self, node):
+      """\
+      Removes :attr:`node` from the ring.
+      """
+
+      self._nodes.remove(node)
+      self._rebuild()
+
+   def get_node(self, string):
+      """\
+      Returns the node that :attr:`string` belongs to.
+      """
+
+      if not self._points:
+         raise ValueError('the ring is empty')
+
+      i = bisect(self._points, ring_hash(string))
+      return self._owners[i % len(self._owners)]
+
+class MemcacheRing(object):
+   """\
+   A Memcache client that spreads records over several clients with a
+   :class:`HashRing`. It implements the client methods used by
+   :class:`MemcacheStore <shorten.MemcacheStore>`; multi-key calls are sent
+   as one call per server.
+
+   Each record is placed by the string that :attr:`route` returns for its
+   name, so that related records can share a server. By default, names are
+   placed as they are.
+
+   :param clients:   a :class:`dict` of node names and Memcache clients.
+   :param vnodes:    the number of points per node on the ring.
+   :param route:     a function returning the string to place a record
+                     name by.
+   """
+
+   def __init__(self, clients, vnodes=160, route=None):
+      if not clients:
+         raise ValueError('at least one Memcache client is required')
+
+      self.clients = dict(clients)
+      self.ring = HashRing(self.clients, vnodes=vnodes)
+      self.route = route
+
+   def add_client(self, node, client):
+      """\
+      Adds a client to the ring. Records that now belong to it are not
+      moved, so they appear to be missing.
+      """
+
+      self.ring.add_node(node)
+      self.clients[node] = client
+
+   def remove_client(self, node):
+      """\
+      Removes a client from the ring.
+      """
+
+      self.ring.remove_node(node)
+      del self.clients[node]
+
+   def node_for(self, name):
+      """\
+      Returns the node name that the record :attr:`name` is placed on.
+      """
+
+      if self.route is not None:
+         name = self.route(name)
+
+      return self.ring.get_node(name)
+
+   def client_for(self, name):
+      """\
+      Returns the client that the record :attr:`name` is placed on.
+      """
+      return self.clients[self.node_for(name)]
+
+   def _group(self, names):
+      """\
+      Returns a :class:`dict` of clients and the names placed on them.
+      """
+
+      groups = {}
+
+      for name in names:
+         groups.setdefault(self.node_for(name), []).append(name)
+
+      return dict((self.clients[node], group)
+         for node, group in groups.items())
+
+   def get(self, name):
+      return self.client_for(name).get(name)
+
+   def set(self, name, val, time=0):
+      return self.client_for(name).set(name, val, time=time)
+
+   def add(self, name, val, time=0):
+      return self.client_for(name).add(name, val, time=time)
+
+   def delete(self, name):
+      return self.client_for(name).delete(name)
+
+   def incr(self, name, delta=1):
+      return self.client_for(name).incr(name, delta)
+
+   def get_multi(self, names):
+      found = {}
+
+      for client, group in self._group(names).items():
+         found.update(client.get_multi(group))
+
+      return found
+
+   def add_multi(self, mapping, time=0):
+      failed = []
+
+      for client, group in self._group(mapping).items():
+         failed.extend(client.add_multi(
+            dict((name, mapping[name]) for name in group), time=time))
+
+      return failed
+
+   def delete_multi(self, names):
+      deleted = True
+
+      for client, group in self._group(names).items():
+         deleted = client.delete_multi(group) and deleted
+
+      return deleted
@@ -0,0 +1,182 @@
+import hmac
+import struct
+
+from hashlib import sha256
+
+from .key import BaseKeyGenerator
+from .errors import KeyInsertError
+
+__all__ = ['FeistelPermutation', 'ScrambledKeygen']
+
+class FeistelPermutation(object):
+   """\
+   A keyed permutation of the integers ``0 .. a*b - 1``. Each value is split
+   into a digit in base `a` and a digit in base `b`, which are mixed over
+   several rounds of an alternating Feistel network (as in the FF1
+   format-preserving encryption mode). Unlike a binary Feistel network, the
+   result never leaves the domain, so both directions take a constant amount
+   of work.
+
+   ::
+
+      perm = FeistelPermutation(64, 64, secret='hunter2')
+
+      # True
+      perm.invert(perm.permute(42)) == 42
+
+   The permutation only obscures the order of values; it is not meant to
+   be cryptographically secure.
+
+   :param a:         the size of the most significant half of the domain.
+   :param b:         the size of the least significant half of the domain.
+   :param secret:    a string used to key the round function.
+   :param rounds:    the number of rounds. Must be even.
+   """
+
+   def __init__(self, a, b, secret, rounds=8):
+      if rounds < 2 or rounds % 2:
+         raise ValueError('rounds must be an even number')
+
+      if a < 1 or b < 1:
+         raise ValueError('the domain cannot be empty')
+
+      if not isinstance(secret, bytes):
+         secret = secret.encode('utf-8')
+
+      self.a = a
+      self.b = b
+      self.size = a * b
+      self.rounds = rounds
+
+      self._mac = hmac.new(secret, digestmod=sha256)
+
+   def _round(self, i, x):
+      mac = self._mac.copy()
+      mac.update('{0}:{1}'.format(i, x).encode('ascii'))
+      return struct.unpack('>Q', mac.digest()[:8])[0]
+
+   def _check(self, n):
+      if not 0 <= n < self.size:
+         raise ValueError('{0} is outside the domain of the permutation'
+            .format(n))
+
+   def permute(self, n):
+      """\
+      Returns the image of :attr:`n`.
+      """
+
+      self._check(n)
+
+      m, k = self.a, self.b
+      left, right = divmod(n, k)
+
+      for i in range(0, self.rounds):
+         left, right = right, (left + self._round(i, right)) % m
+         m, k = k, m
+
+      return int(left*k + right)
+
+   def invert(self, n):
+      """\
+      Returns the value whose image is :attr:`n`.
+      """
+
+      self._check(n)
+
+      m, k = self.a, self.b
+      left, right = divmod(n, k)
+
+      for i in range(self.rounds - 1, -1, -1):
+         m, k = k, m
+         left, right = (right - self._round(i, left)) % m, left
+
+      return int(left*k + right)
+
+class ScrambledKeygen(BaseKeyGenerator):
+   """\
+   Scrambles the keys of another keygen, so that consecutive keys appear
+   unrelated and are spread over the whole keyspace.
+
+   Each key from :attr:`key_gen` is decoded to its counter value and passed
+   through a :class:`FeistelPermutation` over ``len(alphabet) ** width``
+   values. Since the permutation is a bijection, scrambled keys never
+   collide as long as the wrapped keygen's do not. All keys are
+   :attr:`width` digits long.
+
+   ::
+
+      keygen = ScrambledKeygen(MemoryKeygen(start=0), secret='hunter2',
+         width=6)
+
+      store = MemoryStore(key_gen=keygen)
+      key, token = store.insert('aardvark')
+
+      # 0
+      keygen.decode(key)
+
+   A :class:`KeyInsertError <shorten.KeyInsertError>` is raised once the
+   wrapped keygen's counter passes the end of the keyspace.
+
+   :param key_gen:      the keygen to scramble. Its counter should start
+                        at 0 to make use of the whole keyspace.
+
+   :param secret:       a string used to key the permutation. Changing it
+                        changes every key.
+
+   :param width:        the length of each key.
+
+   :param alphabet:     the alphabet for scrambled keys. Defaults to the
+                        wrapped keygen's alphabet.
+
+   :param rounds:       the number of Feistel rounds.
+   """
+
+   def __init__(self, key_gen=None, secret=None, width=None, alphabet=None,
+         rounds=8):
+      if key_gen is None:
+         raise ValueError('a keygen is required')
+
+      if secret is None:
+         raise ValueError('a secret is required')
+
+      if not width:
+         raise ValueError('a key width is required')
+
+      alphabet = alphabet or key_gen.alphabet
+      super(ScrambledKeygen, self).__init__(alphabet=alphabet, start=0)
+
+      base = len(alphabet)
+
+      self.key_gen = key_gen
+      self.width = width
+      self.permutation = FeistelPermutation(base ** (width // 2),
+         base ** (width - width // 2), secret, rounds=rounds)
+
+   def scramble(self, n):
+      """\
+      Returns the key for counter value :attr:`n`.
+      """
+
+      try:
+         n = self.permutation.permute(n)
+      except ValueError:
+         raise KeyInsertError(n, 'keyspace exhausted')
+
+      return self.codec.encode(n, length=self.width)
+
+   def decode(self, key):
+      """\
+      Returns the counter value of a scrambled :attr:`key`.
+      """
+
+      return self.permutation.invert(self.codec.decode(key))
+
+   def next_n(self, n):
+      decode = self.key_gen.decode
+      return [self.scramble(decode(key)) for key in self.key_gen.next_n(n)]
+
+   def __iter__(self):
+      decode = self.key_gen.decode
+
+      for key in self.key_gen:
+         yield self.scramble(decode(key))
@@ -0,0 +1,140 @@
+import time
+import threading
+
+from .key import BaseKeyGenerator
+
+__all__ = ['SnowflakeKeygen']
+
+# 2013-01-01 00:00:00 UTC, in milliseconds
+DEFAULT_EPOCH = 1356998400000
+
+class SnowflakeKeygen(BaseKeyGenerator):
+   """\
+   Creates keys without any coordination between processes. Each key is an
+   integer made of a millisecond timestamp, a node id and a per-millisecond
+   sequence number (in that order, from the most significant bits),
+   encoded in the keygen's alphabet. Keys are unique as long as no two
+   running keygens share a node id.
+
+   ::
+
+      keygen = SnowflakeKeygen(node_id=7)
+      store = RedisStore(redis_client=redis, key_gen=keygen)
+
+      key, token = store.insert('aardvark')
+
+      # (timestamp, 7, 0)
+      keygen.parse(key)
+
+   When more than ``2 ** sequence_bits`` keys are requested within one
+   millisecond, the keygen waits for the next millisecond. If the clock
+   moves backwards, the keygen keeps counting from the last timestamp it
+   used instead (borrowing timestamps from the future as its sequence
+   overflows) until the clock catches up, so keys are never repeated
+   within a process. The number of times this happened is kept in
+   :attr:`clock_regressions`.
+
+   .. warning::
+
+      A process restarted while the clock is behind may repeat keys issued
+      before the restart. Stores will refuse to insert them with a
+      :class:`KeyInsertError <shorten.KeyInsertError>`.
+
+   :param node_id:         a number unique to this process, between 0 and
+                           ``2 ** node_bits - 1``.
+
+   :param epoch:           the time (in milliseconds since the Unix epoch)
+                           that timestamps are counted from.
+
+   :param node_bits:       the number of bits in the node id.
+   :param sequence_bits:   the number of bits in the sequence number.
+
+   :param alphabet:        the alphabet to encode keys in.
+   """
+
+   def __init__(self, node_id=None, epoch=DEFAULT_EPOCH, node_bits=10,
+         sequence_bits=12, alphabet=None, clock=time.time):
+      super(SnowflakeKeygen, self).__init__(alphabet=alphabet, start=0)
+
+      if node_id is None:
+         raise ValueError('a node id is required')
+
+      if not 0 <= node_id < 2 ** node_bits:
+         raise ValueError('node id must be between 0 and {0}'.format(
+            2 ** node_bits - 1))
+
+      self.node_id = node_id
+      self.epoch = epoch
+      self.node_bits = node_bits
+      self.sequence_bits = sequence_bits
+      self.clock = clock
+
+      self.clock_regressions = 0
+
+      self._max_sequence = 2 ** sequence_bits - 1
+      self._node = node_id << sequence_bits
+      self._timestamp_shift = node_bits + sequence_bits
+
+      self._last = -1
+      self._sequence = 0
+      self._lock = threading.Lock()
+
+   def _now(self):
+      return int(self.clock() * 1000) - self.epoch
+
+   def next_id(self):
+      """\
+      Returns the next (unencoded) id.
+      """
+
+      with self._lock:
+         now = self._now()
+         last = self._last
+
+         if now > last:
+            last = now
+            sequence = 0
+         else:
+            if now < last:
+               self.clock_regressions += 1
+
+            sequence = self._sequence + 1
+
+            if sequence > self._max_sequence:
+               sequence = 0
+
+               if now == last:
+                  # Wait for the clock to move on
+                  while now <= last:
+                     time.sleep(0.0001)
+                     now = self._now()
+
+                  last = now
+               else:
+                  # The clock is behind, so borrow the next millisecond
+                  last += 1
+
+         self._last = last
+         self._sequence = sequence
+
+      return (last << self._timestamp_shift) | self._node | sequence
+
+   def parse(self, key):
+      """\
+      Returns a :class:`tuple` of the timestamp (in milliseconds since the
+      Unix epoch), node id and sequence number of :attr:`key`.
+      """
+
+      n = self.decode(key)
+      sequence = n & self._max_sequence
+      node = (n >> self.sequence_bits) & (2 ** self.node_bits - 1)
+      timestamp = (n >> self._timestamp_shift) + self.epoch
+
+      return (timestamp, node, sequence)
+
+   def next_n(self, n):
+      return [self.encode(self.next_id()) for i in range(0, n)]
+
+   def __iter__(self):
+      while True:
+         yield self.encode(self.next_id())
@@ -0,0 +1,246 @@
+import time
+
+from .base import BaseStore
+from .cache import LocalCache
+
+__all__ = ['TieredStore']
+
+_MISSING = object()
+
+class TieredStore(BaseStore):
+   """\
+   Puts a bounded, in-process cache (L1) in front of any store (L2), such
+   as a :class:`RedisStore <shorten.RedisStore>` or
+   :class:`MemcacheStore <shorten.MemcacheStore>`.
+
+   ::
+
+      store = TieredStore(RedisStore(redis_client=redis,
+         counter_key='counter'), max_entries=100000)
+
+      key, token = store.insert('aardvark')
+
+      # Served from L1
+      store[key]
+
+   Values are read from L1 when possible, and from L2 on a miss, after
+   which they are cached. Inserted values are written through to L1, so
+   new links are cached immediately. Keys that L2 does not have are also
+   cached for :attr:`negative_max_age` seconds, so that repeated lookups of
+   missing keys do not reach L2. Keys, tokens and pairs are created by L2.
+
+   Revoking a token through the store removes its key from L1. The store
+   remembers the keys of tokens it has inserted or looked up; if a token
+   is not known, all of L1 is cleared. Revocations by other processes are
+   not seen, so an entry can be stale for up to :attr:`max_age` seconds.
+
+   Pairs inserted through the store with a `ttl` are never cached past
+   their expiry: the store remembers when up to :attr:`max_entries` of them
+   expire, and caps the lifetime of their L1 entries. The expiry of pairs
+   inserted by other processes is not known, so, like a revocation, it can
+   be missed for up to :attr:`max_age` seconds.
+
+   :param store:              the store to cache.
+
+   :param max_entries:        the largest number of values to cache.
+
+   :param max_age:            the number of seconds a value is cached for,
+                              or `None` to cache values until they are
+                              evicted or revoked through the store.
+
+   :param negative_max_age:   the number of seconds a missing key is
+                              cached for, or `None` to not cache missing
+                              keys.
+   """
+
+   def __init__(self, store, max_entries=10000, max_age=5.0,
+         negative_max_age=1.0, clock=time.time):
+      if store is None:
+         raise ValueError('a store is required')
+
+      # Keys and tokens are created by the cached store, so the base class
+      # is not initialized
+      self.store = store
+      self.max_age = max_age
+      self.clock = clock
+
+      self.cache = LocalCache(max_entries=max_entries, max_age=max_age,
+         clock=clock)
+
+      if negative_max_age is None:
+         self.negative_cache = None
+      else:
+         self.negative_cache = LocalCache(max_entries=max_entries,
+            max_age=negative_max_age, clock=clock)
+
+      self._token_keys = LocalCache(max_entries=max_entries)
+
+      # When the pairs inserted with a ttl expire
+      self._expiries = LocalCache(max_entries=max_entries)
+
+   @property
+   def key_gen(self):
+      return self.store.key_gen
+
+   @property
+   def token_gen(self):
+      return self.store.token_gen
+
+   @property
+   def hits(self):
+      """\
+      The number of lookups answered by L1, including missing keys.
+      """
+
+      hits = self.cache.hits
+
+      if self.negative_cache is not None:
+         hits += self.negative_cache.hits
+
+      return hits
+
+   @property
+   def misses(self):
+      """\
+      The number of lookups that reached L2.
+      """
+
+      if self.negative_cache is not None:
+         return self.negative_cache.misses
+
+      return self.cache.misses
+
+   @property
+   def hit_ratio(self):
+      """\
+      The fraction of lookups answered by L1, between 0 and 1.
+      """
+
+      hits = self.hits
+      lookups = hits + self.misses
+
+      return hits / float(lookups) if lookups else 0.0
+
+   @property
+   def miss_ratio(self):
+      """\
+      The fraction of lookups that reached L2, between 0 and 1.
+      """
+
+      misses = self.misses
+      lookups = self.hits + misses
+
+      return misses / float(lookups) if lookups else 0.0
+
+   def next_formatted_pair(self):
+      return self.store.next_formatted_pair()
+
+   def next_keys(self, n):
+      return self.store.next_keys(n)
+
+   def next_formatted_pairs(self, n):
+      return self.store.next_formatted_pairs(n)
+
+   def insert(self, val, **kwargs):
+      """\
+      Inserts a value into L2 and caches it, returning a
+      :class:`Pair <shorten.Pair>`. Keyword arguments, such as `ttl`, are
+      passed to L2.
+      """
+
+      key, token = pair = self.store.insert(val, **kwargs)
+      ttl = kwargs.get('ttl')
+
+      # The key may have been looked up before it was inserted
+      if self.negative_cache is not None:
+         self.negative_cache.invalidate(key)
+
+      if ttl is not None:
+         self._expiries.put(key, self.clock() + ttl)
+
+      # Cached until the pair expires at the latest
+      self.cache.put(key, val, max_age=ttl)
+      self._token_keys.put(token, key)
+
+      return pair
+
+   def revoke(self, token):
+      self.store.revoke(token)
+
+      key = self._token_keys.get(token, _MISSING)
+
+      if key is _MISSING:
+         self.cache.clear()
+      else:
+         self._token_keys.invalidate(token)
+         self.cache.invalidate(key)
+
+   def get_value(self, key):
+      cache = self.cache
+      val = cache.get(key, _MISSING)
+
+      if val is not _MISSING:
+         return val
+
+      negative_cache = self.negative_cache
+
+      if negative_cache is None:
+         generation = cache.generation
+
+         # Raises a KeyError for missing keys
+         val = self.store.get_value(key)
+      else:
+         if negative_cache.get(key, _MISSING) is not _MISSING:
+            raise KeyError(key)
+
+         generation = cache.generation
+         missing_generation = negative_cache.generation
+
+         try:
+            val = self.store.get_value(key)
+         except KeyError:
+            # Not cached if the key was inserted meanwhile
+            negative_cache.put(key, True, missing_generation)
+            raise
+
+      # Not cached if the key was revoked meanwhile, or after it expires
+      expires = self._expiries.get(key)
+
+      if expires is None:
+         cache.put(key, val, generation)
+      else:
+         remaining = expires - self.clock()
+
+         if remaining > 0:
+            cache.put(key, val, generation, max_age=remaining)
+
+      return val
+
+   def has_key(self, key):
+      try:
+         self.get_value(key)
+      except KeyError:
+         return False
+
+      return True
+
+   def has_token(self, token):
+      return self.store.has_token(token)
+
+   def get_token(self, key):
+      token = self.store.get_token(key)
+
+      if token is not None:
+         self._token_keys.put(token, key)
+
+      return token
+
+   def close(self):
+      """\
+      Closes L2, if it can be closed.
+      """
+
+      close = getattr(self.store, 'close', None)
+
+      if close is not None:
+         close()
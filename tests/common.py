@@ -1,4 +1,5 @@
 import sys
+import time
 import functools
 from types import MethodType
 
@@ -19,6 +20,18 @@ def die_nicely(*args):
    msg = 'greenlet died'
    gevent.hub.get_hub().parent.throw(SystemExit(msg))
 
+def wait_until(predicate, timeout=5.0, sleep=time.sleep):
+   """\
+   Polls :attr:`predicate` until it returns `True`, and fails if it does
+   not within :attr:`timeout` seconds.
+   """
+
+   deadline = time.time() + timeout
+
+   while not predicate():
+      assert time.time() < deadline, 'timed out waiting'
+      sleep(0.01)
+
 # Reuse the same key and token
 def wrap_next_formatted_pair(store, key, token):   
    FormattedPair = shorten.base.FormattedPair
@@ -0,0 +1,51 @@
+import pickle
+
+import nose
+
+import shorten
+from shorten import alphabets
+from shorten.alphabets import Alphabet
+
+EMOTICONS = (':)', ':(', ':D', ';)', ';(', 'D:', ':o', ':/')
+
+def test_get_is_shared():
+   assert alphabets.get(alphabets.DEFAULT) is alphabets.get(alphabets.DEFAULT)
+
+   compiled = alphabets.get(alphabets.HEX)
+   assert alphabets.get(compiled) is compiled
+
+   # Unhashable definitions are shared by their symbols
+   assert alphabets.get(list(EMOTICONS)) is alphabets.get(list(EMOTICONS))
+   assert alphabets.get(list(EMOTICONS)) is alphabets.get(EMOTICONS)
+
+def test_keygens_share_alphabets():
+   first = shorten.MemoryKeygen(alphabet=alphabets.HEX)
+   second = shorten.MemoryKeygen(alphabet=alphabets.HEX)
+
+   assert first.alphabet is second.alphabet
+
+def test_invalid_alphabets():
+   for symbols in ['', 'aba', ('0', '00', '1'), ('a', '')]:
+      nose.tools.assert_raises(ValueError, lambda: Alphabet(symbols))
+
+def test_multi_character_symbols():
+   alphabet = alphabets.get(EMOTICONS)
+
+   assert alphabet.encode(12) == ':(;('
+   assert alphabet.decode(':(;(') == 12
+
+   for i in range(0, 1000):
+      assert alphabet.decode(alphabet.encode(i)) == i
+
+   nose.tools.assert_raises(ValueError, lambda: alphabet.decode(':(:x'))
+
+def test_variable_length_symbols():
+   store = shorten.MemoryStore(alphabet=('x', 'yy', 'zzz'), start=5)
+   key, token = store.insert('aardvark')
+
+   assert key == 'yyzzz'
+   assert store[key] == 'aardvark'
+
+def test_alphabet_pickles():
+   alphabet = alphabets.get(EMOTICONS)
+   assert pickle.loads(pickle.dumps(alphabet)) is alphabet
@@ -0,0 +1,143 @@
+import sys
+
+import nose
+
+if sys.version_info < (3, 6):
+   raise nose.SkipTest('AsyncRedisStore requires Python 3.6')
+
+import asyncio
+
+import redis.asyncio
+
+import shorten
+from common import TokenGen
+
+NAMESPACE = 'shorten:nose_tests:async'
+COUNTER_KEY = 'shorten:nose_tests:async:counter'
+
+class Formatter(object):
+   def format_key(self, key):
+      return '{ns}:keys:{key}'.format(ns=NAMESPACE, key=key)
+
+   def format_token(self, token):
+      return '{ns}:tokens:{token}'.format(ns=NAMESPACE, token=token)
+
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+def run(coroutine):
+   return loop.run_until_complete(coroutine)
+
+class TestAsyncRedisStore(object):
+   alphabet = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ-_'
+
+   @classmethod
+   def setup_class(cls):
+      cls.redis = redis.asyncio.Redis(decode_responses=True)
+
+   def setup_method(self, method=None):
+      keys = run(self.redis.keys('{0}:*'.format(NAMESPACE)))
+
+      if keys:
+         run(self.redis.delete(*keys))
+
+   teardown_method = setup_method
+
+   # nose only runs setUp and tearDown
+   setUp = setup_method
+   tearDown = teardown_method
+
+   def get_store(self):
+      return shorten.AsyncRedisStore(
+            redis_client=self.redis,
+            counter_key=COUNTER_KEY,
+            token_gen=TokenGen(),
+            formatter=Formatter(),
+            start=0,
+            alphabet=self.alphabet)
+
+   def test_insert(self):
+      store = self.get_store()
+      key, token = pair = run(store.insert('aardvark'))
+
+      assert isinstance(pair, shorten.Pair)
+      assert run(store.get_value(key)) == 'aardvark'
+      assert run(store.get_token(key)) == token
+
+      assert run(store.has_key(key))
+      assert run(store.has_token(token))
+
+   def test_missing_key(self):
+      store = self.get_store()
+      nose.tools.assert_raises(KeyError, run, store.get_value('missing'))
+
+      assert run(store.get('missing', 'default')) == 'default'
+      assert not run(store.has_key('missing'))
+      assert not run(store.has_token('missing'))
+
+   def test_insert_existing_key(self):
+      store = self.get_store()
+      key, token = run(store.insert('aardvark'))
+      run(self.redis.delete(COUNTER_KEY))
+
+      # The new keygen starts over at the first key
+      store = self.get_store()
+      nose.tools.assert_raises(shorten.KeyInsertError, run,
+         store.insert('bonobo'))
+
+   def test_revoke(self):
+      store = self.get_store()
+      key, token = run(store.insert('aardvark'))
+      run(store.revoke(token))
+
+      assert not run(store.has_key(key))
+      assert not run(store.has_token(token))
+
+      nose.tools.assert_raises(shorten.RevokeError, run,
+         store.revoke(token))
+
+   def test_insert_with_ttl(self):
+      store = self.get_store()
+      key, token = run(store.insert('aardvark', ttl=10))
+
+      formatted_key = Formatter().format_key(key)
+
+      assert 0 < run(self.redis.pttl(formatted_key)) <= 10000
+      assert run(store.get_value(key)) == 'aardvark'
+
+   def test_concurrent_inserts(self):
+      store = shorten.AsyncRedisStore(
+            redis_client=self.redis,
+            counter_key=COUNTER_KEY,
+            formatter=Formatter(),
+            lease_size=10)
+
+      inserts = [store.insert('aardvark') for i in range(0, 50)]
+      pairs = run(asyncio.gather(*inserts))
+
+      assert len(set(pairs)) == 50
+      assert int(run(self.redis.get(COUNTER_KEY))) <= 50
+
+   def test_keygen_next_n(self):
+      store = self.get_store()
+      keys = run(store.next_keys(5))
+
+      assert keys == ['0', '1', '2', '3', '4']
+      assert run(store.next_formatted_pair()).key == '5'
+
+   def test_keygen_requires_async_for(self):
+      store = self.get_store()
+      nose.tools.assert_raises(TypeError, iter, store.key_gen)
+
+   def test_sync_access_raises(self):
+      store = self.get_store()
+      key, token = run(store.insert('aardvark'))
+
+      nose.tools.assert_raises(TypeError, lambda: key in store)
+      nose.tools.assert_raises(TypeError, lambda: store[key])
+
+      def revoke():
+         del store[token]
+
+      nose.tools.assert_raises(TypeError, revoke)
+      assert run(store.has_token(token))
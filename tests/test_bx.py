@@ -1,6 +1,7 @@
 import nose
 
-from shorten.key import bx_encode, bx_decode
+import shorten.key
+from shorten.key import bx_encode, bx_decode, encode_range, Codec, get_codec
 
 def test_bx_encode_wrong_type():
    alphabet = 'abc'
@@ -38,3 +39,63 @@ def test_bx_encode_decode_deadbeef():
    deadbeef = bx_decode(deadbeef, alphabet)
    assert deadbeef == 0xdeadbeef
 
+def test_codec_matches_bx_encode():
+   alphabet = '0123456789abcdef'
+
+   for width in (1, 2, 3):
+      codec = Codec(alphabet, width=width)
+
+      for n in range(0, 5000):
+         string = codec.encode(n)
+         assert string == '%x' % n
+         assert codec.decode(string) == n
+
+def test_codec_padding():
+   codec = Codec('0123456789abcdef')
+
+   assert codec.encode(255, length=4) == '00ff'
+   assert codec.encode(0, length=3) == '000'
+   assert codec.encode(0x12345, length=2) == '12345'
+   assert codec.decode('00ff') == 255
+
+def test_codec_multi_character_symbols():
+   emoticons = (':)', ':(', ':D', ';)', ';(', 'D:', ':o', ':/')
+   codec = Codec(emoticons)
+
+   assert codec.encode(12) == ':(;('
+   assert codec.encode(12, length=3) == ':):(;('
+
+def test_codec_invalid_digit():
+   codec = Codec('abc')
+
+   nose.tools.assert_raises(ValueError, lambda: codec.decode('abcd'))
+   nose.tools.assert_raises(ValueError, lambda: codec.decode(''))
+   nose.tools.assert_raises(ValueError, lambda: codec.encode(-1))
+
+def test_get_codec_is_shared():
+   alphabet = '0123456789abcdef'
+
+   assert get_codec(alphabet) is get_codec(alphabet)
+   assert get_codec(list(alphabet)).encode(255) == 'ff'
+
+def test_encode_range():
+   alphabet = '0123456789abcdef'
+   expected = ['%x' % i for i in range(250, 5000)]
+
+   assert encode_range(250, 5000, alphabet) == expected
+   assert encode_range(250, 5000, alphabet, use_numpy=False) == expected
+
+def test_encode_range_numpy():
+   # encode_range silently falls back to the odometer without NumPy
+   if shorten.key.numpy is None:
+      raise nose.SkipTest('NumPy is not installed')
+
+   alphabet = '0123456789abcdef'
+   expected = ['%x' % i for i in range(250, 5000)]
+
+   assert shorten.key._encode_range_numpy(250, 5000, alphabet) == expected
+   assert encode_range(250, 5000, alphabet, use_numpy=True) == expected
+
+def test_encode_range_empty():
+   assert encode_range(5, 5, 'abc') == []
+   assert encode_range(5, 1, 'abc') == []
@@ -0,0 +1,70 @@
+from shorten.cache import LocalCache
+
+def test_get_and_put():
+   cache = LocalCache(max_entries=10)
+   cache.put('a', 'aardvark')
+
+   assert cache.get('a') == 'aardvark'
+   assert cache.get('b', 'default') == 'default'
+   assert cache.hits == 1 and cache.misses == 1
+   assert cache.hit_ratio == 0.5
+
+def test_evicts_least_recently_used():
+   cache = LocalCache(max_entries=2)
+   cache.put('a', 'aardvark')
+   cache.put('b', 'bonobo')
+
+   # 'b' is now the least recently used
+   cache.get('a')
+   cache.put('c', 'caiman')
+
+   assert len(cache) == 2
+   assert 'a' in cache and 'c' in cache
+   assert 'b' not in cache
+
+def test_max_age():
+   now = [0]
+   cache = LocalCache(max_age=5, clock=lambda: now[0])
+   cache.put('a', 'aardvark')
+
+   now[0] = 4.9
+   assert cache.get('a') == 'aardvark'
+
+   now[0] = 5
+   assert cache.get('a') is None
+
+def test_entry_max_age():
+   now = [0]
+   cache = LocalCache(max_age=5, clock=lambda: now[0])
+   cache.put('a', 'aardvark', max_age=1)
+   cache.put('b', 'bonobo', max_age=10)
+
+   now[0] = 1
+   assert cache.get('a') is None
+
+   now[0] = 4.9
+   assert cache.get('b') == 'bonobo'
+
+   now[0] = 5
+   assert cache.get('b') is None
+
+def test_invalidate():
+   cache = LocalCache()
+   cache.put('a', 'aardvark')
+   cache.invalidate('a')
+   cache.invalidate('missing')
+
+   assert 'a' not in cache
+
+def test_stale_generation_is_not_cached():
+   cache = LocalCache()
+   generation = cache.generation
+
+   # Invalidated while the value was being fetched
+   cache.invalidate('a')
+   cache.put('a', 'aardvark', generation)
+
+   assert 'a' not in cache
+
+   cache.put('a', 'aardvark', cache.generation)
+   assert cache.get('a') == 'aardvark'
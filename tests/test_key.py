@@ -0,0 +1,48 @@
+import nose
+
+from shorten.key import LeaseSizer
+
+class FakeClock(object):
+   def __init__(self):
+      self.now = 0.0
+
+   def __call__(self):
+      return self.now
+
+def test_lease_fixed_size():
+   sizer = LeaseSizer(10)
+
+   for i in range(0, 5):
+      assert sizer.next_size() == 10
+
+def test_lease_grows_when_busy():
+   clock = FakeClock()
+   sizer = LeaseSizer(10, max_size=40, interval=1.0, clock=clock)
+
+   sizes = []
+   for i in range(0, 4):
+      sizes.append(sizer.next_size())
+      clock.now += 0.1
+
+   assert sizes == [10, 20, 40, 40]
+
+def test_lease_shrinks_when_idle():
+   clock = FakeClock()
+   sizer = LeaseSizer(10, max_size=40, interval=1.0, clock=clock)
+
+   for i in range(0, 3):
+      sizer.next_size()
+      clock.now += 0.1
+
+   clock.now += 5
+   assert sizer.next_size() == 20
+
+   clock.now += 5
+   assert sizer.next_size() == 10
+
+   clock.now += 5
+   assert sizer.next_size() == 10
+
+def test_lease_invalid_size():
+   sizer = LeaseSizer(0)
+   assert sizer.next_size() == 1
@@ -0,0 +1,104 @@
+import threading
+
+import gevent
+import nose
+
+from shorten.lock import Lock, Condition, StripedLock
+
+def test_lock_is_exclusive():
+   for runtime in ('threading', 'gevent', 'asyncio'):
+      lock = Lock(runtime)
+
+      assert lock.acquire()
+      assert not lock.acquire(False)
+
+      lock.release()
+      assert lock.acquire(False)
+      lock.release()
+
+def test_lock_context_manager():
+   lock = Lock('threading')
+
+   with lock:
+      assert not lock.acquire(False)
+
+   assert lock.acquire(False)
+
+def test_invalid_runtime():
+   nose.tools.assert_raises(ValueError, Lock, 'twisted')
+   nose.tools.assert_raises(ValueError, Condition, 'twisted')
+
+def test_condition_notifies_greenlets():
+   cond = Condition('gevent')
+   woken = []
+
+   def waiter(i):
+      with cond:
+         cond.wait()
+         woken.append(i)
+
+   greenlets = [gevent.spawn(waiter, i) for i in range(0, 3)]
+   gevent.sleep(0)
+
+   with cond:
+      cond.notify()
+
+   gevent.sleep(0)
+   assert woken == [0]
+
+   with cond:
+      cond.notify_all()
+
+   gevent.joinall(greenlets)
+   assert woken == [0, 1, 2]
+
+def test_condition_wait_timeout():
+   for runtime in ('threading', 'gevent'):
+      cond = Condition(runtime)
+
+      with cond:
+         assert not cond.wait(0.01)
+
+      assert cond.acquire(False)
+      cond.release()
+
+def test_striped_lock_orders_stripes():
+   locks = StripedLock(stripes=8)
+   names = ['aardvark', 'bonobo', 'caribou', 'aardvark']
+
+   held = locks.acquire(*names)
+
+   assert held == sorted(set(locks.stripe(name) for name in names))
+
+   for i in held:
+      assert not locks.locks[i].acquire(False)
+
+   locks.release(held)
+
+   for i in held:
+      assert locks.locks[i].acquire(False)
+
+def test_striped_lock_threads():
+   locks = StripedLock(stripes=4)
+   counts = dict((name, 0) for name in 'abcdefgh')
+
+   def increment():
+      for i in range(0, 1000):
+         for name in counts:
+            held = locks.acquire(name, 'x')
+
+            try:
+               current = counts[name]
+               counts[name] = current + 1
+            finally:
+               locks.release(held)
+
+   threads = [threading.Thread(target=increment) for i in range(0, 4)]
+
+   for thread in threads:
+      thread.start()
+
+   for thread in threads:
+      thread.join()
+
+   assert set(counts.values()) == set([4000])
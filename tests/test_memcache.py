@@ -1,3 +1,5 @@
+import time
+
 import pylibmc
 import shorten
 import nose
@@ -23,6 +25,31 @@ def test_make_store():
    assert store
    assert isinstance(store, shorten.MemcacheStore)
 
+class TokenFromList(object):
+   def __init__(self, tokens):
+      self.tokens = iter(tokens)
+
+   def create_token(self, key):
+      return next(self.tokens)
+
+class CountingClient(object):
+   """\
+   Counts the calls made to a Memcache client.
+   """
+
+   def __init__(self, mc):
+      self.mc = mc
+      self.calls = []
+
+   def __getattr__(self, name):
+      method = getattr(self.mc, name)
+
+      def call(*args, **kwargs):
+         self.calls.append(name)
+         return method(*args, **kwargs)
+
+      return call
+
 class TestMemcacheStore(BaseStoreTest, GeventTestMixin):
    many_num = 1
    formatter = Formatter()
@@ -58,6 +85,306 @@ class TestMemcacheStore(BaseStoreTest, GeventTestMixin):
 
       return store
 
-   def tearDown(self):
+   def setup_method(self, method=None):
+      self.mc.flush_all()
+
+   def teardown_method(self, method=None):
+      self.mc.flush_all()
+
+   # nose only runs setUp and tearDown
+   setUp = setup_method
+   tearDown = teardown_method
+
+   def test_insert_with_ttl(self):
+      store = self.get_store()
+      key, token = store.insert('aardvark', ttl=1)
+      forever = store.insert('bonobo')
+
+      assert store[key] == 'aardvark'
+
+      # Memcache expiry has a resolution of one second
+      time.sleep(2.1)
+
+      assert key not in store
+      assert not store.has_token(token)
+      assert store[forever.key] == 'bonobo'
+
+   def test_insert_many(self):
+      store = self.get_store()
+      values = list(self.make_some_values(250))
+      results = store.insert_many(values, chunk_size=100)
+
+      assert len(set(results)) == 250
+
+      for val, pair in zip(values, results):
+         assert store[pair.key] == val
+         assert store.has_token(pair.token)
+
+   def test_insert_many_reports_errors(self):
+      store = shorten.MemcacheStore(
+            memcache_client=self.mc,
+            key_gen=shorten.MemoryKeygen(start=0, alphabet=self.alphabet),
+            token_gen=shorten.UUIDTokenGenerator(),
+            formatter=self.formatter)
+
+      # The first key exists, and the second key's token will clash
+      self.mc.set(self.formatter.format_key('0'), ('bonobo', 'token'))
+      store.token_gen = TokenFromList(['token-1', 'existing', 'token-3'])
+      self.mc.set(self.formatter.format_token('existing'), 'other')
+
+      results = store.insert_many(['caiman', 'degu', 'elk'])
+
+      assert isinstance(results[0], shorten.KeyInsertError)
+      assert isinstance(results[1], shorten.TokenInsertError)
+      assert store[results[2].key] == 'elk'
+
+      # The key record of the failed token was removed
+      assert '1' not in store
+      assert store['0'] == 'bonobo'
+
+   def test_get_many(self):
+      store = self.get_store()
+      pairs = store.insert_many(['aardvark', 'bonobo', 'caiman'])
+      keys = [pairs[0].key, 'missing', pairs[2].key, pairs[1].key]
+
+      assert store.get_many(keys) == ['aardvark', None, 'caiman', 'bonobo']
+      assert store.get_many(['missing'], default=False) == [False]
+      assert store.get_many([]) == []
+
+   def test_revoke_many(self):
+      store = self.get_store()
+      pairs = store.insert_many(['aardvark', 'bonobo'])
+      tokens = [pairs[0].token, 'missing', pairs[1].token]
+
+      results = store.revoke_many(tokens)
+
+      assert results[0] is None and results[2] is None
+      assert isinstance(results[1], shorten.RevokeError)
+
+      for pair in pairs:
+         assert pair.key not in store
+         assert not store.has_token(pair.token)
+
+   def make_counted_store(self, **kwargs):
+      client = CountingClient(self.mc)
+      store = shorten.MemcacheStore(
+            memcache_client=client,
+            key_gen=shorten.MemoryKeygen(start=0, alphabet=self.alphabet),
+            token_gen=shorten.UUIDTokenGenerator(),
+            formatter=self.formatter,
+            **kwargs)
+
+      return store, client
+
+   def test_insert_round_trips(self):
+      store, client = self.make_counted_store()
+      store.insert('aardvark')
+
+      assert client.calls == ['get_multi', 'add', 'add']
+
+      client.calls = []
+      store.fast = True
+      store.insert('bonobo')
+
+      assert client.calls == ['add', 'add']
+
+   def test_revoke_round_trips(self):
+      store, client = self.make_counted_store()
+      key, token = store.insert('aardvark')
+
+      client.calls = []
+      store.revoke(token)
+
+      assert client.calls == ['get', 'delete_multi']
+      assert key not in store
+
+   def test_revoke_missing_token(self):
+      store = self.get_store()
+      nose.tools.assert_raises(shorten.RevokeError, store.revoke, 'missing')
+
+   def test_get_token_missing_key(self):
+      store = self.get_store()
+      nose.tools.assert_raises(KeyError, store.get_token, 'missing')
+
+   def test_fast_insert_rolls_back_key(self):
+      store, client = self.make_counted_store(fast=True)
+      store.token_gen = TokenFromList(['existing'])
+      self.mc.set(self.formatter.format_token('existing'), 'other')
+
+      nose.tools.assert_raises(shorten.TokenInsertError, store.insert, 
+         'aardvark')
+
+      assert '0' not in store
+
+   def test_next_n_reserves_range(self):
+      store = self.get_store()
+      keys = store.next_keys(100)
+
+      assert len(set(keys)) == 100
+      assert int(self.mc.get(COUNTER_KEY)) == 100
+
+class TestLeasedMemcacheStore(TestMemcacheStore):
+   @classmethod
+   def make_store(cls):      
+      store = shorten.MemcacheStore(
+            memcache_client=cls.mc,
+            counter_key=COUNTER_KEY,
+            token_gen=cls.token_gen, 
+            formatter=cls.formatter, 
+            start=0,
+            alphabet=cls.alphabet,
+            lease_size=10,
+            max_lease_size=100)
+
+      return store
+
+   def test_lease_reserves_block(self):
+      store = self.get_store()
+      store.insert('aardvark')
+
+      assert int(self.mc.get(COUNTER_KEY)) == 10
+
+   def test_counter_recovers_past_high_key(self):
+      keygen = shorten.MemcacheKeygen(memcache_client=self.mc,
+         counter_key=COUNTER_KEY, start=0, high_gap=5)
+      keys = iter(keygen)
+
+      [next(keys) for i in range(0, 3)]
+      self.mc.delete(COUNTER_KEY)
+
+      # The mark is the next multiple of the gap
+      assert int(self.mc.get(keygen.high_key)) == 5
+      assert next(keys) == keygen.encode(5 + 5)
+
+   def test_counter_recovers_past_lost_high_key(self):
+      keygen = shorten.MemcacheKeygen(memcache_client=self.mc,
+         counter_key=COUNTER_KEY, start=0, high_gap=5)
+      keys = iter(keygen)
+
+      [next(keys) for i in range(0, 7)]
+
+      # A restart loses both the counter and the mark
       self.mc.flush_all()
 
+      assert next(keys) == keygen.encode(10 + 5)
+
+   def test_high_key_written_once_per_gap(self):
+      client = CountingClient(self.mc)
+      keygen = shorten.MemcacheKeygen(memcache_client=self.mc,
+         high_client=client, counter_key=COUNTER_KEY, start=0, high_gap=10)
+      keys = iter(keygen)
+
+      [next(keys) for i in range(0, 25)]
+
+      # The mark is read once, to create the counter
+      assert client.calls == ['get', 'set', 'set', 'set']
+      assert int(self.mc.get(keygen.high_key)) == 30
+
+   def test_store_passes_high_client(self):
+      client = CountingClient(self.mc)
+      store = shorten.MemcacheStore(memcache_client=self.mc,
+         counter_key=COUNTER_KEY, formatter=self.formatter, 
+         high_client=client, high_gap=100)
+
+      store.insert('aardvark')
+
+      assert client.calls == ['get', 'set']
+      assert int(self.mc.get(store._keygen.high_key)) == 100
+
+   def test_failed_increment_does_not_end_keys(self):
+      keygen = shorten.MemcacheKeygen(memcache_client=self.mc,
+         counter_key=COUNTER_KEY, start=0)
+      keys = iter(keygen)
+      incr = keygen._incr
+
+      def fail(counter_key, count):
+         raise shorten.KeyInsertError(counter_key, 'counter could not be stored')
+
+      keygen._incr = fail
+      nose.tools.assert_raises(shorten.KeyInsertError, next, keys)
+
+      keygen._incr = incr
+      assert next(keys) == keygen.encode(0)
+
+class TestStripedMemcacheStore(TestMemcacheStore):
+   @classmethod
+   def make_store(cls):      
+      store = shorten.MemcacheStore(
+            memcache_client=cls.mc,
+            counter_key=COUNTER_KEY,
+            token_gen=cls.token_gen, 
+            formatter=cls.formatter, 
+            start=0,
+            alphabet=cls.alphabet,
+            stripes=4)
+
+      return store
+
+   def test_next_n_reserves_range(self):
+      store = self.get_store()
+      keys = store.next_keys(100)
+
+      assert len(set(keys)) == 100
+      assert int(self.mc.get(COUNTER_KEY + ':0')) == 100
+
+   def test_stripes_are_disjoint(self):
+      keygens = [shorten.MemcacheKeygen(memcache_client=self.mc, 
+         counter_key=COUNTER_KEY, start=0, stripes=3, stripe=i) 
+         for i in range(0, 3)]
+
+      for stripe, keygen in enumerate(keygens):
+         keys = iter(keygen)
+         values = [keygen.decode(next(keys)) for i in range(0, 10)]
+         assert values == list(range(stripe, 30, 3))
+
+class TestFastMemcacheStore(TestMemcacheStore):
+   @classmethod
+   def make_store(cls):
+      store = shorten.MemcacheStore(
+            memcache_client=cls.mc,
+            counter_key=COUNTER_KEY,
+            token_gen=cls.token_gen,
+            formatter=cls.formatter,
+            start=0,
+            alphabet=cls.alphabet,
+            fast=True)
+
+      return store
+
+class TestMemcacheRingStore(TestMemcacheStore):
+   @classmethod
+   def setup_class(cls):
+      super(TestMemcacheRingStore, cls).setup_class()
+
+      # Every node is the same server, so records can be checked directly
+      cls.clients = dict(('mc{0}'.format(i), pylibmc.Client(['127.0.0.1'],
+         binary=True)) for i in range(0, 3))
+
+   @classmethod
+   def make_store(cls):
+      store = shorten.MemcacheRingStore(
+            memcache_clients=cls.clients,
+            counter_key=COUNTER_KEY,
+            token_gen=cls.token_gen,
+            formatter=cls.formatter,
+            start=0,
+            alphabet=cls.alphabet)
+
+      return store
+
+   def test_key_and_token_share_a_node(self):
+      store = self.get_store()
+      key, token = store.insert('aardvark')
+
+      assert key == token
+      assert store.ring.node_for(self.formatter.format_key(key)) == \
+         store.ring.node_for(self.formatter.format_token(token))
+
+   def test_records_are_spread(self):
+      store = self.get_store()
+      pairs = store.insert_many(list(self.make_some_values(100)))
+
+      nodes = set(store.ring.node_for(self.formatter.format_key(pair.key))
+         for pair in pairs)
+
+      assert len(nodes) == 3
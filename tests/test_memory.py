@@ -8,3 +8,555 @@
 #      store = MemoryStore(alphabet=alphabet)
 #      return store
 
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+from itertools import islice
+
+import shorten
+from common import wait_until
+
+def take(keygen, n):
+   return list(islice(iter(keygen), 0, n))
+
+def test_odometer_matches_counter():
+   for alphabet in ('ab', '0123456789abcdef', None):
+      for kwargs in (dict(start=0), dict(start=12345), dict(min_length=3)):
+         counter = shorten.MemoryKeygen(alphabet=alphabet, **kwargs)
+         odometer = shorten.MemoryKeygen(alphabet=alphabet, odometer=True, 
+            **kwargs)
+
+         assert take(counter, 5000) == take(odometer, 5000)
+
+def test_odometer_carries():
+   keygen = shorten.MemoryKeygen(alphabet='01', start=6, odometer=True)
+   assert take(keygen, 4) == ['110', '111', '1000', '1001']
+
+def test_iterators_share_counter():
+   keygen = shorten.MemoryKeygen(alphabet='0123456789', start=0)
+   first, second = iter(keygen), iter(keygen)
+
+   # Iterators used to restart at `start`
+   assert [next(first), next(second), next(first)] == ['0', '1', '2']
+
+   keygen = shorten.MemoryKeygen(alphabet='0123456789', start=0, 
+      odometer=True)
+   first, second = iter(keygen), iter(keygen)
+   keys = [next(first), next(second), next(first), next(second)]
+
+   assert len(set(keys)) == 4
+
+def test_next_n_shares_counter():
+   keygen = shorten.MemoryKeygen(alphabet='0123456789', start=0)
+   keys = iter(keygen)
+
+   assert [next(keys), next(keys)] == ['0', '1']
+   assert keygen.next_n(3) == ['2', '3', '4']
+   assert next(keys) == '5'
+
+def test_odometer_reserves_blocks():
+   block = shorten.memory_store.ODOMETER_BLOCK
+   keygen = shorten.MemoryKeygen(start=0, odometer=True)
+   keys = iter(keygen)
+
+   first = [next(keys), next(keys)]
+
+   # Taken after the iterator's block
+   assert keygen.next_n(3) == [keygen.encode(i) 
+      for i in range(block, block + 3)]
+
+   rest = [next(keys) for i in range(2, block + 1)]
+
+   assert first + rest[:-1] == [keygen.encode(i) for i in range(0, block)]
+   assert rest[-1] == keygen.encode(block + 3)
+
+def test_store_next_keys():
+   store = shorten.MemoryStore(alphabet='0123456789', start=8)
+
+   assert store.next_keys(3) == ['8', '9', '10']
+   assert store.insert('aardvark').key == '11'
+
+def make_expiring_store():
+   now = [0]
+   store = shorten.MemoryStore(alphabet='0123456789', start=0, 
+      clock=lambda: now[0])
+
+   return store, now
+
+def test_insert_with_ttl():
+   store, now = make_expiring_store()
+   key, token = store.insert('aardvark', ttl=10)
+   forever = store.insert('bonobo')
+
+   now[0] = 9.9
+   assert store[key] == 'aardvark'
+
+   now[0] = 10
+   assert key not in store
+   assert not store.has_token(token)
+   assert store[forever.key] == 'bonobo'
+   assert len(store) == 1
+
+def test_revoke_before_expiry():
+   store, now = make_expiring_store()
+   key, token = store.insert('aardvark', ttl=10)
+   store.revoke(token)
+
+   now[0] = 10
+   assert len(store) == 0
+   assert not store._expiries
+
+def test_expiry_heap_skips_reused_keys():
+   store, now = make_expiring_store()
+   key, token = store.insert('aardvark', ttl=5)
+   store.revoke(token)
+
+   # Reinsert the same key without a TTL
+   store._data[store.format_key(key)] = ('bonobo', token)
+   store._tokens[store.format_token(token)] = key
+
+   now[0] = 5
+   assert store[key] == 'bonobo'
+
+def test_invalid_ttl():
+   store, now = make_expiring_store()
+
+   for ttl in (0, -1):
+      try:
+         store.insert('aardvark', ttl=ttl)
+      except ValueError:
+         pass
+      else:
+         assert False, 'ttl {0} was accepted'.format(ttl)
+
+class SuffixTokens(object):
+   def create_token(self, key):
+      return key + '!'
+
+def test_dense_matches_memory_store():
+   for token_gen in (None, SuffixTokens()):
+      dense = shorten.DenseMemoryStore(alphabet='0123456789', start=5,
+         token_gen=token_gen)
+      baseline = shorten.MemoryStore(alphabet='0123456789', start=5,
+         token_gen=token_gen)
+
+      pairs = [(dense.insert(i), baseline.insert(i)) for i in range(0, 50)]
+
+      for (pair, expected) in pairs[::3]:
+         dense.revoke(pair.token)
+         baseline.revoke(expected.token)
+
+      for (pair, expected) in pairs:
+         assert pair == expected
+         assert dense.has_key(pair.key) == baseline.has_key(pair.key)
+         assert dense.has_token(pair.token) == baseline.has_token(pair.token)
+         assert dense.get(pair.key) == baseline.get(pair.key)
+
+      assert len(dense) == len(baseline)
+      assert sorted(dense) == sorted(baseline)
+
+def test_dense_tombstones():
+   store = shorten.DenseMemoryStore(alphabet='0123456789', start=0)
+   key, token = store.insert('aardvark')
+   store.revoke(token)
+
+   assert key not in store
+   assert store._values[0] is shorten.memory_store._TOMBSTONE
+
+   try:
+      store.revoke(token)
+   except shorten.RevokeError:
+      pass
+   else:
+      assert False, 'a tombstoned token was revoked twice'
+
+   # Slots are not reused
+   assert store.insert('bonobo').key == '1'
+
+def test_dense_missing_keys():
+   store = shorten.DenseMemoryStore(alphabet='0123456789', start=10)
+   store.insert('aardvark')
+
+   for key in ('9', '010', '11', 'x', '', None):
+      assert key not in store
+      assert not store.has_token(key)
+
+   assert store['10'] == 'aardvark'
+
+def test_dense_key_lengths():
+   for alphabet in ('0123456789', '01', ('x', 'yy', 'zzz')):
+      store = shorten.DenseMemoryStore(alphabet=alphabet, start=0)
+      keygen = store._keygen
+
+      # Keys of up to seven digits, decoded with and without the cache
+      for value in (0, 1, 9, 10, 99, 100, 1000, 10000, 123456, 1000000):
+         key = keygen.encode(value)
+         assert key not in store
+
+         keygen.advance(value)
+         assert store.insert(value).key == key
+
+         for i in range(0, 2):
+            assert store[key] == value
+
+def test_dense_slot_cache():
+   store = shorten.DenseMemoryStore(alphabet='0123456789', start=0)
+   size = shorten.memory_store.SLOT_CACHE_SIZE
+
+   # Missing keys are not cached, since the store may grow to them
+   assert '5' not in store
+   assert '5' not in store._slot_cache
+
+   pairs = [store.insert(i) for i in range(0, size + 10)]
+
+   for key, token in pairs:
+      assert store[key] == int(key)
+
+   assert len(store._slot_cache) <= size
+   assert store._slot_cache[pairs[-1].key] == size + 9
+
+def test_dense_expiry():
+   now = [0]
+   store = shorten.DenseMemoryStore(alphabet='0123456789', start=0,
+      clock=lambda: now[0])
+
+   key, token = store.insert('aardvark', ttl=10)
+   store.insert('bonobo')
+
+   now[0] = 10
+   assert key not in store
+   assert len(store) == 1
+
+class TestJournal(object):
+   def setup_method(self, method=None):
+      self.path = tempfile.mkdtemp()
+
+   def teardown_method(self, method=None):
+      shutil.rmtree(self.path)
+
+   # nose only runs setUp and tearDown
+   setUp = setup_method
+   tearDown = teardown_method
+
+   def make_store(self, cls=shorten.MemoryStore, spawn=None, **kwargs):
+      journal = shorten.Journal(self.path, **kwargs)
+      return cls(alphabet='0123456789', start=0, journal=journal, 
+         spawn=spawn)
+
+   def test_recover_log(self):
+      store = self.make_store()
+      pairs = [store.insert(i) for i in range(0, 10)]
+      store.revoke(pairs[3].token)
+      store.close()
+
+      store = self.make_store()
+
+      assert len(store) == 9
+      assert pairs[3].key not in store
+      assert store[pairs[5].key] == 5
+      assert store.insert('aardvark').key == '10'
+
+   def test_recover_snapshot(self):
+      store = self.make_store(snapshot_records=4)
+      pairs = [store.insert(i) for i in range(0, 10)]
+      store.revoke(pairs[9].token)
+
+      # Written in the background
+      wait_until(lambda: 'snapshot' in os.listdir(self.path))
+      store.close()
+
+      names = os.listdir(self.path)
+      assert 'snapshot' in names
+      assert len([name for name in names if name.startswith('log.')]) == 1
+
+      store = self.make_store()
+
+      assert sorted(store) == [pair.key for pair in pairs[:9]]
+
+      # The revoked key is not reused
+      assert store.insert('aardvark').key == '10'
+
+   def test_inserts_do_not_write_snapshots(self):
+      workers = []
+      store = self.make_store(spawn=workers.append, snapshot_records=4)
+
+      for i in range(0, 10):
+         store.insert(i)
+
+      assert len(workers) == 1
+      assert store.journal.snapshot_due
+      assert 'snapshot' not in os.listdir(self.path)
+
+      store.snapshot()
+      store.close()
+
+      assert 'snapshot' in os.listdir(self.path)
+      assert len(self.make_store()) == 10
+
+   def test_snapshot_covers_racing_inserts(self):
+      store = self.make_store(snapshot_records=None)
+
+      for i in range(0, 9):
+         store.insert(i)
+
+      write_snapshot = store.journal.write_snapshot
+
+      # Inserted and revoked while the snapshot starts
+      def racing_write_snapshot(records, next_value=None):
+         store.revoke(store.insert('aardvark').token)
+         return write_snapshot(records, next_value)
+
+      store.journal.write_snapshot = racing_write_snapshot
+      store.snapshot()
+      store.close()
+
+      store = self.make_store()
+
+      # The revoked key is not reused
+      assert store.insert('bonobo').key == '10'
+
+   def test_gevent_snapshots(self):
+      import gevent
+
+      journal = shorten.Journal(self.path, snapshot_records=4, 
+         runtime='gevent')
+      store = shorten.MemoryStore(alphabet='0123456789', start=0, 
+         journal=journal, runtime='gevent')
+
+      for i in range(0, 10):
+         store.insert(i)
+
+      wait_until(lambda: 'snapshot' in os.listdir(self.path), 
+         sleep=gevent.sleep)
+      store.close()
+
+      assert len(self.make_store()) == 10
+
+   def test_snapshot_after_close(self):
+      store = self.make_store()
+      store.close()
+
+      try:
+         store.snapshot()
+      except ValueError:
+         pass
+      else:
+         assert False, 'a closed store wrote a snapshot'
+
+   def test_recover_dense_store(self):
+      store = self.make_store(cls=shorten.DenseMemoryStore)
+      pairs = [store.insert(i) for i in range(0, 10)]
+      store.snapshot()
+      store.revoke(pairs[0].token)
+      store.close()
+
+      store = self.make_store(cls=shorten.DenseMemoryStore)
+
+      assert len(store) == 9
+      assert store.get_token(pairs[1].key) == pairs[1].token
+      assert store.insert('aardvark').key == '10'
+
+   def test_recover_expiry(self):
+      store = self.make_store()
+      key, token = store.insert('aardvark', ttl=60)
+      store.close()
+
+      store = self.make_store()
+      assert store._expiries[key] > time.time()
+
+   def test_torn_log_tail(self):
+      store = self.make_store()
+      pairs = [store.insert(i) for i in range(0, 3)]
+      store.close()
+
+      log = os.path.join(self.path, sorted(os.listdir(self.path))[-1])
+
+      with open(log, 'rb+') as f:
+         f.truncate(os.path.getsize(log) - 1)
+
+      store = self.make_store()
+
+      assert sorted(store) == ['0', '1']
+      assert store.insert('aardvark').key == '2'
+
+   def test_group_commit(self):
+      journal = shorten.Journal(self.path)
+      journal.replay()
+      journal.open()
+
+      def log():
+         for i in range(0, 25):
+            journal.commit(journal.append(('r', str(i), str(i))))
+
+      threads = [threading.Thread(target=log) for i in range(0, 8)]
+
+      for thread in threads:
+         thread.start()
+
+      for thread in threads:
+         thread.join()
+
+      assert journal.syncs <= 200
+      journal.close()
+
+      assert len(list(shorten.Journal(self.path).replay())) == 200
+
+   def test_threaded_inserts(self):
+      store = self.make_store(snapshot_records=50)
+      revoked = []
+
+      def insert():
+         for i in range(0, 25):
+            key, token = store.insert(i)
+
+            if i % 5 == 0:
+               store.revoke(token)
+               revoked.append(key)
+
+      threads = [threading.Thread(target=insert) for i in range(0, 8)]
+
+      for thread in threads:
+         thread.start()
+
+      for thread in threads:
+         thread.join()
+
+      expected = sorted(store)
+      store.close()
+
+      store = self.make_store()
+
+      assert len(expected) == 160
+      assert sorted(store) == expected
+      assert not set(revoked) & set(store)
+      assert store.insert('aardvark').key == '200'
+
+def run_threads(target, n=8):
+   threads = [threading.Thread(target=target) for i in range(0, n)]
+
+   for thread in threads:
+      thread.start()
+
+   for thread in threads:
+      thread.join()
+
+def test_threaded_inserts_and_revokes():
+   for cls in (shorten.MemoryStore, shorten.DenseMemoryStore):
+      store = cls(alphabet='0123456789', start=0, stripes=4)
+      pairs = []
+
+      def insert_revoke():
+         for i in range(0, 500):
+            pair = store.insert(i)
+            pairs.append(pair)
+
+            if i % 2:
+               store.revoke(pair.token)
+
+      run_threads(insert_revoke)
+
+      assert len(set(pairs)) == 4000
+      assert len(store) == 2000
+      assert len(list(store)) == 2000
+
+def test_threaded_revokes_of_one_token():
+   store = shorten.MemoryStore()
+   key, token = store.insert('aardvark')
+   revoked = []
+
+   def revoke():
+      try:
+         store.revoke(token)
+      except shorten.RevokeError:
+         pass
+      else:
+         revoked.append(token)
+
+   run_threads(revoke)
+
+   assert revoked == [token]
+   assert len(store) == 0
+
+def test_evict_max_entries():
+   store = shorten.MemoryStore(alphabet='0123456789', start=0, max_entries=2,
+      token_gen=SuffixTokens())
+
+   a, b, c = [store.insert(val) for val in ('aardvark', 'bonobo', 'caribou')]
+
+   assert len(store) == 2
+   assert store.evictions == 1
+   assert a.key not in store
+   assert not store.has_token(a.token)
+   assert store[b.key] == 'bonobo' and store[c.key] == 'caribou'
+
+def test_evict_skips_referenced():
+   store = shorten.MemoryStore(alphabet='0123456789', start=0, max_entries=3)
+   a, b, c = [store.insert(val) for val in ('aardvark', 'bonobo', 'caribou')]
+
+   # `a` gets a second chance
+   store.get_value(a.key)
+   store.insert('dingo')
+
+   assert a.key in store
+   assert b.key not in store
+
+def test_evict_max_bytes():
+   store = shorten.MemoryStore(alphabet='0123456789', start=0, max_bytes=10,
+      sizeof=len)
+
+   a, b = store.insert('aaaaa'), store.insert('bbbbb')
+   assert store.evictions == 0
+
+   c = store.insert('cc')
+
+   assert store.evictions == 1
+   assert a.key not in store
+   assert store._bytes == 7
+
+def test_evict_reuses_slots():
+   store = shorten.MemoryStore(max_entries=10)
+
+   for i in range(0, 100):
+      store.insert(i)
+
+   key, token = store.insert('aardvark')
+   store.revoke(token)
+
+   assert len(store) == 9
+   assert store.evictions == 91
+   assert len(store._slot_keys) == 11
+
+def test_evict_threads():
+   store = shorten.MemoryStore(max_entries=50, stripes=4)
+
+   def insert():
+      for i in range(0, 200):
+         store.get(store.insert(i).key)
+
+   run_threads(insert)
+
+   assert len(store) == 50
+   assert store.evictions == 1550
+
+def test_dense_cannot_be_bounded():
+   try:
+      shorten.DenseMemoryStore(max_entries=10)
+   except ValueError:
+      pass
+   else:
+      assert False, 'a dense store was bounded'
+
+def test_dense_rejects_scrambled_keys():
+   keygen = shorten.ScrambledKeygen(shorten.MemoryKeygen(start=0), 
+      secret='x', width=4)
+
+   try:
+      shorten.DenseMemoryStore(key_gen=keygen)
+   except ValueError:
+      pass
+   else:
+      assert False, 'a dense store accepted scrambled keys'
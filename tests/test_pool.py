@@ -0,0 +1,78 @@
+import gevent
+import nose
+
+import shorten
+from shorten import KeyPool, MemoryKeygen, UUIDTokenGenerator
+from common import wait_until
+
+class FailingKeygen(MemoryKeygen):
+   def next_n(self, n):
+      raise IOError('backend is down')
+
+def test_pool_keys_are_sequential():
+   pool = KeyPool(MemoryKeygen(alphabet='0123456789', start=0), size=10)
+   keys = iter(pool)
+
+   assert [next(keys) for i in range(0, 25)] == [str(i) for i in range(0, 25)]
+   pool.close()
+
+def test_pool_prefetches_tokens():
+   pool = KeyPool(MemoryKeygen(start=0), token_gen=UUIDTokenGenerator(), 
+      size=10)
+   store = shorten.MemoryStore(key_gen=pool, token_gen=pool)
+
+   pairs = [store.insert('aardvark') for i in range(0, 50)]
+   pool.close()
+
+   assert len(set(pair.token for pair in pairs)) == 50
+   assert not pool._tokens
+
+   for key, token in pairs:
+      assert store.get_token(key) == token
+
+def wait_for_refills(pool, refills):
+   wait_until(lambda: pool.refills >= refills)
+
+def test_pool_metrics():
+   pool = KeyPool(MemoryKeygen(start=0), size=100, low_water=10)
+   wait_for_refills(pool, 1)
+
+   assert pool.fill_level == 1.0
+   assert pool.refills == 1
+
+   # The pool only reaches its low water mark on the last key taken, so 
+   # the refill starts once every key has been taken
+   pool.next_n(90)
+   wait_for_refills(pool, 2)
+
+   assert pool.fill_level == 1.0
+   assert pool.misses == 0
+   assert len(pool.close()) == 100
+
+def test_pool_gevent_runtime():
+   pool = KeyPool(MemoryKeygen(alphabet='0123456789', start=0), size=10,
+      runtime='gevent')
+   keys = iter(pool)
+
+   # Waits for the worker greenlet without monkey-patching
+   assert [next(keys) for i in range(0, 25)] == [str(i) for i in range(0, 25)]
+   assert isinstance(pool._worker, gevent.Greenlet)
+
+   pool.close()
+
+def test_pool_close_drains():
+   pool = KeyPool(MemoryKeygen(alphabet='0123456789', start=0), size=10)
+   next(iter(pool))
+
+   unused = pool.close()
+
+   assert unused[0] == ('1', '1')
+   assert len(pool) == 0
+   assert list(pool) == []
+   nose.tools.assert_raises(ValueError, lambda: pool.next_n(1))
+
+def test_pool_raises_keygen_errors():
+   pool = KeyPool(FailingKeygen(), size=10, retry_interval=0.01)
+
+   nose.tools.assert_raises(IOError, lambda: next(iter(pool)))
+   pool.close()
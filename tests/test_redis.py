@@ -1,8 +1,10 @@
+import time
+
 import redis
 import nose
 
 import shorten
-from common import BaseStoreTest, GeventTestMixin
+from common import BaseStoreTest, GeventTestMixin, wrap_next_formatted_pair
 
 NAMESPACE = 'shorten:nose_tests'
 COUNTER_KEY = 'shorten:nose_tests:counter'
@@ -47,7 +49,7 @@ class TestRedisStore(BaseStoreTest, GeventTestMixin):
 
    @classmethod
    def setup_class(cls):
-      cls.redis = redis.StrictRedis()
+      cls.redis = redis.StrictRedis(decode_responses=True)
 
    @classmethod
    def teardown_class(cls):
@@ -77,9 +79,16 @@ class TestRedisStore(BaseStoreTest, GeventTestMixin):
 
       return store
 
-   def tearDown(self):
+   def setup_method(self, method=None):
+      clear_redis(self.redis)
+
+   def teardown_method(self, method=None):
       clear_redis(self.redis)
 
+   # nose only runs setUp and tearDown
+   setUp = setup_method
+   tearDown = teardown_method
+
    def test_formatted_key_inserted_into_redis(self):
       store = self.get_store()      
       key, token = store.insert('aardvark')      
@@ -89,3 +98,437 @@ class TestRedisStore(BaseStoreTest, GeventTestMixin):
 
       assert redis_val == 'aardvark'   
 
+   def test_next_n_reserves_range(self):
+      store = self.get_store()
+      keys = store.next_keys(100)
+
+      assert len(set(keys)) == 100
+      assert int(self.redis.get(COUNTER_KEY)) == 100
+
+   def test_insert_many_batch(self):
+      store = self.get_store()
+
+      values = list(self.make_some_values(250))
+      results = store.insert_many(values, chunk_size=100)
+
+      assert len(set(results)) == 250
+
+      for val, pair in zip(values, results):
+         assert store[pair.key] == val
+         assert store.has_token(pair.token)
+
+   def test_insert_many_reports_errors(self):
+      store = shorten.RedisStore(
+            redis_client=self.redis,
+            key_gen=shorten.MemoryKeygen(start=0, alphabet=self.alphabet),
+            token_gen=self.token_gen, 
+            formatter=self.formatter)
+
+      # Make the first key exist already
+      self.redis.hset(self.formatter.format_key('0'), 'value', 'bonobo')
+
+      results = store.insert_many(['caiman', 'degu', 'elk'])
+
+      assert isinstance(results[0], shorten.KeyInsertError)
+      assert store[results[1].key] == 'degu'
+      assert store[results[2].key] == 'elk'
+
+   def test_get_many(self):
+      store = self.get_store()
+      pairs = store.insert_many(['aardvark', 'bonobo', 'caiman'])
+      keys = [pairs[0].key, 'missing', pairs[2].key, pairs[1].key]
+
+      assert store.get_many(keys, chunk_size=2) == \
+         ['aardvark', None, 'caiman', 'bonobo']
+
+      assert store.get_many(['missing'], default=False) == [False]
+      assert store.get_many([]) == []
+
+   def test_has_keys(self):
+      store = self.get_store()
+      pairs = store.insert_many(['aardvark', 'bonobo'])
+      keys = [pairs[0].key, 'missing', pairs[1].key]
+
+      assert store.has_keys(keys, chunk_size=2) == [True, False, True]
+
+   def test_insert_with_ttl(self):
+      store = self.get_store()
+      key, token = store.insert('aardvark', ttl=10)
+
+      for name in (self.formatter.format_key(key), 
+            self.formatter.format_token(token)):
+         assert 0 < self.redis.pttl(name) <= 10000
+
+      assert store[key] == 'aardvark'
+
+   def test_ttl_is_not_set_on_existing_keys(self):
+      store = self.get_store()
+      key, token = store.insert('aardvark')
+
+      wrap_next_formatted_pair(store, key, 'other')
+      nose.tools.assert_raises(shorten.KeyInsertError, store.insert, 
+         'bonobo', ttl=10)
+
+      assert self.redis.pttl(self.formatter.format_key(key)) < 0
+
+   def test_insert_many_with_ttl(self):
+      store = self.get_store()
+      pairs = store.insert_many(['aardvark', 'bonobo'], ttl=10)
+
+      for pair in pairs:
+         assert 0 < self.redis.pttl(self.formatter.format_key(pair.key)) 
+
+class TestLeasedRedisStore(TestRedisStore):
+   @classmethod
+   def make_store(cls):
+      store = shorten.RedisStore( 
+            redis_client=cls.redis, 
+            counter_key=COUNTER_KEY,
+            token_gen=cls.token_gen, 
+            formatter=cls.formatter, 
+            start=0,
+            alphabet=cls.alphabet,
+            lease_size=10,
+            max_lease_size=100)
+
+      return store
+
+   def test_lease_reserves_block(self):
+      store = self.get_store()
+      store.insert('aardvark')
+
+      assert int(self.redis.get(COUNTER_KEY)) == 10
+
+class TestStripedRedisStore(TestRedisStore):
+   @classmethod
+   def make_store(cls):
+      store = shorten.RedisStore( 
+            redis_client=cls.redis, 
+            counter_key=COUNTER_KEY,
+            token_gen=cls.token_gen, 
+            formatter=cls.formatter, 
+            start=0,
+            alphabet=cls.alphabet,
+            stripes=4)
+
+      return store
+
+   def test_next_n_reserves_range(self):
+      store = self.get_store()
+      keys = store.next_keys(100)
+
+      assert len(set(keys)) == 100
+      assert int(self.redis.get(COUNTER_KEY + ':0')) == 100
+
+   def test_stripes_are_disjoint(self):
+      keygens = [shorten.RedisKeygen(redis_client=self.redis, 
+         counter_key=COUNTER_KEY, start=0, stripes=3, stripe=i) 
+         for i in range(0, 3)]
+
+      for stripe, keygen in enumerate(keygens):
+         values = [keygen.decode(key) for key in keygen.next_n(10)]
+         assert values == list(range(stripe, 30, 3))
+
+      assert int(self.redis.get(COUNTER_KEY + ':1')) == 10
+
+class TestScriptedRedisStore(TestRedisStore):
+   @classmethod
+   def make_store(cls):
+      store = shorten.RedisStore( 
+            redis_client=cls.redis, 
+            counter_key=COUNTER_KEY,
+            token_gen=cls.token_gen, 
+            formatter=cls.formatter, 
+            start=0,
+            alphabet=cls.alphabet,
+            scripts=True)
+
+      return store
+
+   def test_revoke_missing_token(self):
+      store = self.get_store()
+      nose.tools.assert_raises(shorten.RevokeError, store.revoke, 'missing')
+
+   def test_failed_insert_stores_nothing(self):
+      store = self.get_store()
+      key, token = store.insert('aardvark')
+
+      wrap_next_formatted_pair(store, 'other', token)
+      nose.tools.assert_raises(shorten.TokenInsertError, store.insert, 'bonobo')
+
+      assert not store.has_key('other')
+
+   def test_scripts_require_affix_formatter(self):
+      class ReversingFormatter(object):
+         def format_key(self, key):
+            return key[::-1]
+
+         def format_token(self, token):
+            return token
+
+      nose.tools.assert_raises(ValueError, lambda: shorten.RedisStore(
+         redis_client=self.redis, counter_key=COUNTER_KEY, 
+         formatter=ReversingFormatter(), scripts=True))
+
+class TestBucketedRedisStore(TestRedisStore):
+   @classmethod
+   def make_store(cls):
+      store = shorten.BucketedRedisStore( 
+            redis_client=cls.redis, 
+            counter_key=COUNTER_KEY,
+            token_gen=cls.token_gen, 
+            formatter=cls.formatter, 
+            start=0,
+            alphabet=cls.alphabet,
+            bucket_size=10,
+            token_buckets=16)
+
+      return store
+
+   def test_formatted_key_inserted_into_redis(self):
+      store = self.get_store()
+      key, token = store.insert('aardvark')
+
+      packed = self.redis.hget(store.key_bucket(key), key)
+
+      assert packed == token + '\x00aardvark'
+      assert self.redis.hget(store.token_bucket(token), token) == key + '\x000'
+
+   def test_insert_existing_token(self):
+      store = self.get_store()
+      key, token = store.insert('aardvark')
+
+      # Bucketed keys must decode, so use an unused key rather than ''
+      wrap_next_formatted_pair(store, 'zzzz', token)
+      nose.tools.assert_raises(shorten.TokenInsertError, store.insert, 'bonobo')
+
+   def test_insert_with_ttl(self):
+      store = self.get_store()
+      nose.tools.assert_raises(ValueError, store.insert, 'aardvark', ttl=10)
+
+   def test_ttl_is_not_set_on_existing_keys(self):
+      pass
+
+   def test_insert_many_with_ttl(self):
+      store = self.get_store()
+      nose.tools.assert_raises(ValueError, store.insert_many, ['aardvark'],
+         ttl=10)
+
+   def test_keys_share_buckets(self):
+      store = self.get_store()
+      pairs = store.insert_many(['aardvark'] * 25)
+
+      buckets = set(store.key_bucket(pair.key) for pair in pairs)
+
+      assert len(buckets) == 3
+      assert all(self.redis.hlen(bucket) <= 10 for bucket in buckets)
+
+   def test_insert_many_reports_errors(self):
+      store = shorten.BucketedRedisStore(
+            redis_client=self.redis,
+            key_gen=shorten.MemoryKeygen(start=0, alphabet=self.alphabet),
+            token_gen=self.token_gen, 
+            formatter=self.formatter)
+
+      # Make the first key exist already
+      self.redis.hset(store.key_bucket('0'), '0', 'token\x00bonobo')
+
+      results = store.insert_many(['caiman', 'degu', 'elk'])
+
+      assert isinstance(results[0], shorten.KeyInsertError)
+      assert store[results[1].key] == 'degu'
+      assert store[results[2].key] == 'elk'
+
+   def test_revoke_missing_token(self):
+      store = self.get_store()
+      nose.tools.assert_raises(shorten.RevokeError, store.revoke, 'missing')
+
+   def test_revoke_with_pipe(self):
+      store = self.get_store()
+      key, token = store.insert('aardvark')
+
+      with self.redis.pipeline() as pipe:
+         store.revoke(token, pipe=pipe)
+         store.revoke('missing', pipe=pipe)
+
+         assert pipe.execute() == [1, 0]
+
+      assert not store.has_key(key)
+      assert not store.has_token(token)
+
+   def test_key_and_token_buckets_differ(self):
+      class SharedFormatter(object):
+         def format_key(self, key):
+            return '{0}:{1}'.format(NAMESPACE, key)
+
+         format_token = format_key
+
+      store = shorten.BucketedRedisStore(
+            redis_client=self.redis,
+            key_gen=shorten.MemoryKeygen(start=0, alphabet=self.alphabet),
+            token_gen=self.token_gen,
+            formatter=SharedFormatter(),
+            token_buckets=1)
+
+      key, token = store.insert('aardvark')
+
+      assert store.key_bucket(key) != store.token_bucket(token)
+      assert store[key] == 'aardvark'
+
+      store.revoke(token)
+
+      assert not store.has_key(key)
+      assert not store.has_token(token)
+
+   def test_bucket_prefixes_must_differ(self):
+      nose.tools.assert_raises(ValueError, lambda: shorten.BucketedRedisStore(
+         redis_client=self.redis, counter_key=COUNTER_KEY, 
+         key_bucket_prefix='buckets:', token_bucket_prefix='buckets:'))
+
+   def test_migrate_to_buckets(self):
+      source = shorten.RedisStore(
+            redis_client=self.redis,
+            counter_key=COUNTER_KEY,
+            token_gen=self.token_gen,
+            formatter=self.formatter,
+            start=0,
+            alphabet=self.alphabet)
+
+      pairs = source.insert_many(['aardvark', 'bonobo', 'caiman'])
+      target = self.get_store()
+
+      migrated = shorten.redis_store.migrate_to_buckets(source, target, 
+         chunk_size=2, delete=True)
+
+      assert migrated == 3
+      assert [target[pair.key] for pair in pairs] == \
+         ['aardvark', 'bonobo', 'caiman']
+
+      assert all(target.has_token(pair.token) for pair in pairs)
+      assert not any(source.has_key(pair.key) for pair in pairs)
+
+      # Nothing is left to migrate
+      assert shorten.redis_store.migrate_to_buckets(source, target) == 0
+
+class TestCachedRedisStore(TestRedisStore):
+   scripts = False
+
+   @classmethod
+   def make_store(cls):
+      store = shorten.RedisStore( 
+            redis_client=cls.redis, 
+            counter_key=COUNTER_KEY,
+            token_gen=cls.token_gen, 
+            formatter=cls.formatter, 
+            start=0,
+            alphabet=cls.alphabet,
+            scripts=cls.scripts,
+            cache_size=100,
+            invalidate=False)
+
+      return store
+
+   def test_cached_get_value(self):
+      store = self.get_store()
+      key, token = store.insert('aardvark')
+      formatted_key = self.formatter.format_key(key)
+
+      assert store[key] == 'aardvark'
+
+      # Served from the cache until invalidated
+      self.redis.delete(formatted_key)
+      assert store[key] == 'aardvark'
+      assert store.cache.hits == 1
+
+      store._invalidate_channel('__keyspace@0__:' + formatted_key)
+      nose.tools.assert_raises(KeyError, store.get_value, key)
+
+   def test_revoke_invalidates_cache(self):
+      store = self.get_store()
+      key, token = store.insert('aardvark')
+
+      assert store[key] == 'aardvark'
+      store.revoke(token)
+
+      nose.tools.assert_raises(KeyError, store.get_value, key)
+
+   def test_revoke_invalidates_after_delete(self):
+      store = self.get_store()
+      key, token = store.insert('aardvark')
+      formatted_key = self.formatter.format_key(key)
+      invalidate = store.cache.invalidate
+      deleted = []
+
+      def check_deleted(cached_key):
+         deleted.append(not self.redis.exists(formatted_key))
+         invalidate(cached_key)
+
+      assert store[key] == 'aardvark'
+
+      store.cache.invalidate = check_deleted
+      store.revoke(token)
+
+      assert deleted == [True]
+
+   def test_revoke_pipe_leaves_cache_to_caller(self):
+      store = self.get_store()
+      key, token = store.insert('aardvark')
+
+      assert store[key] == 'aardvark'
+
+      with self.redis.pipeline() as pipe:
+         revoked = store.revoke(token, pipe=pipe)
+         results = pipe.execute()
+
+      if self.scripts:
+         revoked = results[-1]
+
+      assert revoked == key
+      assert store[key] == 'aardvark'
+
+      store.uncache(revoked)
+      nose.tools.assert_raises(KeyError, store.get_value, key)
+
+   def test_cache_max_age(self):
+      store = self.get_store()
+      store.cache.clock = lambda: now[0]
+      now = [0]
+
+      key, token = store.insert('aardvark')
+      assert store[key] == 'aardvark'
+
+      self.redis.delete(self.formatter.format_key(key))
+      now[0] = store.cache.max_age
+
+      nose.tools.assert_raises(KeyError, store.get_value, key)
+
+   def test_keyspace_notifications_invalidate(self):
+      store = shorten.RedisStore(
+            redis_client=self.redis,
+            counter_key=COUNTER_KEY,
+            formatter=self.formatter,
+            cache_size=100)
+
+      key, token = store.insert('aardvark')
+      formatted_key = self.formatter.format_key(key)
+
+      # Wait for the subscription
+      other = '__keyspace@0__:' + self.formatter.format_key('other')
+
+      while not self.redis.publish(other, 'del'):
+         time.sleep(0.01)
+
+      assert store[key] == 'aardvark'
+      self.redis.publish('__keyspace@0__:' + formatted_key, 'del')
+
+      for i in range(0, 100):
+         if formatted_key not in store.cache:
+            break
+
+         time.sleep(0.01)
+
+      store.close()
+      assert formatted_key not in store.cache
+
+class TestScriptedCachedRedisStore(TestCachedRedisStore):
+   scripts = True
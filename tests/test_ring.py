@@ -0,0 +1,62 @@
+from shorten.ring import HashRing
+
+KEYS = ['key-{0}'.format(i) for i in range(0, 20000)]
+
+def assignments(ring):
+   return dict((key, ring.get_node(key)) for key in KEYS)
+
+def moved_fraction(before, after):
+   moved = sum(1 for key in KEYS if before[key] != after[key])
+   return moved / float(len(KEYS))
+
+def test_keys_are_spread_evenly():
+   ring = HashRing(['mc1', 'mc2', 'mc3', 'mc4'])
+   counts = {}
+
+   for node in assignments(ring).values():
+      counts[node] = counts.get(node, 0) + 1
+
+   assert sorted(counts) == ring.nodes
+
+   for count in counts.values():
+      assert 0.15 < count / float(len(KEYS)) < 0.35
+
+def test_adding_a_node_moves_one_nth():
+   ring = HashRing(['mc1', 'mc2', 'mc3', 'mc4'])
+   before = assignments(ring)
+
+   ring.add_node('mc5')
+   after = assignments(ring)
+
+   # Keys only move to the new node
+   assert all(after[key] in (before[key], 'mc5') for key in KEYS)
+   assert 0.1 < moved_fraction(before, after) < 0.3
+
+def test_removing_a_node_moves_one_nth():
+   ring = HashRing(['mc1', 'mc2', 'mc3', 'mc4', 'mc5'])
+   before = assignments(ring)
+
+   ring.remove_node('mc3')
+   after = assignments(ring)
+
+   # Only keys on the removed node move
+   assert all(after[key] == before[key] 
+      for key in KEYS if before[key] != 'mc3')
+
+   assert 0.1 < moved_fraction(before, after) < 0.3
+
+def test_rings_agree():
+   a = HashRing(['mc1', 'mc2', 'mc3'])
+   b = HashRing(['mc3', 'mc1', 'mc2'])
+
+   assert assignments(a) == assignments(b)
+
+def test_empty_ring():
+   ring = HashRing()
+
+   try:
+      ring.get_node('aardvark')
+   except ValueError:
+      pass
+   else:
+      assert False, 'an empty ring returned a node'
@@ -0,0 +1,47 @@
+import nose
+
+import shorten
+from shorten import ScrambledKeygen, MemoryKeygen, KeyInsertError
+from shorten.scramble import FeistelPermutation
+
+def test_permutation_is_bijective():
+   for a, b in [(1, 5), (3, 7), (16, 16)]:
+      perm = FeistelPermutation(a, b, 'secret')
+      image = [perm.permute(i) for i in range(0, a*b)]
+
+      assert sorted(image) == list(range(0, a*b))
+
+      for i in range(0, a*b):
+         assert perm.invert(perm.permute(i)) == i
+
+def test_permutation_depends_on_secret():
+   first = FeistelPermutation(64, 64, 'secret')
+   second = FeistelPermutation(64, 64, 'another secret')
+
+   assert [first.permute(i) for i in range(0, 10)] != \
+      [second.permute(i) for i in range(0, 10)]
+
+def test_permutation_domain():
+   perm = FeistelPermutation(4, 4, 'secret')
+
+   nose.tools.assert_raises(ValueError, lambda: perm.permute(16))
+   nose.tools.assert_raises(ValueError, lambda: FeistelPermutation(4, 4, 'secret', 
+      rounds=3))
+
+def test_scrambled_keys_decode():
+   keygen = ScrambledKeygen(MemoryKeygen(start=0), secret='secret', width=5)
+   store = shorten.MemoryStore(key_gen=keygen)
+
+   for i in range(0, 100):
+      key, token = store.insert('aardvark')
+
+      assert len(key) == 5
+      assert keygen.decode(key) == i
+
+def test_scrambled_keyspace_exhausted():
+   keygen = ScrambledKeygen(MemoryKeygen(alphabet='01', start=0), 
+      secret='secret', width=2)
+   keys = iter(keygen)
+
+   assert sorted([next(keys) for i in range(0, 4)]) == ['00', '01', '10', '11']
+   nose.tools.assert_raises(KeyInsertError, lambda: next(keys))
@@ -0,0 +1,65 @@
+import nose
+
+import shorten
+from shorten import SnowflakeKeygen
+
+class FakeClock(object):
+   def __init__(self, now):
+      self.now = now
+
+   def __call__(self):
+      return self.now
+
+def make_keygen(clock, **kwargs):
+   return SnowflakeKeygen(node_id=5, epoch=0, sequence_bits=2, clock=clock,
+      **kwargs)
+
+def test_parse():
+   clock = FakeClock(1000.0)
+   keygen = make_keygen(clock)
+   keys = iter(keygen)
+
+   assert keygen.parse(next(keys)) == (1000000, 5, 0)
+   assert keygen.parse(next(keys)) == (1000000, 5, 1)
+
+def test_clock_backwards():
+   clock = FakeClock(1000.0)
+   keygen = make_keygen(clock)
+   keys = iter(keygen)
+
+   seen = set([next(keys)])
+
+   # Go back in time and overflow the sequence several times
+   clock.now = 999.0
+   for i in range(0, 10):
+      seen.add(next(keys))
+
+   assert len(seen) == 11
+   assert keygen.clock_regressions == 10
+   assert keygen.parse(max(seen, key=keygen.decode))[0] == 1000002
+
+def test_unique_across_nodes():
+   clock = FakeClock(1000.0)
+   first = SnowflakeKeygen(node_id=1, epoch=0, clock=clock)
+   second = SnowflakeKeygen(node_id=2, epoch=0, clock=clock)
+
+   keys = set(first.next_n(100)) | set(second.next_n(100))
+   assert len(keys) == 200
+
+def test_sequence_overflow_waits():
+   keygen = SnowflakeKeygen(node_id=0, sequence_bits=1)
+   keys = keygen.next_n(20)
+
+   assert len(set(keys)) == 20
+   assert [keygen.decode(key) for key in keys] == \
+      sorted([keygen.decode(key) for key in keys])
+
+def test_invalid_node_id():
+   nose.tools.assert_raises(ValueError, lambda: SnowflakeKeygen())
+   nose.tools.assert_raises(ValueError, lambda: SnowflakeKeygen(node_id=1024))
+
+def test_store():
+   store = shorten.MemoryStore(key_gen=SnowflakeKeygen(node_id=1))
+   pairs = [store.insert('aardvark') for i in range(0, 100)]
+
+   assert len(set(pairs)) == 100
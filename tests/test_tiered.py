@@ -0,0 +1,164 @@
+import shorten
+
+class CountingStore(shorten.MemoryStore):
+   """\
+   Counts the lookups that reach the store.
+   """
+
+   def __init__(self, **kwargs):
+      super(CountingStore, self).__init__(**kwargs)
+      self.lookups = 0
+
+   def get_value(self, key):
+      self.lookups += 1
+      return super(CountingStore, self).get_value(key)
+
+class SuffixTokens(object):
+   def create_token(self, key):
+      return key + '!'
+
+def make_store(**kwargs):
+   now = [0]
+   backend = CountingStore(alphabet='0123456789', start=0, 
+      token_gen=SuffixTokens(), clock=lambda: now[0])
+
+   store = shorten.TieredStore(backend, clock=lambda: now[0], **kwargs)
+   return store, backend, now
+
+def test_insert_writes_through():
+   store, backend, now = make_store()
+   key, token = store.insert('aardvark')
+
+   assert store[key] == 'aardvark'
+   assert backend[key] == 'aardvark'
+   assert backend.lookups == 1
+   assert store.hits == 1 and store.misses == 0
+
+def test_read_through():
+   store, backend, now = make_store()
+   key, token = backend.insert('aardvark')
+
+   assert store[key] == 'aardvark'
+   assert store[key] == 'aardvark'
+
+   assert backend.lookups == 1
+   assert store.hit_ratio == 0.5
+   assert store.miss_ratio == 0.5
+
+def test_max_age():
+   store, backend, now = make_store(max_age=5)
+   key, token = store.insert('aardvark')
+
+   now[0] = 5
+   assert store[key] == 'aardvark'
+   assert backend.lookups == 1
+
+def test_negative_caching():
+   store, backend, now = make_store(negative_max_age=1)
+
+   for i in range(0, 3):
+      assert store.get('0') is None
+
+   assert backend.lookups == 1
+   assert store.hits == 2
+
+   now[0] = 1
+   assert '0' not in store
+   assert backend.lookups == 2
+
+def test_insert_invalidates_negative_entry():
+   store, backend, now = make_store()
+
+   assert '0' not in store
+
+   key, token = store.insert('aardvark')
+   assert key == '0'
+   assert store[key] == 'aardvark'
+
+def test_no_negative_caching():
+   store, backend, now = make_store(negative_max_age=None)
+
+   assert store.get('0') is None
+   assert store.get('0') is None
+   assert backend.lookups == 2
+
+def test_revoke_invalidates():
+   store, backend, now = make_store()
+   key, token = store.insert('aardvark')
+   other = store.insert('bonobo')
+
+   store.revoke(token)
+
+   assert key not in store
+   assert not backend.has_token(token)
+   assert len(store.cache) == 1
+
+def test_revoke_unknown_token_clears_cache():
+   store, backend, now = make_store()
+   key, token = backend.insert('aardvark')
+   other = store.insert('bonobo')
+
+   assert store[key] == 'aardvark'
+
+   store.revoke(token)
+
+   assert key not in store
+   assert store[other.key] == 'bonobo'
+
+def test_get_token_remembers_key():
+   store, backend, now = make_store()
+   key, token = backend.insert('aardvark')
+
+   assert store[key] == 'aardvark'
+   assert store.get_token(key) == token
+
+   store.revoke(token)
+
+   assert key not in store
+   assert len(store.cache) == 0
+
+def test_ttl_write_through():
+   store, backend, now = make_store(max_age=5)
+
+   short = store.insert('aardvark', ttl=1)
+   long = store.insert('bonobo', ttl=10)
+
+   assert store[short.key] == 'aardvark'
+   assert store[long.key] == 'bonobo'
+   assert backend.lookups == 0
+
+   now[0] = 1
+   assert short.key not in store
+   assert store[long.key] == 'bonobo'
+
+def test_ttl_read_through():
+   store, backend, now = make_store(max_age=5)
+   key, token = store.insert('reset-link', ttl=1)
+
+   # Read through after L1 lost the entry
+   store.cache.clear()
+   now[0] = 0.5
+   assert store[key] == 'reset-link'
+   assert backend.lookups == 1
+
+   now[0] = 1
+   assert key not in store
+   assert backend.lookups == 2
+
+def test_ttl_expired_pair_is_not_cached():
+   store, backend, now = make_store(max_age=5)
+   key, token = store.insert('reset-link', ttl=1)
+
+   store.cache.clear()
+   now[0] = 2
+
+   # L2 still has the pair, but it has expired
+   backend.clock = lambda: 0
+   assert store[key] == 'reset-link'
+   assert key not in store.cache
+
+def test_keys_come_from_backend():
+   store, backend, now = make_store()
+
+   assert store.next_keys(2) == ['0', '1']
+   assert store.insert('aardvark').key == '2'